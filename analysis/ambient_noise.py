@@ -0,0 +1,101 @@
+'''
+ambient_noise.py - calibrated band noise level of every transmission, without a dask Client
+
+The hydrophone data (kaooi.open_ooi_lf / open_ooi_bb, 40 minutes around the
+reception) is loaded a chunk of transmissions at a time, so memory is bound
+by --chunk_size and not by the length of the record. Every chunk gets the
+calibrated Welch PSD and band level of kb2ooi/ambient_noise.py. Writes to
+<data_directory>analysis/ambient_noise/:
+
+- levels.parquet : band level [dB re uPa^2/Hz] indexed by (node, transmission)
+- summary.json : count, mean, std and quantiles of every node, over the
+  transmissions with a level at every node of the band (levels_dataset)
+
+usage:
+    python analysis/ambient_noise.py [--chunk_size 200] [--bands lf bb]
+
+    # in a notebook
+    levels = ambient_noise.load_levels()
+    bb_f_avg = ambient_noise.levels_dataset(levels, 'bb')
+'''
+import os
+import sys
+import json
+import pathlib
+import argparse
+import numpy as np
+import pandas as pd
+import kaooi
+from tqdm import tqdm
+from dotenv import load_dotenv
+
+# make repository modules importable when run as a script
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent))
+from kb2ooi import ambient_noise, tracing
+
+
+def band_setup(band):
+    '''
+    band_setup - dataset, nodes, calibration [counts / reference unit] and reference of a band
+    '''
+    if band == 'lf':
+        # calibration in counts / Pa, levels re 1 uPa
+        return kaooi.open_ooi_lf(), ambient_noise.lf_nodes, ambient_noise.lf_calibration(), 1e-6
+    return kaooi.open_ooi_bb(), ambient_noise.bb_nodes, ambient_noise.bb_calib, 1
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Calibrated band noise levels of every transmission')
+    parser.add_argument('--bands', type=str, nargs='+', default=['lf', 'bb'], choices=['lf', 'bb'])
+    parser.add_argument('--chunk_size', type=int, default=200, help='transmissions loaded at a time')
+    args = parser.parse_args()
+
+    # load .env file
+    current_file_path = pathlib.Path(__file__).resolve()
+    env_path = f'{current_file_path.parent.parent}/.env'
+    load_dotenv(env_path)
+
+    out_dir = ambient_noise.default_output_dir()
+    os.makedirs(out_dir, exist_ok=True)
+
+    tracer = tracing.Tracer('ambient_noise', chunk_size=args.chunk_size)
+    frames = []
+    for band in args.bands:
+        tracer.stage(f'{band} open')
+        ds, nodes, calibration, reference = band_setup(band)
+        ds = ds[nodes].sel({'time':slice(*ambient_noise.time_window)})
+        n_transmissions = ds.sizes['transmission']
+
+        tracer.stage(f'{band} levels')
+        levels = {node: np.full(n_transmissions, np.nan) for node in nodes}
+        for start in tqdm(range(0, n_transmissions, args.chunk_size), desc=band):
+            chunk = ds.isel({'transmission':slice(start, start + args.chunk_size)}).load()
+            for node in nodes:
+                x = chunk[node].transpose('transmission', 'time').values
+                chunk_levels = ambient_noise.band_levels(x, ambient_noise.fs[band], calibration[node], reference)
+                levels[node][start:start + len(chunk_levels)] = chunk_levels
+            del chunk
+
+        transmissions = pd.Index(ds.transmission.values, name='transmission')
+        frame = pd.concat({node: pd.DataFrame({'level_db':levels[node]}, index=transmissions) for node in nodes}, names=['node', 'transmission'])
+        frame['band'] = band
+        frames.append(frame)
+
+    tracer.stage('write')
+    levels = pd.concat(frames).sort_index()
+    fn = f'{out_dir}levels.parquet'
+    tmp = f'{fn}.{os.getpid()}.tmp'
+    levels.to_parquet(tmp)
+    os.replace(tmp, fn)
+
+    summary = {}
+    for band in args.bands:
+        summary.update(ambient_noise.summarize(ambient_noise.levels_dataset(levels, band)))
+    fn = f'{out_dir}summary.json'
+    tmp = f'{fn}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(summary, f, indent=2)
+    os.replace(tmp, fn)
+    tracer.close()
+
+    print(pd.DataFrame(summary).T.round(2))
@@ -0,0 +1,48 @@
+'''
+build_tl_products.py - build the quantized TL pyramids used by map.ipynb
+
+For every node the TL_iw_range.py outputs in <data_directory>tl_iws/ are
+reduced to TL over realizations and written to
+<data_directory>tl_products/<node>_tl.zarr (see kb2ooi/tl_products.py). The
+size of the inputs and of the level read for a figure panel of --pixels are
+printed to check the size reduction. With --compare the stored TL is compared
+to the TL panel of the original map.ipynb, computed from the full complex
+fields (TL_iw_range.py --save_field).
+'''
+import sys
+import pathlib
+import argparse
+from dotenv import load_dotenv
+
+# make repository modules importable when run as a script
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent))
+from kb2ooi import tl_products, tracing
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build quantized multiresolution TL products')
+    parser.add_argument('--nodes', type=str, nargs='+', default=['LJ01C'], help='hydrophones with TL_iw_range.py outputs')
+    parser.add_argument('--n_levels', type=int, default=4, help='number of pyramid levels')
+    parser.add_argument('--compare', action='store_true', help='compare level 0 with the original map.ipynb TL from the full complex fields')
+    parser.add_argument('--pixels', type=int, nargs=2, default=[800, 1600], help='(depth, range) pixels of the figure panel used for the size check')
+    args = parser.parse_args()
+
+    # load .env file
+    current_file_path = pathlib.Path(__file__).resolve()
+    env_path = f'{current_file_path.parent.parent}/.env'
+    load_dotenv(env_path)
+
+    for node in args.nodes:
+        tracer = tracing.Tracer('build_tl_products', node=node)
+        tracer.stage('tl product')
+        report = tl_products.build_product(node, n_levels=args.n_levels, compare=args.compare)
+        tracer.close()
+
+        level = tl_products.select_level([lvl['shape'] for lvl in report['levels']], args.pixels)
+        for lvl in report['levels']:
+            print(f'{node} level {lvl["level"]}: {lvl["shape"]}, {lvl["bytes"]/1e6:.2f} MB, max quantization error {lvl["max_error"]:.4f} dB, {lvl["n_clipped"]} values clipped')
+        if 'baseline' in report:
+            baseline = report['baseline']
+            print(f'{node}: level 0 differs from the original map.ipynb TL by at most {baseline["max_difference"]:.4f} dB ({baseline["rms_difference"]:.4f} dB rms, {baseline["n_points"]} points)')
+        ratio = report['input_bytes'] / report['levels'][level]['bytes']
+        print(f'{node}: {report["input_bytes"]/1e6:.1f} MB of inputs, figure reads level {level} ({ratio:.0f}x smaller)')
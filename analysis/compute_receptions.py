@@ -23,8 +23,51 @@ from scipy.interpolate import interp1d
 from datetime import datetime
 from dotenv import load_dotenv
 import os
+import sys
+import pathlib
+import argparse
+
+# make repository modules importable when run as a script
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent))
+from kb2ooi import alignment, reception_quality, tracing, travel_times
+
+
+def align_band(stack, band, table, args):
+    '''
+    align_band - align the transmissions of every node of a stack, and the alignment report
+    '''
+    aligned, reports = {}, {}
+    for node in stack.data_vars:
+        node_stack = stack[node].compute()
+        aligned[node], report = alignment.align_stack(node_stack, window=args.window, max_lag=args.max_lag)
+        # transmissions for the target SNR of the stack over transmissions (stacked like the notebooks), unaligned and aligned
+        in_arrival = reception_quality.arrival_mask(node_stack.shorttime.values, node, table)
+        in_noise = reception_quality.noise_mask(node_stack.shorttime.values, node, table)
+        needed, final = {}, {}
+        for name, x in [('unaligned', node_stack), ('aligned', aligned[node])]:
+            snr = alignment.stack_snr(x, in_arrival, in_noise).values
+            reached = np.flatnonzero(snr >= args.target_snr)
+            needed[name] = int(reached[0]) + 1 if len(reached) else None
+            final[name] = snr[-1]
+        print(
+            f'{node}: median |lag| {report["lag"].abs().median()*1e3:.2f} ms, '
+            f'SNR of all transmissions {final["unaligned"]:.1f} dB unaligned, {final["aligned"]:.1f} dB aligned, '
+            f'transmissions for {args.target_snr} dB: {needed["unaligned"]} unaligned, {needed["aligned"]} aligned'
+        )
+        reports[node] = report
+    report = pd.concat(reports, names=['node', 'transmission'])
+    report['band'] = band
+    return xr.Dataset(aligned), report
+
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Stack the receptions of every transmission')
+    parser.add_argument('--align', action=argparse.BooleanOptionalAction, default=False, help='also write stacks with the transmissions aligned (bb_stack_aligned.nc, lf_stack_aligned.nc)')
+    parser.add_argument('--window', type=int, default=50, help='transmissions in the running reference of the alignment')
+    parser.add_argument('--max_lag', type=float, default=0.1, help='largest lag of the alignment [s]')
+    parser.add_argument('--target_snr', type=float, default=20, help='SNR of the stack over transmissions that is reported [dB]')
+    args = parser.parse_args()
+
     # load .env file
     env_path = '../.env'
     _ = load_dotenv(env_path)
@@ -44,6 +87,8 @@ if __name__ == '__main__':
     # Print the dashboard URL
     print(f"Dask dashboard available at: {client.dashboard_link}")
 
+    tracer = tracing.Tracer('compute_receptions')
+    tracer.stage('open datasets')
     print('openning datasets...')
     bb = kaooi.open_ooi_bb(compute=True)
     bb_proc = kaooi.process_data(bb, sampling_rate=500)
@@ -64,18 +109,12 @@ if __name__ == '__main__':
         'HYSB1'
     ]
 
-    # estimate arrival times for stacking
-    print('estimating absolute arrival times...')
-    T0s = {}
-
-    for node in hydrophones:
-        ssp = envy.get_ssp_slice(coords['KB'], coords[node], 50, fillna=True).load()
-        kb_range = geo.great_circle(coords['KB'], coords[node]).km
-        integrated_minimum = ssp.min('depth').mean('range')
-
-        # time of last arrival (time spread is only at maximum 10 s)
-        T0s[node] =  float(kb_range*1000 / integrated_minimum)
+    # predicted last arrival of every node for stacking (analysis/travel_times.py)
+    tracer.stage('travel times')
+    table = travel_times.load_table()
+    T0s = {node: float(table['t_last'].sel({'node':node})) for node in hydrophones}
 
+    tracer.stage('stack')
     bb_stack = {}
     for node in bb_proc.keys():
         bb_stack[node] = bb_proc[node].sel({'longtime':slice(T0s[node], T0s[node]+20*60)}).mean('longtime')
@@ -90,10 +129,34 @@ if __name__ == '__main__':
     if not os.path.exists(f'{os.environ["data_directory"]}analysis'):
         os.makedirs(f'{os.environ["data_directory"]}analysis')
 
+    if args.align:
+        # computed once for the fixed window and the aligned stacks
+        bb_stack, lf_stack = bb_stack.compute(), lf_stack.compute()
+
     # save to disk
+    tracer.stage('write')
     print('computing arrivals and saving to disk...')
     fn = f'{os.environ["data_directory"]}analysis/bb_stack.nc'
     np.abs(bb_stack).to_netcdf(fn)
 
     fn = f'{os.environ["data_directory"]}analysis/lf_stack.nc'
-    np.abs(lf_stack).to_netcdf(fn)
\ No newline at end of file
+    np.abs(lf_stack).to_netcdf(fn)
+
+    # transmissions aligned to a running reference (kb2ooi/alignment.py), written
+    # next to the fixed window stacks, which keep the travel time wander
+    if args.align:
+        tracer.stage('align')
+        bb_aligned, bb_report = align_band(bb_stack, 'bb', table, args)
+        lf_aligned, lf_report = align_band(lf_stack, 'lf', table, args)
+        fn = f'{os.environ["data_directory"]}analysis/alignment.parquet'
+        tmp = f'{fn}.{os.getpid()}.tmp'
+        pd.concat([bb_report, lf_report]).sort_index().to_parquet(tmp)
+        os.replace(tmp, fn)
+
+        fn = f'{os.environ["data_directory"]}analysis/bb_stack_aligned.nc'
+        np.abs(bb_aligned).to_netcdf(fn)
+
+        fn = f'{os.environ["data_directory"]}analysis/lf_stack_aligned.nc'
+        np.abs(lf_aligned).to_netcdf(fn)
+
+    tracer.close()
\ No newline at end of file
@@ -0,0 +1,64 @@
+'''
+reception_quality.py - noise RMS, peak SNR, noise level and quality flags of every stacked transmission
+
+Reads the stacks written by compute_receptions.py and the travel time table
+(analysis/travel_times.py) and writes one row per band, node and transmission to
+<data_directory>analysis/reception_quality.parquet (see
+kb2ooi/reception_quality.py for the columns and flags).
+
+usage:
+    python analysis/reception_quality.py [--min_snr 10]
+
+    # in a notebook
+    quality = pd.read_parquet(f'{os.environ["data_directory"]}analysis/reception_quality.parquet')
+    good = quality[quality.flags == 0].loc[('bb', 'LJ01C')]
+'''
+import os
+import sys
+import pathlib
+import argparse
+import pandas as pd
+import xarray as xr
+from dotenv import load_dotenv
+
+# make repository modules importable when run as a script
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent))
+from kb2ooi import reception_quality, tracing, travel_times
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Per transmission quality of the stacked receptions')
+    parser.add_argument('--min_snr', type=float, default=10, help='peak SNR below which transmissions are flagged [dB]')
+    parser.add_argument('--noisy_factor', type=float, default=3, help='noise RMS relative to the node median above which transmissions are flagged')
+    parser.add_argument('--max_missing', type=float, default=0.1, help='fraction of missing samples above which transmissions are flagged')
+    args = parser.parse_args()
+
+    # load .env file
+    current_file_path = pathlib.Path(__file__).resolve()
+    env_path = f'{current_file_path.parent.parent}/.env'
+    load_dotenv(env_path)
+
+    analysis_dir = f'{os.environ["data_directory"]}analysis/'
+    table = travel_times.load_table()
+
+    tracer = tracing.Tracer('reception_quality')
+    frames = []
+    for band in ['bb', 'lf']:
+        tracer.stage(f'{band} quality')
+        with xr.open_dataset(f'{analysis_dir}{band}_stack.nc') as stacks:
+            frames.append(reception_quality.quality_table(stacks, table, band, min_snr=args.min_snr, noisy_factor=args.noisy_factor, max_missing=args.max_missing))
+    quality = pd.concat(frames).sort_index()
+
+    tracer.stage('write')
+    fn = f'{analysis_dir}reception_quality.parquet'
+    tmp = f'{fn}.{os.getpid()}.tmp'
+    quality.to_parquet(tmp)
+    os.replace(tmp, fn)
+    tracer.close()
+
+    summary = quality.groupby(['band', 'node']).agg(
+        transmissions=('flags', 'size'),
+        good=('flags', lambda f: int((f == 0).sum())),
+        median_snr_db=('peak_snr_db', 'median'),
+    )
+    print(summary.round(1))
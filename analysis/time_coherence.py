@@ -0,0 +1,70 @@
+'''
+time_coherence.py - coherence vs lag of the time coherence PE runs, updated as time steps are written
+
+Time steps in <data_directory>time_coherence_iws/ are consumed in time order
+(see kb2ooi/time_coherence.py). The estimator state and the current
+coherence curve are written to <data_directory>time_coherence/ after every
+update, so the curve can be used while later time steps are still running and
+the next call continues where the last one stopped.
+
+usage:
+    python analysis/time_coherence.py LJ01C [--max_lag 20] [--follow 600]
+'''
+import os
+import sys
+import time
+import pathlib
+import argparse
+from dotenv import load_dotenv
+from kaooi.coordinates import depths
+
+# make repository modules importable when run as a script
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent))
+from kb2ooi import pe, time_coherence, tracing
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Streaming time coherence of the PE arrivals')
+    parser.add_argument('node', type=str, help='Node identifier (e.g. LJ01C)')
+    parser.add_argument('--max_lag', type=int, default=20, help='largest lag [time steps]')
+    parser.add_argument('--n_steps', type=int, default=time_coherence.n_time_steps, help='number of time steps of the experiment')
+    parser.add_argument('--confidence', type=float, default=0.95, help='confidence level of the bounds')
+    parser.add_argument('--follow', type=float, default=None, help='keep polling for new time steps every FOLLOW seconds until all steps are done')
+    args = parser.parse_args()
+
+    # load .env file
+    current_file_path = pathlib.Path(__file__).resolve()
+    env_path = f'{current_file_path.parent.parent}/.env'
+    load_dotenv(env_path)
+
+    in_dir = f'{os.environ["data_directory"]}time_coherence_iws/'
+    out_dir = f'{os.environ["data_directory"]}time_coherence/'
+    os.makedirs(out_dir, exist_ok=True)
+    state_fn = f'{out_dir}{args.node}_state.npz'
+    out_fn = f'{out_dir}{args.node}_coherence.nc'
+
+    if os.path.exists(state_fn):
+        estimator = time_coherence.CoherenceEstimator.load(state_fn, max_lag=args.max_lag)
+        print(f'resuming from time step {estimator.n_steps}')
+    else:
+        estimator = time_coherence.CoherenceEstimator(args.max_lag)
+
+    def file_paths(step):
+        return pe.output_paths(in_dir, args.node, step)
+
+    while True:
+        tracer = tracing.Tracer('time_coherence', node=args.node)
+        tracer.stage('coherence update')
+        added = time_coherence.update_from_files(estimator, file_paths, depths[args.node], n_steps=args.n_steps)
+        if added > 0:
+            estimator.save(state_fn)
+            result = estimator.result(args.confidence)
+            tmp = f'{out_fn}.{os.getpid()}.tmp'
+            result.to_netcdf(tmp)
+            os.replace(tmp, out_fn)
+        tracer.close()
+        print(f'{estimator.n_steps} / {args.n_steps} time steps, {added} new')
+
+        if (args.follow is None) or (estimator.n_steps >= args.n_steps):
+            break
+        time.sleep(args.follow)
@@ -0,0 +1,104 @@
+"""
+trace_report.py - aggregate stage traces written by kb2ooi.tracing across all jobs
+
+prints wall time, CPU time, allocated core-hours and peak memory for every
+(script, stage), so it is clear where a campaign spends its core-hours. The
+peak memory of a stage is stage_max_rss, the lifetime_ columns are the peak
+of the process up to the end of the stage.
+
+usage:
+    python analysis/trace_report.py [--trace_dir <dir>] [--by node] [--csv report.csv]
+"""
+import os
+import sys
+import pathlib
+import argparse
+import pandas as pd
+from dotenv import load_dotenv
+
+# make repository modules importable when run as a script
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent))
+from kb2ooi import tracing
+
+
+def summarize(records : list, by : list = None):
+    '''
+    summarize - aggregate trace records by script and stage
+
+    Parameters
+    ----------
+    records : list
+        records returned by tracing.load_traces
+    by : list
+        extra fields to group by (e.g. ['node'])
+
+    Returns
+    -------
+    summary : pd.DataFrame
+    '''
+    df = pd.DataFrame(records)
+    if by is None:
+        by = []
+    for field in by:
+        if field not in df:
+            df[field] = None
+
+    for field in ['stage_max_rss', 'lifetime_max_rss', 'lifetime_max_rss_children']:
+        if field not in df:
+            df[field] = float('nan')
+        df[field] = df[field].astype(float)
+
+    df['core_hours'] = df['wall_time'] * df['n_cpus'] / 3600
+    df['cpu_hours'] = df['cpu_time'] / 3600
+    df['wall_hours'] = df['wall_time'] / 3600
+
+    summary = df.groupby(['script', 'stage'] + by, dropna=False).agg(
+        runs=('wall_time', 'size'),
+        wall_hours=('wall_hours', 'sum'),
+        mean_wall_min=('wall_time', lambda x: x.mean() / 60),
+        max_wall_min=('wall_time', lambda x: x.max() / 60),
+        cpu_hours=('cpu_hours', 'sum'),
+        core_hours=('core_hours', 'sum'),
+        stage_max_rss_GB=('stage_max_rss', lambda x: x.max() / 1e9),
+        lifetime_max_rss_GB=('lifetime_max_rss', lambda x: x.max() / 1e9),
+        lifetime_max_rss_children_GB=('lifetime_max_rss_children', lambda x: x.max() / 1e9),
+    )
+    summary['cpu_efficiency'] = summary['cpu_hours'] / summary['core_hours']
+
+    # fraction of each script's core-hours spent in each stage
+    stages = summary.drop('total', level='stage', errors='ignore')
+    script_total = stages.groupby(level='script')['core_hours'].transform('sum')
+    summary['core_hour_fraction'] = stages['core_hours'] / script_total
+
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='aggregate pipeline stage traces')
+    parser.add_argument('--trace_dir', type=str, default=None, help='directory of trace files')
+    parser.add_argument('--by', type=str, nargs='*', default=[], help='extra fields to group by (e.g. node)')
+    parser.add_argument('--csv', type=str, default=None, help='optional path to save the summary')
+    args = parser.parse_args()
+
+    # load .env file
+    current_file_path = pathlib.Path(__file__).resolve()
+    env_path = f'{current_file_path.parent.parent}/.env'
+    load_dotenv(env_path)
+
+    records = tracing.load_traces(args.trace_dir)
+    if len(records) == 0:
+        print('no trace records found.')
+        sys.exit()
+
+    summary = summarize(records, args.by)
+
+    with pd.option_context('display.max_rows', None, 'display.width', 200, 'display.float_format', '{:.2f}'.format):
+        print(summary)
+
+    totals = summary.xs('total', level='stage') if 'total' in summary.index.get_level_values('stage') else None
+    if totals is not None:
+        print(f'\ntotal allocated core-hours: {totals["core_hours"].sum():.1f}')
+
+    if args.csv is not None:
+        summary.to_csv(args.csv)
+        print(f'saved summary to {args.csv}')
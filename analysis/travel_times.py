@@ -0,0 +1,48 @@
+'''
+travel_times.py - predict the arrival window of every hydrophone and write the travel time table
+
+The table (<data_directory>travel_times/travel_times.nc, see
+kb2ooi/travel_times.py) is read by compute_receptions.py for stacking, by the
+PE drivers for the arrival window of the output and by the figures for the
+time offsets. With --monthly a second table with a month dimension is
+written from the monthly climatology.
+
+usage:
+    python analysis/travel_times.py [--monthly] [--num_range_points 200]
+'''
+import sys
+import pathlib
+import argparse
+from dotenv import load_dotenv
+
+# make repository modules importable when run as a script
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent))
+from kb2ooi import tracing, travel_times
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Predicted arrival windows of all hydrophones')
+    parser.add_argument('--nodes', type=str, nargs='*', default=travel_times.hydrophones, help='hydrophones in the table')
+    parser.add_argument('--num_range_points', type=int, default=200, help='number of range points of the sound speed slices')
+    parser.add_argument('--guard', type=float, default=2.0, help='guard added to both ends of the arrival window [s]')
+    parser.add_argument('--monthly', action='store_true', help='also write the table for every month of the monthly climatology')
+    args = parser.parse_args()
+
+    # load .env file
+    current_file_path = pathlib.Path(__file__).resolve()
+    env_path = f'{current_file_path.parent.parent}/.env'
+    load_dotenv(env_path)
+
+    tracer = tracing.Tracer('travel_times')
+    tracer.stage('climate')
+    table = travel_times.build_table(args.nodes, num_range_points=args.num_range_points, guard=args.guard)
+    print(table[['distance', 't_first', 't_last', 'mls_integer', 'fs_integer', 'alignment_offset']].to_dataframe().round(2))
+    differs = (table['mls_integer'] != table['mls_integer_predicted']) | (table['fs_integer'] != table['fs_integer_predicted'])
+    if bool(differs.any()):
+        print('published integers that differ from the prediction:')
+        print(table[['mls_integer', 'mls_integer_predicted', 'fs_integer', 'fs_integer_predicted']].where(differs, drop=True).to_dataframe())
+    if args.monthly:
+        tracer.stage('monthly')
+        monthly = travel_times.build_table(args.nodes, monthly=True, num_range_points=args.num_range_points, guard=args.guard)
+        print(monthly['travel_time'].to_pandas().round(2))
+    tracer.close()
@@ -0,0 +1,6 @@
+'''
+kb2ooi - shared helpers for the KB to OOI simulation and analysis scripts
+
+The scripts in this repository are run directly (e.g. ``python simulation/...``),
+so they add the repository root to ``sys.path`` before importing from here.
+'''
@@ -0,0 +1,197 @@
+'''
+alignment.py - sub-sample alignment of the stacked transmissions
+
+compute_receptions.py stacks a fixed window of every transmission, so clock
+drift and timing jitter between transmissions smear any stack over
+transmissions. ``align`` estimates the lag of every transmission against a
+running reference and shifts it, in one batch over the transmission axis:
+
+1. the receptions (transmission, shorttime) are transformed with one FFT
+   along shorttime (the matched filter output is periodic in the MLS period,
+   so circular shifts are exact)
+2. the first iteration correlates the envelopes |x| with their mean, which
+   does not depend on the carrier phase of the transmissions. The phases of
+   complex receptions are then aligned to their coherent mean (a few power
+   iterations), and later iterations use the rolling mean of the aligned
+   neighbours (excluding the transmission itself) as the reference
+3. the cross correlation with the reference is the inverse FFT of
+   X * conj(R), the integer lag is its peak within max_lag and the sub-sample
+   lag comes from a parabola through the peak and its neighbours
+4. the shift is applied as a phase ramp in the frequency domain, and the
+   phase of the correlation peak is removed for complex receptions
+
+Lags are accumulated over the iterations and the median lag is removed, so
+the arrival times of the aligned receptions are not biased.
+'''
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+
+def _rolling_reference(X : np.ndarray, valid : np.ndarray, window : int):
+    '''
+    _rolling_reference - mean of the valid neighbours of every transmission within window, excluding itself
+    '''
+    Xv = np.where(valid[:, None], X, 0)
+    csum = np.concatenate([np.zeros((1, X.shape[1]), dtype=X.dtype), np.cumsum(Xv, axis=0)])
+    ccount = np.concatenate([[0], np.cumsum(valid)])
+    idx = np.arange(len(X))
+    lo = np.clip(idx - window//2, 0, len(X))
+    hi = np.clip(idx + window//2 + 1, 0, len(X))
+    total = csum[hi] - csum[lo] - Xv
+    count = (ccount[hi] - ccount[lo] - valid)[:, None]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(count > 0, total / count, 0)
+
+
+def _peak(c : np.ndarray, max_lag : int):
+    '''
+    _peak - sub-sample circular lag [samples] and value of the peak of |c| along the last axis
+    '''
+    n = c.shape[-1]
+    lags = np.fft.fftfreq(n, 1/n).astype(int)
+    magnitude = np.where(np.abs(lags) <= max_lag, np.abs(c), -np.inf)
+    k = np.argmax(magnitude, axis=-1)
+    rows = np.arange(c.shape[0])
+    y0 = np.abs(c[rows, (k - 1) % n])
+    y1 = np.abs(c[rows, k])
+    y2 = np.abs(c[rows, (k + 1) % n])
+    denominator = y0 - 2*y1 + y2
+    with np.errstate(invalid='ignore', divide='ignore'):
+        delta = np.where(denominator < 0, 0.5*(y0 - y2)/denominator, 0)
+    return lags[k] + np.clip(delta, -0.5, 0.5), c[rows, k]
+
+
+def align(x : np.ndarray, window : int = 50, max_lag : int = None, n_iter : int = 3, align_phase : bool = True):
+    '''
+    align - align every row of x to a running reference
+
+    Parameters
+    ----------
+    x : np.ndarray
+        (transmission, shorttime) receptions, real or complex, rows with NaN are not used and not shifted
+    window : int
+        number of transmissions of the running reference
+    max_lag : int
+        largest lag [samples], a quarter of the period if None
+    n_iter : int
+        number of iterations, the first correlates the envelopes with their mean
+    align_phase : bool
+        remove the phase of the correlation peak (complex x only)
+
+    Returns
+    -------
+    aligned : np.ndarray
+        x shifted by -lag
+    lag : np.ndarray
+        (transmission,) lag [samples] of every row to the common reference, NaN for rows with NaN
+    correlation : np.ndarray
+        (transmission,) normalized correlation with the final reference
+    '''
+    x = np.asarray(x)
+    n = x.shape[-1]
+    max_lag = n//4 if max_lag is None else max_lag
+    is_complex = np.iscomplexobj(x)
+    valid = np.isfinite(x).all(axis=1)
+
+    X = np.fft.fft(np.where(valid[:, None], x, 0), axis=-1)
+    # frequency of every bin [cycles / sample], the phase ramp of a shift
+    f = np.fft.fftfreq(n)
+    phase = np.ones(len(x), dtype=complex)
+    correlation = np.full(len(x), np.nan)
+
+    # envelope alignment, independent of the carrier phase
+    E = np.fft.fft(np.where(valid[:, None], np.abs(x), 0), axis=-1)
+    c = np.fft.ifft(E * np.conj(E[valid].mean(axis=0)), axis=-1)
+    step, _ = _peak(c, max_lag)
+    lag = np.where(valid, step, 0)
+
+    if is_complex and align_phase:
+        Xa = X * np.exp(2j*np.pi*f*lag[:, None])
+        # power iterations for the phases that maximize |coherent mean|
+        R = Xa[np.argmax(np.where(valid, (np.abs(Xa)**2).sum(axis=-1), -np.inf))]
+        for _ in range(5):
+            inner = (Xa * np.conj(R)).sum(axis=-1)
+            phase = np.where(valid & (inner != 0), np.exp(-1j*np.angle(inner)), 1)
+            R = (Xa * phase[:, None])[valid].mean(axis=0)
+
+    for _ in range(n_iter - 1):
+        Xa = X * np.exp(2j*np.pi*f*lag[:, None]) * phase[:, None]
+        R = _rolling_reference(Xa, valid, window)
+        c = np.fft.ifft(Xa * np.conj(R), axis=-1)
+        step, peak = _peak(c, max_lag)
+        lag += np.where(valid, step, 0)
+        if is_complex and align_phase:
+            phase *= np.exp(-1j*np.angle(np.where(valid & (peak != 0), peak, 1)))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            norm = np.sqrt((np.abs(Xa)**2).sum(axis=-1) * (np.abs(R)**2).sum(axis=-1))
+            correlation = np.where(valid, np.abs(peak)*n / norm, np.nan)
+
+    # lags relative to the median transmission
+    if valid.any():
+        lag -= np.median(lag[valid])
+    Xa = X * np.exp(2j*np.pi*f*lag[:, None]) * phase[:, None]
+    aligned = np.fft.ifft(Xa, axis=-1)
+    if not is_complex:
+        aligned = aligned.real
+    aligned[~valid] = x[~valid]
+    return aligned.astype(x.dtype, copy=False), np.where(valid, lag, np.nan), correlation
+
+
+def align_stack(stack : xr.DataArray, **kwargs):
+    '''
+    align_stack - align the transmissions of a stack (transmission, shorttime) of one node
+
+    kwargs are passed to align, max_lag is given in seconds
+
+    Returns
+    -------
+    aligned : xr.DataArray
+    report : pd.DataFrame
+        lag [s] and correlation of every transmission
+    '''
+    stack = stack.transpose('transmission', 'shorttime')
+    dt = float(np.median(np.diff(stack.shorttime.values)))
+    if kwargs.get('max_lag') is not None:
+        kwargs['max_lag'] = int(np.ceil(kwargs['max_lag'] / dt))
+    aligned, lag, correlation = align(stack.values, **kwargs)
+    aligned = stack.copy(data=aligned)
+    aligned.attrs['aligned'] = 1
+    report = pd.DataFrame(
+        {'lag':lag*dt, 'correlation':correlation},
+        index=pd.Index(stack.transmission.values, name='transmission'),
+    )
+    return aligned, report
+
+
+def stack_snr(stack : xr.DataArray, in_arrival : np.ndarray, in_noise : np.ndarray = None):
+    '''
+    stack_snr - peak SNR [dB] of the mean of the first n transmissions, for every n
+
+    stacked like ArrivalStatistics.ipynb: |stack| of every transmission is
+    divided by its noise RMS per component (RMS of |stack| in the noise
+    samples / sqrt(2)) and averaged over transmissions, incoherently. The
+    SNR is the peak of the mean in the arrival window, to compare how many
+    transmissions aligned and unaligned stacks need for a target SNR
+
+    Parameters
+    ----------
+    stack : xr.DataArray
+        (transmission, shorttime), real or complex
+    in_arrival : np.ndarray
+        bool (shorttime,), samples in the arrival window
+    in_noise : np.ndarray
+        bool (shorttime,), noise samples (reception_quality.noise_mask), outside the arrival window if None
+    '''
+    in_noise = ~in_arrival if in_noise is None else in_noise
+    x = np.abs(stack.transpose('transmission', 'shorttime').values)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        snr = x / (np.sqrt(np.mean(x[:, in_noise]**2, axis=1)) / np.sqrt(2))[:, None]
+    valid = np.isfinite(snr).all(axis=1)
+    snr = np.where(valid[:, None], snr, 0)
+    running = np.cumsum(snr, axis=0) / np.maximum(np.cumsum(valid), 1)[:, None]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        peak = 20*np.log10(running[:, in_arrival].max(axis=1))
+    peak = np.where(np.cumsum(valid) > 0, peak, np.nan)
+    return xr.DataArray(peak, dims=['transmission'], coords={'transmission':stack.transmission.values}, name='stack_snr')
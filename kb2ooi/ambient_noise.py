@@ -0,0 +1,148 @@
+'''
+ambient_noise.py - calibrated noise levels of every transmission, computed chunk by chunk
+
+ambient_noise.ipynb computed the Welch PSD of the full 40 minute window of
+every transmission with a dask Client and kept all spectra in memory to take
+band averages, quantiles and KDEs. ``band_levels`` computes the calibrated
+Welch PSD (median average, as in the notebook) of a chunk of transmissions
+with scipy and returns the 37.5 - 112.5 Hz band average in dB re uPa^2/Hz.
+analysis/ambient_noise.py writes the per transmission levels and the
+summary. ``levels_dataset`` drops transmissions with a missing level at any
+node of the band, like ``Dataset.dropna('transmission')`` in the notebook, so
+quantiles and KDEs are computed over the same transmissions as before.
+'''
+
+import os
+import json
+import pathlib
+import numpy as np
+import pandas as pd
+import xarray as xr
+from scipy import signal
+
+# calibration of the broadband hydrophones [counts / uPa]
+bb_calib = {
+    'LJ01C':10**((-168.2 + 128.9)/20), # dV rel V / uPA | dB rel counts / V
+    'PC01A':10**((-170.2 + 128.9)/20),
+    'PC03A':10**((-170.5 + 128.9)/20),
+    'LJ03A':10**((-168.8 + 128.9)/20),
+    'LJ01D':10**((-170.5 + 128.9)/20),
+    'LJ01A':10**((-168.9 + 128.9)/20),
+}
+
+lf_nodes = ['AXCC1', 'AXEC2', 'AXBA1', 'HYS14', 'HYSB1']
+bb_nodes = ['LJ01C', 'PC01A', 'PC03A', 'LJ01D', 'LJ01A']
+
+# sampling rate [Hz], Welch segment length and band of the band levels [Hz]
+fs = {'lf':200, 'bb':500}
+nperseg = 4096
+band = (37.5, 112.5)
+
+# 40 minutes around the reception [s from the transmission]
+time_window = (35*60, 75*60)
+
+
+def lf_calibration():
+    '''
+    lf_calibration - counts / Pa of the low frequency hydrophones from the ooipy calibration table
+    '''
+    import ooipy
+    calibration_path = f'{pathlib.Path(ooipy.__file__).resolve().parent}/hydrophone/calibration_by_assetID.csv'
+    calibration = pd.read_csv(calibration_path, header=[0, 1])
+    return {node: float(calibration[f'{node}-HDH']['0 phase'].loc[0]) for node in lf_nodes}
+
+
+def band_levels(x : np.ndarray, fs : float, calibration : float, reference : float = 1):
+    '''
+    band_levels - band averaged calibrated PSD of every row of x
+
+    Parameters
+    ----------
+    x : np.ndarray
+        (transmission, time) in counts
+    fs : float
+        sampling rate [Hz]
+    calibration : float
+        counts per unit pressure
+    reference : float
+        reference pressure in the units of the calibration (1e-6 for Pa to
+        get levels re uPa)
+
+    Returns
+    -------
+    np.ndarray
+        (transmission,) mean of the PSD [dB re reference^2/Hz] over band, NaN
+        for transmissions with missing data
+    '''
+    x = np.asarray(x, dtype=float) / calibration
+    levels = np.full(x.shape[0], np.nan)
+    valid = np.isfinite(x).all(axis=1)
+    if not valid.any():
+        return levels
+    f, psd = signal.welch(x[valid], fs=fs, nperseg=nperseg, average='median', axis=-1)
+    in_band = (f >= band[0]) & (f <= band[1])
+    with np.errstate(divide='ignore'):
+        psd_db = 10*np.log10(psd[:, in_band]) - 20*np.log10(reference)
+    levels[valid] = psd_db.mean(axis=-1)
+    levels[~np.isfinite(levels)] = np.nan
+    return levels
+
+
+def default_output_dir():
+    return f'{os.environ["data_directory"]}analysis/ambient_noise/'
+
+
+def load_levels(out_dir : str = None):
+    '''
+    load_levels - per transmission band levels written by analysis/ambient_noise.py, indexed by (node, transmission)
+    '''
+    out_dir = default_output_dir() if out_dir is None else out_dir
+    return pd.read_parquet(f'{out_dir}levels.parquet')
+
+
+def levels_dataset(levels : pd.DataFrame, band_name : str, joint : bool = True):
+    '''
+    levels_dataset - band levels of one band ('lf' or 'bb') as a Dataset with one variable per node over transmission
+
+    Parameters
+    ----------
+    levels : pd.DataFrame
+        output of load_levels
+    band_name : str
+        'lf' or 'bb'
+    joint : bool
+        drop transmissions with a missing level at any node of the band (the
+        dropna('transmission') of ambient_noise.ipynb), otherwise every node
+        keeps its own transmissions with NaN for missing levels
+    '''
+    levels = levels[levels['band'] == band_name]['level_db']
+    ds = levels.unstack('node').to_xarray()
+    if joint:
+        ds = ds.dropna('transmission')
+    return ds
+
+
+def summarize(ds : xr.Dataset, quantiles=(0.05, 0.25, 0.5, 0.75, 0.95)):
+    '''
+    summarize - count, mean, std and quantiles of the levels of every node of a levels_dataset
+    '''
+    summary = {}
+    for node in ds.data_vars:
+        x = ds[node].values
+        x = x[np.isfinite(x)]
+        summary[node] = {
+            'n':int(len(x)),
+            'mean':float(np.mean(x)) if len(x) > 0 else np.nan,
+            'std':float(np.std(x, ddof=1)) if len(x) > 1 else np.nan,
+            **{f'q{int(round(q*100)):02}':float(v) for q, v in zip(quantiles, np.quantile(x, quantiles) if len(x) > 0 else np.full(len(quantiles), np.nan))},
+        }
+    return summary
+
+
+def load_summary(out_dir : str = None):
+    '''
+    load_summary - count, mean, std and quantiles of the band levels of every node
+    '''
+    out_dir = default_output_dir() if out_dir is None else out_dir
+    with open(f'{out_dir}summary.json') as f:
+        return pd.DataFrame(json.load(f)).T
@@ -0,0 +1,119 @@
+'''
+branching.py - find where the paths from KB to different nodes stop sharing the same environment
+
+Paths from KB to different nodes run through (nearly) the same ocean for
+thousands of km before they diverge near the coast or Axial Seamount, and the
+Monte Carlo runs use the same internal wave perturbation (range, depth) for
+every node. ``branch_range`` finds the range up to which two paths have the
+same sound speed, bathymetry and bottom properties, ``plan_branches`` the
+node every node shares the longest path with, and ``marched_range`` the range
+RAM would march with and without restarting every node from the field at its
+branch range.
+
+Only the plan is implemented. Restarting needs a starting field argument in
+bighorn.run_ram, which it does not have, so every node is still run over the
+full path. plan_branches.py writes the plan, so the saving can be checked
+before such a hook is added to RAM.
+'''
+
+import numpy as np
+
+from kb2ooi import pe
+
+
+def branch_range(node_a : str, path_a : tuple, node_b : str, path_b : tuple, ssp_tolerance : float = 0.5, bathy_tolerance : float = 10, cascadia_slope : bool = False):
+    '''
+    branch_range - range [km] up to which two paths have the same environment
+
+    the sound speed, bathymetry and bottom properties are compared on the
+    range grid of path_a
+
+    Parameters
+    ----------
+    node_a, node_b : str
+        node names
+    path_a, path_b : tuple
+        (ssp, bathy) from pe.load_path
+    ssp_tolerance : float
+        maximum sound speed difference [m/s]
+    bathy_tolerance : float
+        maximum bathymetry difference [m]
+    cascadia_slope : bool
+        passed to pe.bottom_properties
+
+    Returns
+    -------
+    float
+        branch range [km], 0 if the paths differ at the source
+    '''
+    ssp_a, bathy_a = path_a
+    ssp_b, bathy_b = path_b
+    ranges = ssp_a.range.values
+    ranges = ranges[ranges <= min(float(ssp_b.range[-1]), float(bathy_a.range[-1]), float(bathy_b.range[-1]))]
+
+    dc = np.abs(ssp_a.sel({'range':ranges}) - ssp_b.interp({'range':ranges, 'depth':ssp_a.depth}))
+    dc = dc.transpose('range', ...).values.reshape(len(ranges), -1)
+    dh = np.abs(bathy_a.interp({'range':ranges}).values - bathy_b.interp({'range':ranges}).values)
+    differs = (np.nanmax(dc, axis=1) > ssp_tolerance) | (dh > bathy_tolerance)
+
+    for prop_a, prop_b in zip(pe.bottom_properties(node_a, ranges, cascadia_slope), pe.bottom_properties(node_b, ranges, cascadia_slope)):
+        differs |= (prop_a.values[0] != prop_b.values[0])
+
+    if not differs.any():
+        return float(ranges[-1])
+    first = int(np.argmax(differs))
+    return float(ranges[first - 1]) if first > 0 else 0.0
+
+
+def plan_branches(paths : dict, **kwargs):
+    '''
+    plan_branches - trunk node and branch range of every node
+
+    every node branches from the node it shares the longest path with. The
+    trunk of a pair is the first node by name, so that both nodes of a pair
+    would use the same checkpoint.
+
+    Parameters
+    ----------
+    paths : dict
+        {node: (ssp, bathy)}
+    **kwargs
+        passed to branch_range
+
+    Returns
+    -------
+    dict
+        {node: (trunk_node, branch_range)}
+    '''
+    plan = {}
+    for node in paths:
+        best = (node, 0.0)
+        for other in paths:
+            if other == node:
+                continue
+            a, b = sorted([node, other])
+            r = branch_range(a, paths[a], b, paths[b], **kwargs)
+            if r > best[1]:
+                best = (a, r)
+        plan[node] = best
+    return plan
+
+
+def marched_range(paths : dict, plan : dict):
+    '''
+    marched_range - range [km] marched by RAM for all nodes, with and without branch restarts
+
+    with restarts, the trunk segment of every distinct (trunk, branch range)
+    is marched once and every node marches from its branch range to its
+    receiver
+
+    Returns
+    -------
+    dict
+        full and branched range [km] and their ratio
+    '''
+    lengths = {node: float(bathy.range[-1]) for node, (ssp, bathy) in paths.items()}
+    full = sum(lengths.values())
+    checkpoints = {(trunk, r_branch) for trunk, r_branch in plan.values() if r_branch > 0}
+    branched = sum(lengths[node] - plan[node][1] for node in paths) + sum(r_branch for _, r_branch in checkpoints)
+    return {'full':full, 'branched':branched, 'ratio':branched/full if full > 0 else 1.0}
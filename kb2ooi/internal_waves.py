@@ -0,0 +1,693 @@
+'''
+internal_waves.py - build merged internal wave sound speed perturbations
+
+``merge_sections`` combines the ~100 km internal wave sections (one per 50 km
+step along the path) with a cosine squared taper into a single perturbation
+along the whole path. It is used by merge_dciw.py for the MATLAB sections and
+by ``generate_realization``, which computes the sections with the python iwGM
+package directly from the ``KB_2_{hydrophone}.nc`` ocean sections, so a PE
+worker can build a realization in memory without any .mat or .nc round trips.
+``compute_sections`` builds those ocean sections (get_100km_ocean_sections.py).
+``write_realization`` stores merged perturbations as chunked, zlib compressed
+netcdf with the mantissa rounded to the bits needed to stay within
+``dciw_tolerance`` [m/s].
+``generate_time_step`` builds a time step of the time coherence experiment
+with a full realization, as KB2OOI_time_func.m. ``IWTimeSeries`` is the opt
+in approximation: the spectral (vertical mode, wavenumber) amplitudes of every
+section are stored once and each time step is a phase advance and an inverse
+transform. It is checked against a full realization at the last time step.
+'''
+
+import os
+import numpy as np
+import xarray as xr
+from scipy import signal
+from tqdm import tqdm
+
+from kb2ooi import precision
+
+# parameters used by KB2OOI_real_func.m
+iw_params = {
+    'zeta0':7.3,
+    'jstar':3,
+    'dca':0.0182,
+    'StrainThreshold':0.3,
+}
+
+
+def merge_sections(dciws : list, verbose : bool = True):
+    '''
+    merge_sections - merge 100 km internal wave sections into a single perturbation
+
+    Parameters
+    ----------
+    dciws : list
+        list of xr.DataArray (range [km], depth), one section per 50 km step
+    verbose : bool
+        whether to print out progress
+
+    Returns
+    -------
+    merged_iw : xr.DataArray
+        merged iw perturbation realization in the precision of kb2ooi.precision
+    '''
+    dr = float(dciws[0].range[1] - dciws[0].range[0])
+
+    def get_factors(x):
+        factors = []
+        for i in range(1, int(x + 1)):
+            if x % i == 0:
+                factors.append(i)
+        return factors
+
+    factors = np.array(get_factors(50e3))
+
+    # get dr that is integer divisible by (100/2)km
+    # largest integer factor of 100km that is larger that dr
+    dr_bin = int(np.max((factors - (dr*1000))[(factors - (dr*1000)) < 0]) + dr*1000)/1000
+
+    dciws_interp = []
+
+    # interpolate and reassign coordinates to sections
+    if verbose:
+        print('interpolating and reassigning coordinates...')
+    for k, dciw in enumerate(tqdm(dciws, disable=not verbose)):
+        # interpolate to change in range of dr_bin
+        dciws_interp.append(dciw.interp({'range':np.arange(0,100,dr_bin)}))
+
+        # make sure range is first dimension
+        dciws_interp[k] = dciws_interp[k].transpose('range', 'depth')
+        # add cosine taper
+        cos_tap = np.expand_dims(np.cos(np.linspace(-np.pi/2, np.pi/2, dciws_interp[k].sizes['range']))**2, 1)
+        if k == 0:
+            cos_tap[:int(dciws_interp[k].sizes['range']/2)] = 1
+        elif k == (len(dciws)-1):
+            cos_tap[int(dciws_interp[k].sizes['range']/2):] = 1
+        dciws_interp[k] = precision.as_real(dciws_interp[k] * cos_tap)
+        # reassign range relative coordinates
+        dciws_interp[k] = dciws_interp[k].assign_coords({'range':np.arange(0,100,dr_bin) + 50*k})
+
+    # merge sections
+    if verbose:
+        print('merging sections...')
+    dciws_mixed = dciws_interp[0]
+    for k in tqdm(range(1,len(dciws_interp)), disable=not verbose):
+        a,b = xr.align(dciws_mixed, dciws_interp[k], fill_value=0, join='outer')
+        dciws_mixed = a+b
+
+    return precision.as_real(dciws_mixed)
+
+
+
+# error allowed in stored perturbations [m/s] and chunks of the stored files
+dciw_tolerance = 1e-3
+dciw_chunks = {'range':256, 'depth':512}
+
+
+def keepbits(values, tolerance : float):
+    '''
+    keepbits - number of mantissa bits needed to round values with an error of at most tolerance
+
+    the rounding error of a value with binary exponent e is at most
+    2**(e - keepbits - 1), so the largest magnitude sets the number of bits
+    '''
+    values = np.asarray(values)
+    max_abs = np.nanmax(np.abs(values)) if values.size > 0 else 0
+    n_mantissa = np.finfo(values.dtype).nmant
+    if (max_abs == 0) or not np.isfinite(max_abs):
+        return 0
+    bits = int(np.ceil(np.floor(np.log2(max_abs)) - 1 - np.log2(tolerance)))
+    return int(np.clip(bits, 0, n_mantissa))
+
+
+def bitround(values, keepbits : int):
+    '''
+    bitround - round the mantissa of floating point values to keepbits bits (round to nearest, ties to even)
+
+    the trailing zero bits compress well, values are returned with the same dtype
+    '''
+    values = np.array(values)
+    n_mantissa = np.finfo(values.dtype).nmant
+    if keepbits >= n_mantissa:
+        return values
+    uint = np.dtype(f'uint{values.dtype.itemsize*8}').type
+    maskbits = n_mantissa - keepbits
+    mask = ~uint((1 << maskbits) - 1)
+    half = uint((1 << (maskbits - 1)) - 1)
+    bits = values.view(uint)
+    rounded = ((bits + ((bits >> uint(maskbits)) & uint(1)) + half) & mask).view(values.dtype)
+    return np.where(np.isfinite(values), rounded, values)
+
+
+def write_realization(dciw : xr.DataArray, fn : str, tolerance : float = dciw_tolerance, chunks : dict = None, complevel : int = 4):
+    '''
+    write_realization - write a merged perturbation as chunked, compressed netcdf
+
+    Parameters
+    ----------
+    dciw : xr.DataArray
+        merged perturbation (range [km], depth)
+    fn : str
+        output file, written to a temporary file first
+    tolerance : float
+        largest rounding error of the stored perturbation [m/s], the mantissa
+        is kept with just enough bits (keepbits). No rounding if None
+    chunks : dict
+        chunk size per dimension, dciw_chunks if None
+    complevel : int
+        zlib compression level
+
+    Returns
+    -------
+    dict
+        keepbits and the max_error of the stored values [m/s]
+    '''
+    chunks = dciw_chunks if chunks is None else chunks
+    values = dciw.values
+    bits = np.finfo(values.dtype).nmant
+    if tolerance is not None:
+        bits = keepbits(values, tolerance)
+        values = bitround(values, bits)
+
+    stored = dciw.copy(data=values)
+    stored.attrs.update({'keepbits':bits, 'tolerance':tolerance if tolerance is not None else 0})
+    encoding = {
+        'zlib':True,
+        'complevel':complevel,
+        'shuffle':True,
+        'chunksizes':tuple(min(chunks.get(dim, size), size) for dim, size in stored.sizes.items()),
+    }
+    name = stored.name if stored.name is not None else '__xarray_dataarray_variable__'
+
+    os.makedirs(os.path.dirname(fn) or '.', exist_ok=True)
+    tmp = f'{fn}.{os.getpid()}.tmp'
+    stored.to_netcdf(tmp, encoding={name:encoding})
+    os.replace(tmp, fn)
+
+    return {'keepbits':bits, 'max_error':float(np.nanmax(np.abs(values - dciw.values))) if values.size > 0 else 0.0}
+
+
+def stored_params(fn : str):
+    '''
+    stored_params - tolerance, complevel and precision a merged realization file was written with
+
+    in the form of the params of merge_dciw.py. Files written before
+    write_realization have no tolerance attribute and are lossless
+    (tolerance None), complevel is None for uncompressed files
+    '''
+    with xr.open_dataarray(fn) as da:
+        tolerance = da.attrs.get('tolerance', 0)
+        complevel = da.encoding.get('complevel') if da.encoding.get('zlib', False) else None
+        dtype = np.dtype(da.dtype)
+    return {
+        'tolerance':float(tolerance) if tolerance else None,
+        'complevel':int(complevel) if complevel is not None else None,
+        'precision':next((name for name, (real, _) in precision.dtypes.items() if np.dtype(real) == dtype), str(dtype)),
+    }
+
+
+def window_means(tsc : xr.Dataset, step : float = 50, width : float = 100):
+    '''
+    window_means - means of every variable over range windows [step*k, step*k + width]
+
+    uses cumulative sums over range, so all windows are computed at once.
+    NaNs are skipped, as in ``xr.Dataset.mean``. The number of windows is the
+    same as the original loop in get_100km_ocean_sections.py.
+
+    Parameters
+    ----------
+    tsc : xr.Dataset
+        variables with dimensions (range, depth) and a lat coordinate along range
+    step : float
+        spacing of the windows [km]
+    width : float
+        width of the windows [km]
+
+    Returns
+    -------
+    means : xr.Dataset
+        variables with dimensions (range, depth), where range is the mean range
+        of each window
+    '''
+    tsc = tsc.transpose('range', 'depth')
+    ranges = tsc.range.values
+    n_sections = int((ranges[-2] - width)/step) + 1
+
+    # window bounds, inclusive as with tsc.sel({'range':slice(start, stop)})
+    starts = step*np.arange(n_sections)
+    lo = np.searchsorted(ranges, starts, side='left')
+    hi = np.searchsorted(ranges, starts + width, side='right')
+
+    def windowed(values):
+        valid = ~np.isnan(values)
+        pad = [(1, 0)] + [(0, 0)]*(values.ndim - 1)
+        total = np.pad(np.cumsum(np.where(valid, values, 0), axis=0), pad)
+        count = np.pad(np.cumsum(valid, axis=0), pad)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (total[hi] - total[lo]) / (count[hi] - count[lo])
+
+    mean_range = windowed(ranges.astype(float))
+    means = xr.Dataset(
+        {var: (('range', 'depth'), windowed(tsc[var].values)) for var in tsc.data_vars},
+        coords={
+            'range':mean_range,
+            'depth':tsc.depth.values,
+            'lat':('range', windowed(tsc.lat.values.astype(float))),
+        },
+    )
+    return means
+
+
+def compute_sections(tsc : xr.Dataset, depths = np.arange(0,5000), step : float = 50, width : float = 100):
+    '''
+    compute_sections - 100 km averaged T, S, C and N^2 sections along a path
+
+    input for the internal wave model (see KB2OOI_real_func.m). N^2 is computed
+    with a single gsw.Nsquared call for all sections.
+
+    Parameters
+    ----------
+    tsc : xr.Dataset
+        T, S and C from envy.get_TSC_slice
+    depths : array like
+        depth grid of the output
+    step, width : float
+        spacing and width of the sections [km]
+
+    Returns
+    -------
+    sections : xr.Dataset
+        T, S, C, N2 and pmid with dimensions (range, depth)
+    '''
+    import gsw
+
+    sections = window_means(tsc, step=step, width=width)
+
+    N2, pmid = gsw.Nsquared(
+        sections.S.values,
+        sections.T.values,
+        sections.depth.values[np.newaxis, :],
+        lat=sections.lat.values[:, np.newaxis],
+        axis=1,
+    )
+    sections['N2'] = xr.DataArray(N2, dims=['range', 'depth'], coords={'depth':sections.depth[:-1]})
+    sections['pmid'] = xr.DataArray(pmid, dims=['range', 'depth'], coords={'depth':sections.depth[:-1]})
+
+    return sections.interp({'depth':depths}, method='linear')
+
+
+def load_ocean_sections(hydrophone : str = 'LJ01D'):
+    '''
+    load_ocean_sections - open the 100 km averaged ocean sections and smooth them
+
+    the sound speed and buoyancy frequency profiles are low pass filtered in
+    depth (4th order butterworth, 100 m cutoff), as in KB2OOI_real_func.m
+
+    Parameters
+    ----------
+    hydrophone : str
+        hydrophone of the path, LJ01D is the longest path and is used for all nodes
+
+    Returns
+    -------
+    tsc : xr.Dataset
+        sections with smoothed variables Cf and Nf
+    '''
+    fn = f'{os.environ["data_directory"]}iws/KB_2_{hydrophone}.nc'
+    tsc = xr.open_dataset(fn).load().transpose('range', 'depth')
+
+    # compute N (N^2 is provided)
+    N = np.sqrt(np.abs(tsc.N2))
+
+    dz = float(tsc.depth[1] - tsc.depth[0])
+    fN = 2*np.pi/(2*dz)
+    fc1 = 2*np.pi/100
+    B1, A1 = signal.butter(4, fc1/fN)
+
+    tsc['Cf'] = (('range', 'depth'), signal.filtfilt(B1, A1, tsc.C.values, axis=-1))
+    tsc['Nf'] = (('range', 'depth'), signal.filtfilt(B1, A1, N.values, axis=-1))
+    return tsc
+
+
+def generate_sections(tsc : xr.Dataset, seed : int, time : float = 100, verbose : bool = True):
+    '''
+    generate_sections - compute internal wave sections for every range of tsc
+
+    uses the same seed scheme as KB2OOI_real_func.m (the seed is incremented
+    before every section). Note that the python and MATLAB random number
+    generators differ, so the same seed does not reproduce the MATLAB sections.
+
+    Parameters
+    ----------
+    tsc : xr.Dataset
+        output of load_ocean_sections
+    seed : int
+        starting seed (real_idx*81 for realizations)
+    time : float
+        time passed to iwGMtfast
+    verbose : bool
+        whether to print out progress
+
+    Returns
+    -------
+    dciws : list
+        list of xr.DataArray (range [km], depth), truncated to 110 km
+    '''
+    import iwGM
+
+    dciws = []
+    for idx in tqdm(range(tsc.sizes['range']), disable=not verbose):
+        # new seed for every run
+        seed = seed + 1
+        section = tsc.isel({'range':idx})
+
+        zetaiw, dciw, ziw, xiw, jmax = iwGM.iwGMtfast(
+            iw_params['zeta0'],
+            section.Nf.values,
+            section.Cf.values,
+            tsc.depth.values.astype(float),
+            float(section.lat),
+            time,
+            seed,
+            iw_params['jstar'],
+            iw_params['dca'],
+            iw_params['StrainThreshold'],
+        )
+
+        xiw = np.asarray(xiw).flatten()
+        # first point past 110 km, kept like dciw(:,1:x100km_idx) in KB2OOI_real_func.m
+        x100km_idx = np.argmax(xiw > 110000)
+
+        dciws.append(
+            xr.DataArray(
+                np.asarray(dciw)[:, :x100km_idx + 1],
+                dims=['depth', 'range'],
+                coords={'depth':np.asarray(ziw).flatten(), 'range':xiw[:x100km_idx + 1]/1000}
+            ).transpose('range', 'depth')
+        )
+    return dciws
+
+
+def generate_realization(real_idx : int, hydrophone : str = 'LJ01D', cache_dir : str = None, tsc : xr.Dataset = None, verbose : bool = True):
+    '''
+    generate_realization - build a merged internal wave realization in memory
+
+    Parameters
+    ----------
+    real_idx : int
+        realization index, the seed is real_idx*81 as in KB2OOI_real_func.m
+    hydrophone : str
+        hydrophone of the ocean sections
+    cache_dir : str
+        if given, the merged realization is read from / written to
+        ``{cache_dir}dciw_{real_idx:03}.nc`` so other nodes can reuse it
+    tsc : xr.Dataset
+        already loaded ocean sections (output of load_ocean_sections)
+    verbose : bool
+        whether to print out progress
+
+    Returns
+    -------
+    dciw : xr.DataArray
+        merged perturbation (range [km], depth)
+    '''
+    if cache_dir is not None:
+        fn = f'{cache_dir}dciw_{real_idx:03}.nc'
+        if os.path.exists(fn):
+            return precision.as_real(xr.open_dataarray(fn).load())
+
+    if tsc is None:
+        tsc = load_ocean_sections(hydrophone)
+
+    dciw = merge_sections(generate_sections(tsc, real_idx*81, verbose=verbose), verbose=verbose)
+
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        # written to a temporary file so that other workers never read a partial file
+        write_realization(dciw, fn)
+
+    return dciw
+
+
+def generate_time_step(time : float, seed : int = 0, tsc : xr.Dataset = None, verbose : bool = True):
+    '''
+    generate_time_step - merged perturbation of the time coherence realization at time [s]
+
+    a full iwGMtfast realization per time step, as KB2OOI_time_func.m
+    (time_idx * 27.28 s, seed 0)
+    '''
+    if tsc is None:
+        tsc = load_ocean_sections()
+    return merge_sections(generate_sections(tsc, seed, time=time, verbose=verbose), verbose=verbose)
+
+
+# rotation rate of the earth [rad/s]
+earth_rotation = 7.2921e-5
+
+
+def _stretched_grid(N : np.ndarray, z : np.ndarray):
+    # WKB stretched depth xi in [0, 1] and total of N over depth
+    N = np.maximum(N, 1e-3*np.max(N))
+    xi = np.concatenate(([0], np.cumsum((N[1:] + N[:-1])/2*np.diff(z))))
+    return xi/xi[-1], xi[-1], N
+
+
+class SpectralSection:
+    '''
+    SpectralSection - linear internal wave section evolved in time by a phase advance
+
+    The displacement of a section is decomposed into WKB vertical modes
+    sqrt(N0/N) sin(j pi xi(z)) (a sine transform in stretched depth) and
+    horizontal wavenumbers (an FFT in range). Every (j, k) component
+    oscillates at omega^2 = f^2 + k^2 (B / (j pi))^2, B = int N dz, so the
+    section at any time is c0 cos(omega t) + s sin(omega t). c0 and s are
+    fitted from two iwGMtfast snapshots of the same seed, at t0 and t0 + dt.
+    The sound speed perturbation is G(z) * displacement, with G fitted by
+    least squares from the snapshots.
+
+    This (hydrostatic) omega is not bounded by N, and s = (c1 - c0
+    cos(omega dt)) / sin(omega dt) is ill conditioned where omega dt is close
+    to a multiple of pi. Components with omega >= N_max (not internal waves)
+    or omega dt > pi/2 are set to zero before the division. The WKB modes are
+    not the modes of iwGMtfast, so the evolved section is only an
+    approximation of iwGMtfast at later times, see ``error``.
+
+    Parameters
+    ----------
+    zeta0, zeta1 : np.ndarray
+        displacement (depth, range) at t0 and t0 + dt
+    dciw0, dciw1 : np.ndarray
+        sound speed perturbation (depth, range) at t0 and t0 + dt
+    z : np.ndarray
+        depth [m]
+    x : np.ndarray
+        range [m], uniformly spaced
+    N : np.ndarray
+        buoyancy frequency [rad/s] on z
+    lat : float
+        latitude of the section
+    t0, dt : float
+        times of the snapshots [s]
+    '''
+
+    def __init__(self, zeta0, zeta1, dciw0, dciw1, z, x, N, lat, t0, dt):
+        from scipy import fft
+
+        self.z = np.asarray(z, dtype=float)
+        self.x = np.asarray(x, dtype=float)
+        self.t0 = t0
+        self.xi, B, N = _stretched_grid(np.asarray(N, dtype=float), self.z)
+        self.scale = np.sqrt(N/np.max(N))[:, np.newaxis]
+
+        # uniform interior stretched grid for the sine transform
+        n_modes = len(self.z)
+        self.xi_grid = np.arange(1, n_modes + 1)/(n_modes + 1)
+
+        f = 2*earth_rotation*np.sin(np.radians(lat))
+        k = 2*np.pi*fft.fftfreq(len(self.x), self.x[1] - self.x[0])
+        j = np.arange(1, n_modes + 1)
+        self.omega = np.sqrt(f**2 + (k[np.newaxis, :]*B/(j[:, np.newaxis]*np.pi))**2)
+
+        c0 = self._forward(zeta0)
+        c1 = self._forward(zeta1)
+        wdt = self.omega*dt
+        # sin(omega dt) >= sin(f dt) > 0 for the components that are kept
+        self.valid = (self.omega < np.max(N)) & (wdt <= np.pi/2)
+        self.c0 = np.where(self.valid, c0, 0)
+        self.s = np.where(self.valid, (c1 - c0*np.cos(wdt)) / np.where(self.valid, np.sin(wdt), 1), 0)
+
+        zeta = np.concatenate([zeta0, zeta1], axis=1)
+        dciw = np.concatenate([dciw0, dciw1], axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.G = np.nan_to_num(np.sum(dciw*zeta, axis=1)/np.sum(zeta**2, axis=1))[:, np.newaxis]
+
+    def _forward(self, zeta):
+        from scipy import fft
+        from scipy.interpolate import interp1d
+
+        scaled = interp1d(self.xi, np.asarray(zeta)*self.scale, axis=0)(self.xi_grid)
+        return fft.fft(fft.dst(scaled, type=1, axis=0), axis=1)
+
+    def _inverse(self, coefs):
+        from scipy import fft
+
+        scaled = fft.idst(fft.ifft(coefs, axis=1).real, type=1, axis=0)
+        # the modes vanish at the surface and bottom
+        xi = np.concatenate(([0], self.xi_grid, [1]))
+        scaled = np.concatenate([np.zeros((1, scaled.shape[1])), scaled, np.zeros((1, scaled.shape[1]))])
+        zeta = np.stack([np.interp(self.xi, xi, column) for column in scaled.T], axis=1)
+        return zeta / self.scale
+
+    def displacement(self, t : float):
+        '''
+        displacement - displacement (depth, range) at time t [s]
+        '''
+        wt = self.omega*(t - self.t0)
+        return self._inverse(self.c0*np.cos(wt) + self.s*np.sin(wt))
+
+    def dciw(self, t : float):
+        '''
+        dciw - sound speed perturbation (depth, range) at time t [s]
+        '''
+        return self.G*self.displacement(t)
+
+    def error(self, t : float, dciw : np.ndarray):
+        '''
+        error - relative rms error of the sound speed perturbation at time t [s] against dciw (depth, range)
+        '''
+        dciw = np.asarray(dciw)
+        return float(np.sqrt(np.mean((self.dciw(t) - dciw)**2) / max(np.mean(dciw**2), np.finfo(float).tiny)))
+
+
+def _iw_snapshot(section : xr.Dataset, depth : np.ndarray, time : float, seed : int):
+    import iwGM
+
+    zetaiw, dciw, ziw, xiw, jmax = iwGM.iwGMtfast(
+        iw_params['zeta0'],
+        section.Nf.values,
+        section.Cf.values,
+        depth,
+        float(section.lat),
+        time,
+        seed,
+        iw_params['jstar'],
+        iw_params['dca'],
+        iw_params['StrainThreshold'],
+    )
+    return np.asarray(zetaiw), np.asarray(dciw), np.asarray(ziw).flatten(), np.asarray(xiw).flatten()
+
+
+def spectral_sections(tsc : xr.Dataset, seed : int, t_check : float, t0 : float = 0, dt : float = None, max_error : float = 0.1, verbose : bool = True):
+    '''
+    spectral_sections - SpectralSection for every range of tsc from two iwGMtfast snapshots
+
+    every section is checked against a third iwGMtfast snapshot at t_check,
+    which is not used in the fit. It should be the last time that is needed,
+    the error of the phase advance grows with time.
+
+    Parameters
+    ----------
+    tsc : xr.Dataset
+        output of load_ocean_sections
+    seed : int
+        starting seed, incremented before every section as in generate_sections
+    t_check : float
+        time of the check snapshot [s]
+    t0 : float
+        time of the first snapshot [s]
+    dt : float
+        time between the snapshots [s]. Defaults to pi / (2 N_max) of each
+        section, so that omega*dt <= pi/2 for every component with
+        omega < N_max. Components with a larger omega*dt are dropped
+        (see SpectralSection)
+    max_error : float
+        largest relative rms error of the sound speed perturbation of a
+        section against the check snapshot
+    verbose : bool
+        whether to print out progress
+
+    Returns
+    -------
+    sections : list of SpectralSection
+        with the error at t_check as ``check_error``
+
+    Raises
+    ------
+    ValueError
+        if a section differs from its check snapshot by more than max_error
+    '''
+    depth = tsc.depth.values.astype(float)
+    sections = []
+    for idx in tqdm(range(tsc.sizes['range']), disable=not verbose):
+        seed = seed + 1
+        section = tsc.isel({'range':idx})
+        dt_section = dt if dt is not None else np.pi/(2*float(section.Nf.max()))
+
+        zeta0, dciw0, ziw, xiw = _iw_snapshot(section, depth, t0, seed)
+        zeta1, dciw1, _, _ = _iw_snapshot(section, depth, t0 + dt_section, seed)
+        _, dciw_check, _, _ = _iw_snapshot(section, depth, t_check, seed)
+        N = np.interp(ziw, depth, section.Nf.values)
+        spectral = SpectralSection(zeta0, zeta1, dciw0, dciw1, ziw, xiw, N, float(section.lat), t0, dt_section)
+        spectral.check_error = spectral.error(t_check, dciw_check)
+        if spectral.check_error > max_error:
+            raise ValueError(
+                f'section {idx} (seed {seed}) differs from iwGMtfast at {t_check:.2f} s by a relative rms error '
+                f'of {spectral.check_error:.3f}, more than {max_error}'
+            )
+        sections.append(spectral)
+    return sections
+
+
+class IWTimeSeries:
+    '''
+    IWTimeSeries - merged internal wave perturbation of one realization at any time
+
+    the spectral amplitudes of every section are computed once
+    (spectral_sections), and each time step costs one inverse transform per
+    section and a merge, instead of a full realization. Only valid up to
+    t_check, where every section was checked against iwGMtfast.
+
+    Parameters
+    ----------
+    seed : int
+        starting seed of the realization, KB2OOI_time_func.m uses 0
+    t_check : float
+        last time that is needed [s], passed to spectral_sections
+    tsc : xr.Dataset
+        output of load_ocean_sections, loaded if None
+    t0, dt, max_error : float
+        passed to spectral_sections
+    '''
+
+    def __init__(self, seed : int, t_check : float, tsc : xr.Dataset = None, t0 : float = 0, dt : float = None, max_error : float = 0.1, verbose : bool = True):
+        if tsc is None:
+            tsc = load_ocean_sections()
+        self.verbose = verbose
+        self.t_check = t_check
+        self.sections = spectral_sections(tsc, seed, t_check, t0=t0, dt=dt, max_error=max_error, verbose=verbose)
+        # largest error of the sections against iwGMtfast at t_check
+        self.check_error = max(section.check_error for section in self.sections)
+
+    def at(self, t : float):
+        '''
+        at - merged perturbation (range [km], depth) at time t [s]
+        '''
+        dciws = []
+        for section in self.sections:
+            # first point past 110 km, as in generate_sections
+            x100km_idx = np.argmax(section.x > 110000)
+            dciws.append(
+                xr.DataArray(
+                    section.dciw(t)[:, :x100km_idx + 1],
+                    dims=['depth', 'range'],
+                    coords={'depth':section.z, 'range':section.x[:x100km_idx + 1]/1000}
+                ).transpose('range', 'depth')
+            )
+        return merge_sections(dciws, verbose=False)
+
+    def stream(self, times):
+        '''
+        stream - yield (time, merged perturbation) for every time [s] in times
+        '''
+        for t in times:
+            yield t, self.at(t)
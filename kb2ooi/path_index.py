@@ -0,0 +1,406 @@
+'''
+path_index.py - precomputed great circle points and interpolation stencils into the global grids
+
+envy.get_ssp_slice and envy.get_bathymetry_slice find the great circle
+points and interpolate the global climatology and bathymetry every time a
+slice is requested. ``PathIndex`` stores, for a (source, receiver,
+num_range_points) path, the great circle points and the bilinear stencil
+(four grid indices and weights per point) into every grid, so a slice is a
+gather of four grid cells per point and a weighted sum. Indices are written
+to ``<data_directory>path_index/`` and ``get_index`` derives a new
+resolution from the finest cached index of the same path instead of
+rebuilding it: ranges that are on the finest path reuse its stencils, other
+ranges are interpolated along the great circle and get new stencils from the
+stored grid axes.
+
+The global grids are read from the files set in the .env file
+(``ssp_climate_path``, ``ssp_monthly_path``, ``bathymetry_path``), each with a
+single variable on (lat, lon) and any other dimensions (depth, time), in the
+sign conventions of the envy slices. ``load_path`` returns slices in the
+layout of pe.load_path (range [km], depth / time, with lat and lon along
+range).
+'''
+
+import os
+import json
+import numpy as np
+import xarray as xr
+from kaooi.coordinates import coords
+
+from kb2ooi import paths
+
+# environment variables with the global grid files
+grid_paths = {
+    'ssp_climate':'ssp_climate_path',
+    'ssp_monthly':'ssp_monthly_path',
+    'bathymetry':'bathymetry_path',
+}
+
+
+def default_index_dir():
+    return f'{os.environ["data_directory"]}path_index/'
+
+
+def index_path(source : str, receiver : str, num_range_points : int, index_dir : str = None):
+    index_dir = default_index_dir() if index_dir is None else index_dir
+    return f'{index_dir}{source}_{receiver}_{num_range_points}.npz'
+
+
+def great_circle(start, end, num_range_points : int):
+    '''
+    great_circle - evenly spaced points on the great circle from start to end
+
+    Returns
+    -------
+    lat, lon : np.ndarray
+        [degrees], lon in [-180, 180)
+    ranges : np.ndarray
+        range from start [km]
+    '''
+    return _slerp(start, end, np.linspace(0, 1, num_range_points))
+
+
+def _slerp(start, end, fraction):
+    lat1, lon1 = np.radians(start[0]), np.radians(start[1])
+    lat2, lon2 = np.radians(end[0]), np.radians(end[1])
+    p1 = np.array([np.cos(lat1)*np.cos(lon1), np.cos(lat1)*np.sin(lon1), np.sin(lat1)])
+    p2 = np.array([np.cos(lat2)*np.cos(lon2), np.cos(lat2)*np.sin(lon2), np.sin(lat2)])
+    omega = np.arccos(np.clip(np.dot(p1, p2), -1, 1))
+    fraction = np.asarray(fraction, dtype=float)[:, None]
+    if omega == 0:
+        p = np.repeat(p1[None, :], len(fraction), axis=0)
+    else:
+        p = (np.sin((1 - fraction)*omega)*p1 + np.sin(fraction*omega)*p2) / np.sin(omega)
+    lat = np.degrees(np.arcsin(np.clip(p[:, 2], -1, 1)))
+    lon = (np.degrees(np.arctan2(p[:, 1], p[:, 0])) + 180) % 360 - 180
+    return lat, lon, fraction[:, 0]*omega*paths.earth_radius
+
+
+def _axis_stencil(axis : np.ndarray, x : np.ndarray, periodic : bool = False):
+    # lower / upper index and weight of the upper index of x on a sorted axis
+    n = len(axis)
+    if periodic:
+        x = axis[0] + np.mod(x - axis[0], 360)
+        i0 = np.clip(np.searchsorted(axis, x, side='right') - 1, 0, n - 1)
+        i1 = (i0 + 1) % n
+        span = np.where(i1 == 0, axis[0] + 360 - axis[i0], axis[i1] - axis[i0])
+    else:
+        i0 = np.clip(np.searchsorted(axis, x, side='right') - 1, 0, n - 2)
+        i1 = i0 + 1
+        span = axis[i1] - axis[i0]
+    t = np.clip((x - axis[i0]) / span, 0, 1)
+    return i0, i1, t
+
+
+def bilinear_stencil(grid_lat : np.ndarray, grid_lon : np.ndarray, lat : np.ndarray, lon : np.ndarray):
+    '''
+    bilinear_stencil - grid indices and weights of the four cells around every point
+
+    the longitude axis is treated as periodic if it covers the globe
+
+    Returns
+    -------
+    ilat, ilon : np.ndarray
+        (n_points, 4) indices into the grid axes
+    weights : np.ndarray
+        (n_points, 4) bilinear weights
+    '''
+    grid_lat = np.asarray(grid_lat, dtype=float)
+    grid_lon = np.asarray(grid_lon, dtype=float)
+    lat_flip = grid_lat[0] > grid_lat[-1]
+    if lat_flip:
+        grid_lat = grid_lat[::-1]
+    spacing = np.median(np.diff(grid_lon))
+    periodic = (grid_lon[-1] - grid_lon[0] + spacing) >= 360 - 1e-6
+
+    a0, a1, ta = _axis_stencil(grid_lat, lat)
+    o0, o1, to = _axis_stencil(grid_lon, lon, periodic=periodic)
+    if lat_flip:
+        a0, a1 = len(grid_lat) - 1 - a0, len(grid_lat) - 1 - a1
+
+    ilat = np.stack([a0, a0, a1, a1], axis=1)
+    ilon = np.stack([o0, o1, o0, o1], axis=1)
+    weights = np.stack([(1 - ta)*(1 - to), (1 - ta)*to, ta*(1 - to), ta*to], axis=1)
+    return ilat, ilon, weights
+
+
+class PathIndex:
+    '''
+    PathIndex - great circle points of a path and their stencils into global grids
+
+    Parameters
+    ----------
+    source, receiver : str
+        names in kaooi.coordinates.coords
+    num_range_points : int
+        number of points on the path
+    '''
+
+    def __init__(self, source : str, receiver : str, num_range_points : int):
+        self.source = source
+        self.receiver = receiver
+        self.num_range_points = num_range_points
+        self.lat, self.lon, self.ranges = great_circle(coords[source], coords[receiver], num_range_points)
+        self.axes = {}
+        self.stencils = {}
+
+    def add_grid(self, name : str, grid_lat, grid_lon):
+        '''
+        add_grid - compute the stencils into a grid with axes grid_lat, grid_lon
+        '''
+        self.axes[name] = (np.asarray(grid_lat, dtype=float), np.asarray(grid_lon, dtype=float))
+        self.stencils[name] = bilinear_stencil(*self.axes[name], self.lat, self.lon)
+
+    def gather(self, name : str, grid : xr.DataArray, block_size : int = 256):
+        '''
+        gather - slice of a grid along the path from the stored stencil
+
+        the grid is read in blocks of range points, each block only reads the
+        grid cells around its part of the path. Weights of NaN (land) cells
+        are set to zero and the remaining weights are renormalized.
+
+        Parameters
+        ----------
+        name : str
+            grid name used in add_grid
+        grid : xr.DataArray
+            global grid with lat and lon dimensions, may be lazily loaded
+        block_size : int
+            number of range points per block
+
+        Returns
+        -------
+        xr.DataArray
+            (range [km], other dimensions of grid) with lat and lon along range
+        '''
+        ilat, ilon, weights = self.stencils[name]
+        other_dims = [dim for dim in grid.dims if dim not in ('lat', 'lon')]
+        grid = grid.transpose('lat', 'lon', *other_dims)
+
+        blocks = []
+        for start in range(0, self.num_range_points, block_size):
+            block = slice(start, start + block_size)
+            # read the cells of this block once, then index them in memory
+            ulat, lat_idx = np.unique(ilat[block], return_inverse=True)
+            ulon, lon_idx = np.unique(ilon[block], return_inverse=True)
+            cells = grid.isel({'lat':ulat, 'lon':ulon}).values
+            values = cells[lat_idx.reshape(ilat[block].shape), lon_idx.reshape(ilon[block].shape)]
+
+            w = np.broadcast_to(weights[block].reshape(weights[block].shape + (1,)*len(other_dims)), values.shape).copy()
+            valid = np.isfinite(values)
+            w[~valid] = 0
+            total = w.sum(axis=1)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                blocks.append((np.where(valid, values, 0)*w).sum(axis=1) / total)
+        values = np.concatenate(blocks, axis=0)
+
+        return xr.DataArray(
+            values,
+            dims=['range'] + other_dims,
+            coords={
+                'range':self.ranges,
+                'lat':('range', self.lat),
+                'lon':('range', self.lon),
+                **{dim: grid[dim].values for dim in other_dims if dim in grid.coords},
+            },
+            name=grid.name,
+        )
+
+    def derive(self, num_range_points : int):
+        '''
+        derive - index of the same path with a different number of points
+
+        points that are on this path keep their stencils, the others are
+        interpolated along the great circle and get new stencils from the
+        stored grid axes
+        '''
+        index = PathIndex.__new__(PathIndex)
+        index.source, index.receiver, index.num_range_points = self.source, self.receiver, num_range_points
+        index.lat, index.lon, index.ranges = great_circle(coords[self.source], coords[self.receiver], num_range_points)
+        index.axes = dict(self.axes)
+        index.stencils = {}
+
+        position = np.linspace(0, self.num_range_points - 1, num_range_points)
+        on_path = np.isclose(position, np.round(position), rtol=0, atol=1e-9)
+        nearest = np.round(position).astype(int)
+        for name, (ilat, ilon, weights) in self.stencils.items():
+            new = bilinear_stencil(*index.axes[name], index.lat[~on_path], index.lon[~on_path]) if (~on_path).any() else None
+            stencil = []
+            for k, array in enumerate((ilat, ilon, weights)):
+                out = np.empty((num_range_points, 4), dtype=array.dtype)
+                out[on_path] = array[nearest[on_path]]
+                if new is not None:
+                    out[~on_path] = new[k]
+                stencil.append(out)
+            index.stencils[name] = tuple(stencil)
+        return index
+
+    def save(self, fn : str):
+        '''
+        save - write the index, written to a temporary file first
+        '''
+        arrays = {'lat':self.lat, 'lon':self.lon, 'ranges':self.ranges}
+        for name in self.stencils:
+            arrays[f'{name}_grid_lat'], arrays[f'{name}_grid_lon'] = self.axes[name]
+            arrays[f'{name}_ilat'], arrays[f'{name}_ilon'], arrays[f'{name}_weights'] = self.stencils[name]
+        meta = {'source':self.source, 'receiver':self.receiver, 'num_range_points':self.num_range_points, 'grids':list(self.stencils)}
+
+        os.makedirs(os.path.dirname(fn), exist_ok=True)
+        tmp = f'{fn}.{os.getpid()}.tmp.npz'
+        np.savez(tmp, meta=json.dumps(meta), **arrays)
+        os.replace(tmp, fn)
+
+    @classmethod
+    def load(cls, fn : str):
+        '''
+        load - index written by save
+        '''
+        state = np.load(fn)
+        meta = json.loads(str(state['meta']))
+        index = cls.__new__(cls)
+        index.source, index.receiver, index.num_range_points = meta['source'], meta['receiver'], meta['num_range_points']
+        index.lat, index.lon, index.ranges = state['lat'], state['lon'], state['ranges']
+        index.axes, index.stencils = {}, {}
+        for name in meta['grids']:
+            index.axes[name] = (state[f'{name}_grid_lat'], state[f'{name}_grid_lon'])
+            index.stencils[name] = (state[f'{name}_ilat'], state[f'{name}_ilon'], state[f'{name}_weights'])
+        return index
+
+
+def open_grid(name : str):
+    '''
+    open_grid - lazily open a global grid from the file set in the .env file (see grid_paths)
+    '''
+    fn = os.environ.get(grid_paths[name])
+    if fn is None:
+        raise KeyError(f'{grid_paths[name]} is not set in the .env file')
+    if fn.rstrip('/').endswith('.zarr'):
+        ds = xr.open_zarr(fn)
+    else:
+        ds = xr.open_dataset(fn)
+    return ds[list(ds.data_vars)[0]]
+
+
+# largest differences from the envy slices for a path to pass the comparison of build_path_index.py --compare
+tolerances = {
+    'ssp':0.05,  # m/s
+    'bathymetry':1.0,  # m
+    'range':1e-3,  # km
+    'latlon':1e-5,  # degrees
+}
+
+
+def available():
+    '''
+    available - whether all global grid files are set in the .env file
+    '''
+    return all(var in os.environ for var in grid_paths.values())
+
+
+def report_path(index_dir : str = None):
+    index_dir = default_index_dir() if index_dir is None else index_dir
+    return f'{index_dir}report.json'
+
+
+def compare_slices(gathered : xr.DataArray, reference : xr.DataArray):
+    '''
+    compare_slices - largest differences of a gathered slice from the envy slice in values, range, lat and lon
+
+    lat / lon are only compared when both slices have them, the others are None
+    '''
+    diff = {
+        'values':float(np.nanmax(np.abs(gathered.values - reference.transpose(*gathered.dims).values))),
+        'range':float(np.max(np.abs(gathered.range.values - reference.range.values))),
+        'lat':None,
+        'lon':None,
+    }
+    for coord in ['lat', 'lon']:
+        if (coord in gathered.coords) and (coord in reference.coords):
+            d = gathered[coord].values - reference[coord].values
+            if coord == 'lon':
+                d = (d + 180) % 360 - 180
+            diff[coord] = float(np.max(np.abs(d)))
+    return diff
+
+
+def passed(diffs : dict, variable : str):
+    '''
+    passed - whether the differences of compare_slices are within tolerances
+    '''
+    checks = [(diffs['values'], tolerances[variable]), (diffs['range'], tolerances['range'])]
+    checks += [(diffs[coord], tolerances['latlon']) for coord in ['lat', 'lon'] if diffs[coord] is not None]
+    return all(np.isfinite(d) and (d <= tolerance) for d, tolerance in checks)
+
+
+def validated(node : str, num_range_points : int, source : str = 'KB', index_dir : str = None):
+    '''
+    validated - whether build_path_index.py --compare recorded a passing comparison of the path at this resolution
+    '''
+    fn = report_path(index_dir)
+    if not os.path.exists(fn):
+        return False
+    with open(fn) as f:
+        report = json.load(f)
+    entry = report.get(f'{source}_{node}', {}).get(str(num_range_points), {})
+    return bool(entry.get('passed', False))
+
+
+def get_index(source : str, receiver : str, num_range_points : int, grids : dict = None, index_dir : str = None):
+    '''
+    get_index - cached index of a path, derived from the finest cached index of the path or built
+
+    Parameters
+    ----------
+    source, receiver : str
+    num_range_points : int
+    grids : dict
+        {name: xr.DataArray} grids to index when the path has no cached index,
+        opened with open_grid if None
+    index_dir : str
+        default_index_dir() if None
+
+    Returns
+    -------
+    PathIndex
+    '''
+    index_dir = default_index_dir() if index_dir is None else index_dir
+    fn = index_path(source, receiver, num_range_points, index_dir)
+    if os.path.exists(fn):
+        return PathIndex.load(fn)
+
+    cached = []
+    if os.path.isdir(index_dir):
+        prefix = f'{source}_{receiver}_'
+        cached = [int(f[len(prefix):-4]) for f in os.listdir(index_dir) if f.startswith(prefix) and f.endswith('.npz') and f[len(prefix):-4].isdigit()]
+
+    if len(cached) > 0:
+        index = PathIndex.load(index_path(source, receiver, max(cached), index_dir)).derive(num_range_points)
+    else:
+        if grids is None:
+            grids = {name: open_grid(name) for name in grid_paths}
+        index = PathIndex(source, receiver, num_range_points)
+        for name, grid in grids.items():
+            index.add_grid(name, grid.lat.values, grid.lon.values)
+    index.save(fn)
+    return index
+
+
+def load_path(node : str, num_range_points : int = 3000, climate : bool = True, source : str = 'KB', index_dir : str = None):
+    '''
+    load_path - sound speed and bathymetry slices from source to node gathered with the path index
+
+    Parameters are the same as pe.load_path. Depths below the bottom (NaN in
+    the climatology) are filled with the deepest value of each profile,
+    similar to envy.get_ssp_slice with fillna=True.
+
+    Returns
+    -------
+    ssp : xr.DataArray
+    bathy : xr.DataArray
+    '''
+    index = get_index(source, node, num_range_points, index_dir=index_dir)
+    ssp_name = 'ssp_climate' if climate else 'ssp_monthly'
+    # profiles on land (NaN at every depth) take the nearest ocean profile along the path
+    ssp = index.gather(ssp_name, open_grid(ssp_name)).ffill('depth').ffill('range').bfill('range')
+    bathy = index.gather('bathymetry', open_grid('bathymetry'))
+    return ssp, bathy
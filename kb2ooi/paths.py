@@ -0,0 +1,102 @@
+'''
+paths.py - group propagation paths from KB that leave in nearly the same direction
+
+Hydrophones whose bearing from KB differs by less than a tolerance lie
+(approximately) on the same great circle, so environment slices and PE runs
+for the group can be computed once along the path to the farthest hydrophone
+and the nearer hydrophones are taken at their along-track range. The
+geometric error of that approximation is the cross-track distance of each
+hydrophone from the shared path.
+'''
+
+import numpy as np
+from kaooi.coordinates import coords
+
+# mean earth radius [km]
+earth_radius = 6371.0
+
+
+def _radians(point):
+    return np.radians(point[0]), np.radians(point[1])
+
+
+def distance(start, end):
+    '''
+    distance - great circle distance [km] between two (lat, lon) points
+    '''
+    lat1, lon1 = _radians(start)
+    lat2, lon2 = _radians(end)
+    a = np.sin((lat2 - lat1)/2)**2 + np.cos(lat1)*np.cos(lat2)*np.sin((lon2 - lon1)/2)**2
+    return 2*earth_radius*np.arcsin(np.sqrt(a))
+
+
+def bearing(start, end):
+    '''
+    bearing - initial bearing [degrees from north] of the great circle from start to end
+    '''
+    lat1, lon1 = _radians(start)
+    lat2, lon2 = _radians(end)
+    y = np.sin(lon2 - lon1)*np.cos(lat2)
+    x = np.cos(lat1)*np.sin(lat2) - np.sin(lat1)*np.cos(lat2)*np.cos(lon2 - lon1)
+    return np.degrees(np.arctan2(y, x)) % 360
+
+
+def track_offsets(source, reference, point):
+    '''
+    track_offsets - position of point relative to the great circle from source to reference
+
+    Returns
+    -------
+    along_track : float
+        range [km] along the reference path of the closest point
+    cross_track : float
+        distance [km] of point from the reference path
+    '''
+    d13 = distance(source, point)/earth_radius
+    theta = np.radians(bearing(source, point) - bearing(source, reference))
+
+    cross_track = np.arcsin(np.sin(d13)*np.sin(theta))
+    along_track = np.arccos(np.clip(np.cos(d13)/np.cos(cross_track), -1, 1))
+    return float(along_track*earth_radius), float(np.abs(cross_track)*earth_radius)
+
+
+def group_paths(nodes : list, tolerance : float = 0.5, source : str = 'KB'):
+    '''
+    group_paths - group nodes with bearings from source within tolerance
+
+    nodes are sorted by bearing and a new group is started whenever a node is
+    more than tolerance from the first node of the current group. Every group
+    is sorted by distance, with the farthest (reference) node last.
+
+    Parameters
+    ----------
+    nodes : list
+        node names in kaooi.coordinates.coords
+    tolerance : float
+        maximum bearing difference within a group [degrees]
+    source : str
+        source name
+
+    Returns
+    -------
+    groups : list of dict
+        with keys ``reference`` (farthest node), ``nodes`` and ``offsets``
+        ({node: (along_track, cross_track)} in km along the reference path)
+    '''
+    bearings = {node: bearing(coords[source], coords[node]) for node in nodes}
+    ordered = sorted(nodes, key=lambda node: bearings[node])
+
+    members = []
+    for node in ordered:
+        if members and (bearings[node] - bearings[members[-1][0]]) <= tolerance:
+            members[-1].append(node)
+        else:
+            members.append([node])
+
+    groups = []
+    for group in members:
+        group = sorted(group, key=lambda node: distance(coords[source], coords[node]))
+        reference = group[-1]
+        offsets = {node: track_offsets(coords[source], coords[reference], coords[node]) for node in group}
+        groups.append({'reference':reference, 'nodes':group, 'offsets':offsets})
+    return groups
@@ -0,0 +1,776 @@
+'''
+pe.py - build RAM environments and write Green's functions for the PE drivers
+
+These are the steps shared by the PE scripts: load the sound speed and
+bathymetry slice for a path, add an internal wave perturbation, flat earth
+transform, assign bottom properties and write the complex Green's function
+as separate real / imaginary netcdf files. ``reduce_profiles`` and
+``reduce_bathymetry`` drop range profiles and bathymetry breakpoints that are
+within a tolerance of their neighbours before the environment is built.
+``extract_receivers`` returns the Green's function of several receivers on a
+shared path (kb2ooi.paths) from a single RAM run, ``validate_shift`` checks
+such a receiver against its own run. ``window_run_args`` sets
+the frequency grid from an arrival window around the predicted travel time
+instead of the full 10 s period, ``window_to_time`` reconstructs that window
+and ``validate_window`` compares it with the full grid reconstruction.
+Environments, written Green's functions and the loaders ``load_dciw`` and
+``read_gf`` use the precision set in kb2ooi.precision, ``validate_precision``
+compares the arrivals of a float32 run with a float64 run.
+'''
+
+import os
+import json
+import numpy as np
+import xarray as xr
+import envy
+import bighorn
+from kaooi.coordinates import coords, depths
+
+from kb2ooi import path_index, paths, precision
+
+# nodes with bottom properties of rock near Axial Seamount
+axial_nodes = ['AXBA1', 'AXCC1', 'AXEC2', 'PC03A']
+# nodes that use the cascadia slope bottom model on the continental slope
+slope_nodes = ['HYS14', 'LJ01C']
+
+# RAM parameters used by the Monte Carlo, time front and monthly drivers
+ram_params = {
+    'freq':75,
+    'zr':0,
+    'dr':10,
+    'ndr':14,
+    'zmax':6200,
+    'dz':2,
+    'ndz':5,
+    'zmplt':6200,
+    'c0':1500,
+    'np':8,
+    'ns':1,
+    'rs':10000,
+}
+
+# arguments to bighorn.run_ram
+run_args = {
+    'Fs':300,
+    'T0':10,
+    'bw':(37.5, 112.5),
+    'zdec':1,
+    'rdec':-1,
+}
+
+
+def load_path(node : str, num_range_points : int = 3000, climate : bool = True, use_index : bool = None):
+    '''
+    load_path - load sound speed and bathymetry slices from KB to node
+
+    Parameters
+    ----------
+    node : str
+        hydrophone name (e.g. AXCC1)
+    num_range_points : int
+        number of range points in the slices
+    climate : bool
+        passed to envy.get_ssp_slice, if False the monthly profiles are returned
+    use_index : bool
+        gather the slices with the cached kb2ooi.path_index instead of envy.
+        If None, the index is only used when the global grid files are set in
+        the .env file and build_path_index.py --compare recorded a passing
+        comparison with envy for this node and num_range_points
+
+    Returns
+    -------
+    ssp : xr.DataArray
+    bathy : xr.DataArray
+    '''
+    if use_index is None:
+        use_index = path_index.available() and path_index.validated(node, num_range_points)
+    if use_index:
+        ssp, bathy = path_index.load_path(node, num_range_points=num_range_points, climate=climate)
+        return precision.as_real(ssp), precision.as_real(bathy)
+
+    ssp = envy.get_ssp_slice(
+        coords['KB'],
+        coords[node],
+        num_range_points=num_range_points,
+        fillna=True,
+        climate=climate,
+    ).load()
+
+    bathy = envy.get_bathymetry_slice(
+        coords['KB'],
+        coords[node],
+        num_range_points=num_range_points,
+    ).load()
+
+    return precision.as_real(ssp), precision.as_real(bathy)
+
+
+def load_dciw(fn : str):
+    '''
+    load_dciw - load a merged internal wave realization (dciw_XXX.nc) in the current precision
+    '''
+    return precision.as_real(xr.open_dataarray(fn).load())
+
+
+def add_perturbation(ssp : xr.DataArray, dciw : xr.DataArray):
+    '''
+    add_perturbation - combine climate sound speed with an internal wave perturbation
+
+    the result is on the range grid of the perturbation and the depth grid of
+    the sound speed
+    '''
+    return ssp.interp({'range':dciw.range}) + dciw.interp({'depth':ssp.depth}, kwargs={'bounds_error':False, 'fill_value':'extrapolate'})
+
+
+def bottom_properties(node : str, ranges, cascadia_slope : bool = False):
+    '''
+    bottom_properties - sound speed, density and attenuation of the bottom
+
+    uses med_silt near KB, clay for the ocean basin, rock for Axial Seamount
+    and (optionally) the cascadia slope model for continental slope nodes
+
+    Parameters
+    ----------
+    node : str
+        hydrophone name
+    ranges : array like
+        range coordinate [km]
+    cascadia_slope : bool
+        whether to use the cascadia slope model for slope nodes
+
+    Returns
+    -------
+    cb, rhob, attn : xr.DataArray
+    '''
+    template = xr.DataArray(
+        np.ones((1,len(ranges))),
+        dims=['depth','range'],
+        coords={
+            'range':ranges,
+            'depth':np.array([6000])}
+    )
+
+    props = {}
+    for name, prop in [('cb','soundSpeed'), ('rhob','density'), ('attn','soundAttenuation')]:
+        da = template.copy()
+        da.loc[:,:30] = bighorn.bottom_props['med_silt'][prop]
+        da.loc[:,30:] = bighorn.bottom_props['clay'][prop]
+        if node in axial_nodes:
+            da.loc[:,3555:] = bighorn.bottom_props['rock'][prop]
+        if cascadia_slope and (node in slope_nodes):
+            da.loc[:,3000:] = bighorn.bottom_props['cascadia-slope'][prop]
+        props[name] = da
+
+    return props['cb'], props['rhob'], props['attn']
+
+
+def build_environment(node : str, ssp : xr.DataArray, bathy : xr.DataArray, cascadia_slope : bool = False, flat_earth_kwargs : dict = None, verbose : bool = True, flat_earth : bool = True, property_range = None, **params):
+    '''
+    build_environment - flat earth transform and build the RAM environment
+
+    Parameters
+    ----------
+    node : str
+        hydrophone name
+    ssp : xr.DataArray
+        sound speed (range, depth), including any perturbation
+    bathy : xr.DataArray
+        bathymetry slice
+    cascadia_slope : bool
+        whether to use the cascadia slope bottom model for slope nodes
+    flat_earth_kwargs : dict
+        extra arguments for envy.flat_earth_c (e.g. n_cpus, chunk_size)
+    verbose : bool
+        print progress
+    flat_earth : bool
+        whether to flat earth transform ssp, False if ssp is already
+        transformed (e.g. by shared_env.flat_earth_c)
+    property_range : array like
+        range grid [km] of the bottom properties, the range of ssp if None.
+        Pass the range of the original slice when ssp was reduced
+        (reduce_profiles), so the sediment transitions stay where they are
+    **params
+        RAM parameters that override ram_params
+
+    Returns
+    -------
+    env : envy.EnvironmentRAM
+    '''
+    if flat_earth_kwargs is None:
+        flat_earth_kwargs = {}
+
+    if not flat_earth:
+        ssp_f = ssp
+    else:
+        if verbose:
+            print('computing flat earth transform...')
+        ssp_f = envy.flat_earth_c(ssp, verbose=verbose, **flat_earth_kwargs)
+    ssp_f = precision.as_real(ssp_f)
+    bathy_f = precision.as_real(envy.flat_earth_bathy(bathy))
+
+    if property_range is None:
+        property_range = ssp_f.range
+    cb, rhob, attn = bottom_properties(node, property_range, cascadia_slope=cascadia_slope)
+
+    input_params = {
+        'title':node,
+        'zs':depths['KB']+10,
+        'rmax':bathy_f.range[-1]*1000,
+        **ram_params,
+        'bathymetry':bathy_f,
+        'soundspeed':ssp_f,
+        'cb':cb,
+        'rhob':rhob,
+        'attn':attn,
+    }
+    input_params.update(params)
+
+    return envy.EnvironmentRAM(**input_params)
+
+
+def output_paths(out_dir : str, node : str, realization : int):
+    '''
+    output_paths - real and imaginary Green's function file names for a realization
+    '''
+    fnr = f'{out_dir}{node}_{realization:02}_Gfz_real.nc'
+    fni = f'{out_dir}{node}_{realization:02}_Gfz_imag.nc'
+    return fnr, fni
+
+
+def output_exists(fnr : str, fni : str):
+    return os.path.exists(fnr) and os.path.exists(fni)
+
+
+def write_gf(gf : xr.DataArray, fnr : str, fni : str):
+    '''
+    write_gf - save a complex Green's function as real and imaginary netcdf files in the current precision
+
+    each file is written to a temporary file and renamed, the real part first
+    and the imaginary part last, so a Green's function is complete once fni
+    exists
+    '''
+    os.makedirs(os.path.dirname(fnr), exist_ok=True)
+    gf = precision.as_complex(gf)
+    for part, fn in [(gf.real, fnr), (gf.imag, fni)]:
+        tmp = f'{fn}.{os.getpid()}.tmp'
+        part.to_netcdf(tmp)
+        os.replace(tmp, fn)
+
+
+def read_gf(fnr : str, fni : str):
+    '''
+    read_gf - load a complex Green's function written by write_gf in the current precision
+    '''
+    return precision.as_complex(xr.open_dataarray(fnr).load() + 1j*xr.open_dataarray(fni).load())
+
+
+def realization_index(dciw_filepath : str):
+    '''
+    realization_index - realization number from a dciw_XXX.nc file name
+    '''
+    return int(dciw_filepath[-6:-3])
+
+
+def reduce_profiles(ssp : xr.DataArray, tolerance : float = 0.1):
+    '''
+    reduce_profiles - merge adjacent range profiles that agree within a tolerance
+
+    RAM refactors the Pade operators at every profile update, so profiles that
+    differ from their neighbours by less than ``tolerance`` at every depth are
+    replaced by a single profile. Each merged segment is represented by the
+    midrange profile (max + min)/2 at the range of its first profile, so the
+    sound speed error is at most ``tolerance``.
+
+    Parameters
+    ----------
+    ssp : xr.DataArray
+        sound speed with dimensions range and depth
+    tolerance : float
+        maximum sound speed error [m/s], 0 returns ssp unchanged
+
+    Returns
+    -------
+    ssp_reduced : xr.DataArray
+        sound speed at the first range of every segment
+    report : dict
+        number of profiles before and after, max and rms error [m/s]
+    '''
+    values = ssp.transpose('range', ...).values
+    n_range = values.shape[0]
+
+    if tolerance <= 0:
+        return ssp, {'n_profiles':n_range, 'n_reduced':n_range, 'max_error':0.0, 'rms_error':0.0}
+
+    starts = [0]
+    reduced = []
+    cmin = values[0].copy()
+    cmax = values[0].copy()
+    for k in range(1, n_range):
+        new_min = np.fmin(cmin, values[k])
+        new_max = np.fmax(cmax, values[k])
+        if np.nanmax(new_max - new_min) > 2*tolerance:
+            reduced.append((cmax + cmin)/2)
+            starts.append(k)
+            cmin = values[k].copy()
+            cmax = values[k].copy()
+        else:
+            cmin, cmax = new_min, new_max
+    reduced.append((cmax + cmin)/2)
+    reduced = np.array(reduced)
+
+    # error of the piecewise constant profiles on the original range grid
+    segment = np.searchsorted(starts, np.arange(n_range), side='right') - 1
+    error = values - reduced[segment]
+
+    ssp_reduced = ssp.transpose('range', ...).isel({'range':starts}).copy(data=reduced).transpose(*ssp.dims)
+    report = {
+        'n_profiles':n_range,
+        'n_reduced':len(starts),
+        'max_error':float(np.nanmax(np.abs(error))),
+        'rms_error':float(np.sqrt(np.nanmean(error**2))),
+    }
+    return ssp_reduced, report
+
+
+def reduce_bathymetry(bathy : xr.DataArray, tolerance : float = 1.0):
+    '''
+    reduce_bathymetry - remove bathymetry breakpoints that linear interpolation reproduces
+
+    Douglas-Peucker simplification of the piecewise linear bathymetry with a
+    vertical tolerance.
+
+    Parameters
+    ----------
+    bathy : xr.DataArray
+        bathymetry with dimension range
+    tolerance : float
+        maximum depth error [m], 0 returns bathy unchanged
+
+    Returns
+    -------
+    bathy_reduced : xr.DataArray
+    report : dict
+        number of points before and after, max and rms error [m]
+    '''
+    ranges = bathy.range.values.astype(float)
+    values = bathy.values.astype(float)
+    n_range = len(ranges)
+
+    if tolerance <= 0:
+        return bathy, {'n_points':n_range, 'n_reduced':n_range, 'max_error':0.0, 'rms_error':0.0}
+
+    keep = np.zeros(n_range, dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, n_range-1)]
+    while stack:
+        i, j = stack.pop()
+        if j - i < 2:
+            continue
+        line = np.interp(ranges[i+1:j], ranges[[i, j]], values[[i, j]])
+        deviation = np.abs(values[i+1:j] - line)
+        k = int(np.argmax(deviation))
+        if deviation[k] > tolerance:
+            keep[i+1+k] = True
+            stack.extend([(i, i+1+k), (i+1+k, j)])
+
+    error = values - np.interp(ranges, ranges[keep], values[keep])
+    report = {
+        'n_points':n_range,
+        'n_reduced':int(keep.sum()),
+        'max_error':float(np.max(np.abs(error))),
+        'rms_error':float(np.sqrt(np.mean(error**2))),
+    }
+    return bathy.isel({'range':np.flatnonzero(keep)}), report
+
+
+# approximate group speed of the deep water arrivals [m/s], used to move a
+# broadband Green's function a short distance in range
+c_group = 1480
+
+
+def frequency_dim(gf : xr.DataArray):
+    '''
+    frequency_dim - name of the frequency dimension of a bighorn Green's function
+    '''
+    dims = [dim for dim in gf.dims if dim not in ['depth', 'range']]
+    if len(dims) != 1:
+        raise ValueError(f'could not find frequency dimension in {gf.dims}')
+    return dims[0]
+
+
+def shift_range(gf : xr.DataArray, delta_range : float, c : float = c_group):
+    '''
+    shift_range - move a broadband Green's function delta_range [km] along the path
+
+    the field at the end of the path is delayed by delta_range / c, which is
+    accurate for receivers a few km apart in deep water. The geometric spreading
+    and any change of bathymetry over delta_range are neglected.
+    '''
+    dim = frequency_dim(gf)
+    delay = delta_range*1000 / c
+    return gf * np.exp(-2j*np.pi*gf[dim]*delay)
+
+
+def extract_receivers(gf : xr.DataArray, offsets : dict, reference : str, c : float = c_group):
+    '''
+    extract_receivers - Green's function of every receiver of a shared path
+
+    If gf is range resolved (run_ram with rdec > 0), the nearest output range
+    is selected. Otherwise gf is the field at the reference (farthest)
+    receiver, and every other receiver is moved back along the path with
+    shift_range. This is an approximation (no bathymetry, bottom or spreading
+    change over the offset), the shifted Green's functions carry the
+    attributes approximated_from (the reference node), range_offset [km] and
+    time_shift [s]. Compare a shifted receiver with its own run with
+    simulation/pe_simulation/validate_shared_path.py (validate_shift) before
+    using it.
+
+    Parameters
+    ----------
+    gf : xr.DataArray
+        output of bighorn.run_ram for the path to the reference receiver
+    offsets : dict
+        {node: (along_track, cross_track)} [km] from kb2ooi.paths.group_paths
+    reference : str
+        node at the end of the shared path
+    c : float
+        group speed used to shift the field in range [m/s]
+
+    Returns
+    -------
+    gfs : dict
+        {node: xr.DataArray}
+    report : dict
+        {node: {along_track, cross_track, range_offset, time_shift}}, distances
+        in km and time in s, range_offset is the distance the field was moved
+    '''
+    reference_range = offsets[reference][0]
+
+    gfs = {}
+    report = {}
+    for node, (along_track, cross_track) in offsets.items():
+        if 'range' in gf.dims:
+            gfs[node] = gf.sel({'range':along_track}, method='nearest')
+            range_offset = float(gfs[node].range) - along_track
+            time_shift = 0.0
+        else:
+            range_offset = reference_range - along_track
+            gfs[node] = gf if node == reference else shift_range(gf, -range_offset, c)
+            time_shift = -range_offset*1000 / c if range_offset != 0 else 0.0
+            if node != reference:
+                gfs[node].attrs.update({**gf.attrs, 'approximated_from':reference, 'range_offset':range_offset, 'time_shift':time_shift})
+
+        report[node] = {
+            'along_track':along_track,
+            'cross_track':cross_track,
+            'range_offset':range_offset,
+            'time_shift':time_shift,
+        }
+    return gfs, report
+
+
+# smallest zero lag envelope correlation and largest relative envelope energy
+# error of a shifted receiver against its own run (validate_shift)
+shift_tolerances = {
+    'min_correlation':0.9,
+    'max_energy_error':0.25,
+}
+
+
+def _circular_lag(a, b, dt):
+    # lag [s] of b relative to a from the peak of their circular cross correlation, and the normalized peak
+    c = np.fft.ifft(np.fft.fft(b) * np.conj(np.fft.fft(a))).real
+    k = int(np.argmax(c))
+    lag = (k if k <= len(c)//2 else k - len(c))*dt
+    return lag, float(c[k] / np.sqrt(np.sum(a**2)*np.sum(b**2)))
+
+
+def validate_shift(gf_node : xr.DataArray, gf_reference : xr.DataArray, range_offset : float, depth : float, args : dict = None, c : float = c_group, tolerances : dict = None):
+    '''
+    validate_shift - compare a receiver moved along a shared path (extract_receivers) with its own run
+
+    the arrival envelopes at the receiver depth are compared without
+    realigning them, so a wrong delay or sign fails the correlation as well
+    as a wrong waveform
+
+    Parameters
+    ----------
+    gf_node : xr.DataArray
+        Green's function of the run to the receiver
+    gf_reference : xr.DataArray
+        Green's function of the run to the end of the shared path
+    range_offset : float
+        distance [km] between the reference and the receiver along the path,
+        as reported by extract_receivers
+    depth : float
+        receiver depth [m]
+    args : dict
+        bighorn.run_ram arguments of both runs, run_args if None
+    c : float
+        group speed used to shift the field [m/s]
+    tolerances : dict
+        min_correlation and max_energy_error, shift_tolerances if None
+
+    Returns
+    -------
+    dict
+        correlation and energy_error of the shifted envelope, the lag [s] of
+        the envelope peak correlation for the shift, the shift with the
+        opposite sign and no shift, sign_ok and passed
+    '''
+    args = run_args if args is None else args
+    tolerances = shift_tolerances if tolerances is None else tolerances
+
+    def envelope(gf):
+        gt = bighorn.convert_to_time(gf, args['Fs'], args['T0'], args['bw'])
+        return np.abs(gt.sel({'depth':depth}, method='nearest')).values
+
+    truth = envelope(gf_node)
+    shifted = envelope(shift_range(gf_reference, -range_offset, c))
+    dt = 1/args['Fs']
+    lag, _ = _circular_lag(truth, shifted, dt)
+    lag_flipped, _ = _circular_lag(truth, envelope(shift_range(gf_reference, range_offset, c)), dt)
+    lag_unshifted, _ = _circular_lag(truth, envelope(gf_reference), dt)
+
+    energy = np.sum(truth**2)
+    report = {
+        'range_offset':range_offset,
+        'time_shift':-range_offset*1000 / c,
+        'correlation':float(np.dot(truth, shifted) / np.sqrt(energy*np.sum(shifted**2))),
+        'energy_error':float(np.abs(np.sum(shifted**2) - energy) / energy),
+        'lag':lag,
+        'lag_opposite_sign':lag_flipped,
+        'lag_unshifted':lag_unshifted,
+        'sign_ok':bool(abs(lag) <= abs(lag_flipped)),
+        **tolerances,
+    }
+    report['passed'] = bool(
+        report['sign_ok']
+        and (report['correlation'] >= tolerances['min_correlation'])
+        and (report['energy_error'] <= tolerances['max_energy_error'])
+    )
+    return report
+
+
+def validation_path(node : str):
+    '''
+    validation_path - file of the validate_shift report of node (validate_shared_path.py)
+    '''
+    return f'{os.environ["data_directory"]}timefront/env_files/shared_path_validation_{node}.json'
+
+
+def shift_validated(node : str, reference : str):
+    '''
+    shift_validated - whether node passed validate_shift against its own run on the path to reference
+    '''
+    fn = validation_path(node)
+    if not os.path.exists(fn):
+        return False
+    with open(fn) as f:
+        report = json.load(f)
+    return (report.get('reference') == reference) and bool(report.get('passed', False))
+
+
+def validated_groups(groups : list):
+    '''
+    validated_groups - split nodes that did not pass validate_shift off their shared path group
+
+    Parameters
+    ----------
+    groups : list of dict
+        output of kb2ooi.paths.group_paths
+
+    Returns
+    -------
+    groups : list of dict
+        groups with only the reference and the nodes that passed, every other
+        node in a group of its own
+    rejected : list
+        nodes that were split off
+    '''
+    validated = []
+    rejected = []
+    for group in groups:
+        reference = group['reference']
+        members = [node for node in group['nodes'] if (node == reference) or shift_validated(node, reference)]
+        rejected += [node for node in group['nodes'] if node not in members]
+        validated.append({**group, 'nodes':members, 'offsets':{node: group['offsets'][node] for node in members}})
+    for node in rejected:
+        validated.append({'reference':node, 'nodes':[node], 'offsets':{node: (0.0, 0.0)}})
+    return validated, rejected
+
+
+def window_run_args(window : float, guard : float = 0.2, **kwargs):
+    '''
+    window_run_args - run_ram arguments that only solve the frequencies needed for a time window
+
+    the frequency spacing 1/T0 sets the length of the (periodic) time series
+    returned by bighorn.convert_to_time. An arrival window of ``window``
+    seconds is reconstructed without aliasing if T0 >= window, so T0 is set to
+    the window plus a guard instead of the default 10 s, and the number of PE
+    solves is reduced by T0 / 10.
+
+    Parameters
+    ----------
+    window : float
+        length of the arrival window [s]
+    guard : float
+        fraction of the window added to T0 to separate the arrivals from their
+        periodic repeats
+    **kwargs
+        override run_args (e.g. Fs, bw)
+
+    Returns
+    -------
+    dict
+        arguments for bighorn.run_ram
+    '''
+    args = {**run_args, **kwargs}
+    # T0 is rounded up so that Fs*T0 is an integer number of samples
+    T0 = np.ceil(window*(1 + guard)*args['Fs']) / args['Fs']
+    args['T0'] = float(min(T0, run_args['T0']))
+    return args
+
+
+def window_to_time(gf : xr.DataArray, travel_time : float, window : float, Fs : float = None, T0 : float = None, bw : tuple = None):
+    '''
+    window_to_time - arrival window in absolute travel time from a Green's function
+
+    the time series of bighorn.convert_to_time is periodic with T0. The
+    samples are unwrapped to absolute time around the predicted travel time
+    and the window [travel_time - window/2, travel_time + window/2] is returned.
+
+    Parameters
+    ----------
+    gf : xr.DataArray
+        Green's function from bighorn.run_ram
+    travel_time : float
+        predicted travel time of the center of the window [s]
+    window : float
+        length of the window [s]
+    Fs, T0, bw
+        arguments used for bighorn.run_ram, taken from the attributes of gf
+        (see write_gf) or run_args if None
+
+    Returns
+    -------
+    gt : xr.DataArray
+        Green's function with absolute time coordinate
+    '''
+    Fs = Fs if Fs is not None else gf.attrs.get('Fs', run_args['Fs'])
+    T0 = T0 if T0 is not None else gf.attrs.get('T0', run_args['T0'])
+    bw = bw if bw is not None else tuple(gf.attrs.get('bw', run_args['bw']))
+
+    gt = bighorn.convert_to_time(gf, Fs, T0, bw)
+    start = travel_time - window/2
+    time = start + np.mod(gt.time.values - start, T0)
+    gt = gt.assign_coords({'time':time}).sortby('time')
+    return gt.sel({'time':slice(start, start + window)})
+
+
+def predicted_travel_time(node : str, c : float = c_group):
+    '''
+    predicted_travel_time - travel time [s] from KB to node at the group speed c
+    '''
+    return paths.distance(coords['KB'], coords[node])*1000 / c
+
+
+def run_attrs(args : dict, travel_time : float = None):
+    '''
+    run_attrs - attributes recording the frequency grid of a Green's function, used by window_to_time
+    '''
+    attrs = {'Fs':args['Fs'], 'T0':args['T0'], 'bw':list(args['bw'])}
+    if travel_time is not None:
+        attrs['travel_time'] = travel_time
+    return attrs
+
+
+def validate_window(gf_full : xr.DataArray, gf_window : xr.DataArray, travel_time : float, window : float, full_args : dict = None, window_args : dict = None):
+    '''
+    validate_window - compare a windowed run with the full frequency grid reconstruction
+
+    Returns
+    -------
+    dict
+        number of frequencies of each run, relative rms and max error of the
+        complex time series in the window and the correlation coefficient
+    '''
+    full_args = run_args if full_args is None else full_args
+    window_args = run_args if window_args is None else window_args
+
+    gt_full = window_to_time(gf_full, travel_time, window, full_args['Fs'], full_args['T0'], full_args['bw'])
+    gt_window = window_to_time(gf_window, travel_time, window, window_args['Fs'], window_args['T0'], window_args['bw'])
+    gt_window = gt_window.sel({'time':gt_full.time.values}, method='nearest')
+
+    a = gt_full.values.flatten()
+    b = gt_window.values.flatten()
+    valid = ~(np.isnan(a) | np.isnan(b))
+    a, b = a[valid], b[valid]
+    diff = a - b
+
+    return {
+        'n_freq_full':int(gf_full.sizes[frequency_dim(gf_full)]),
+        'n_freq_window':int(gf_window.sizes[frequency_dim(gf_window)]),
+        'rms_error':float(np.sqrt(np.mean(np.abs(diff)**2) / np.mean(np.abs(a)**2))),
+        'max_error':float(np.max(np.abs(diff)) / np.max(np.abs(a))),
+        'correlation':float(np.abs(np.vdot(a, b)) / (np.linalg.norm(a)*np.linalg.norm(b))),
+    }
+
+
+def validate_precision(gf_ref : xr.DataArray, gf_test : xr.DataArray, depth : float, travel_time : float, window : float, args : dict = None, dynamic_range : float = 60):
+    '''
+    validate_precision - compare the arrivals of a reduced precision run with a float64 reference
+
+    Parameters
+    ----------
+    gf_ref, gf_test : xr.DataArray
+        Green's functions of the same environment in float64 and reduced precision
+    depth : float
+        receiver depth [m]
+    travel_time : float
+        predicted travel time [s], the window is centered on it
+    window : float
+        arrival window [s]
+    args : dict
+        bighorn.run_ram arguments of both runs, run_args if None
+    dynamic_range : float
+        envelope errors are measured where the reference envelope is within
+        dynamic_range dB of its peak
+
+    Returns
+    -------
+    dict
+        dtypes of both runs, max / rms envelope difference [dB] and relative
+        rms envelope error at the receiver, max / rms TL difference over depth
+        [dB] and at the receiver
+    '''
+    args = run_args if args is None else args
+
+    def envelope(gf):
+        gf = gf.astype(np.complex128)
+        return np.abs(window_to_time(gf.sel({'depth':depth}, method='nearest'), travel_time, window, args['Fs'], args['T0'], args['bw']).values)
+
+    def tl(gf):
+        # band averaged transmission loss vs depth
+        power = (np.abs(gf.astype(np.complex128))**2).mean(frequency_dim(gf))
+        return -10*np.log10(power)
+
+    env_ref, env_test = envelope(gf_ref), envelope(gf_test)
+    valid = np.isfinite(env_ref) & np.isfinite(env_test) & (env_ref > np.nanmax(env_ref)*10**(-dynamic_range/20))
+    env_db = 20*np.log10(env_test[valid] / env_ref[valid])
+
+    tl_ref, tl_test = tl(gf_ref), tl(gf_test)
+    tl_diff = (tl_test - tl_ref).values
+    tl_diff = tl_diff[np.isfinite(tl_diff)]
+    tl_receiver = float(tl_test.sel({'depth':depth}, method='nearest') - tl_ref.sel({'depth':depth}, method='nearest'))
+
+    return {
+        'dtype_ref':str(gf_ref.dtype),
+        'dtype_test':str(gf_test.dtype),
+        'envelope_max_db':float(np.max(np.abs(env_db))),
+        'envelope_rms_db':float(np.sqrt(np.mean(env_db**2))),
+        'envelope_rms_error':float(np.sqrt(np.mean((env_test[valid] - env_ref[valid])**2) / np.mean(env_ref[valid]**2))),
+        'tl_max_db':float(np.max(np.abs(tl_diff))),
+        'tl_rms_db':float(np.sqrt(np.mean(tl_diff**2))),
+        'tl_receiver_db':tl_receiver,
+    }
@@ -0,0 +1,159 @@
+'''
+pe_tasks.py - run independent PE tasks concurrently inside one allocation
+
+The time front and monthly drivers run several RAM solves (climate and
+perturbed, several nodes or months) that do not depend on each other. Each
+task is run in its own forked process, so path data loaded by the driver is
+shared without pickling, and writes its own output as soon as it finishes.
+
+The allocation is split into slots. Every slot gets a disjoint set of CPUs
+(the process is pinned with ``os.sched_setaffinity``) and the number of slots
+is chosen so that the memory predicted by ``kb2ooi.resources`` for all
+concurrent tasks fits in the memory budget. The OpenMP / BLAS and numba
+thread pools already exist in the forked process, so setting
+OMP_NUM_THREADS there has no effect. They are limited to the CPUs of the
+slot with threadpoolctl instead.
+'''
+
+import os
+import sys
+import time
+import multiprocessing as mp
+from multiprocessing.connection import wait
+from threadpoolctl import threadpool_limits
+
+from kb2ooi import resources
+
+
+def available_cpus():
+    '''
+    available_cpus - sorted CPUs this process is allowed to run on
+    '''
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count()))
+
+
+def memory_budget():
+    '''
+    memory_budget - memory of the SLURM allocation [bytes], None if unknown
+    '''
+    if 'SLURM_MEM_PER_NODE' in os.environ:
+        return float(os.environ['SLURM_MEM_PER_NODE'])*1e6
+    return None
+
+
+def plan_slots(n_tasks : int, features : dict, n_cpus : int, mem_budget : float = None, max_slots : int = None, margin : float = 1.2, coefs : tuple = None):
+    '''
+    plan_slots - largest number of concurrent tasks that fits in the memory budget
+
+    Parameters
+    ----------
+    n_tasks : int
+        number of tasks
+    features : dict
+        resources.task_features of the largest task
+    n_cpus : int
+        CPUs of the allocation
+    mem_budget : float
+        memory of the allocation [bytes], memory is not limiting if None
+    max_slots : int
+        upper limit on concurrent tasks
+    margin : float
+        safety factor on predicted memory
+
+    Returns
+    -------
+    n_slots : int
+    cpus_per_slot : int
+    '''
+    upper = min(n_tasks, n_cpus)
+    if max_slots is not None:
+        upper = min(upper, max_slots)
+
+    for n_slots in range(max(upper, 1), 0, -1):
+        cpus_per_slot = n_cpus // n_slots
+        if mem_budget is None:
+            return n_slots, cpus_per_slot
+        _, mem = resources.predict(features, cpus_per_slot, coefs)
+        if n_slots*mem*margin <= mem_budget:
+            return n_slots, cpus_per_slot
+    return 1, n_cpus
+
+
+def _run_pinned(cpus : list, func, args : tuple):
+    # restrict the task (and any processes or threads it starts) to its slot
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+    # the thread pools of numpy / BLAS and numba are created when they are
+    # imported in the driver, so the environment variables only reach
+    # processes the task starts, the pools of this process are limited directly
+    for var in ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'NUMBA_NUM_THREADS']:
+        os.environ[var] = str(len(cpus))
+    if 'numba' in sys.modules:
+        sys.modules['numba'].set_num_threads(min(len(cpus), sys.modules['numba'].config.NUMBA_NUM_THREADS))
+    with threadpool_limits(limits=len(cpus)):
+        func(*args)
+
+
+def run_tasks(tasks : list, features : dict, mem_budget : float = None, max_slots : int = None, margin : float = 1.2):
+    '''
+    run_tasks - run tasks concurrently with CPUs and memory split between them
+
+    Parameters
+    ----------
+    tasks : list of dict
+        with keys ``name`` and ``func``, and optionally ``args``. ``func(*args)``
+        is run in a forked process and should write its own output
+    features : dict
+        resources.task_features of the largest task, used to predict memory
+    mem_budget : float
+        memory available to all tasks [bytes], taken from SLURM if None
+    max_slots : int
+        upper limit on concurrent tasks
+    margin : float
+        safety factor on predicted memory
+
+    Returns
+    -------
+    failed : list
+        names of tasks that did not exit cleanly
+    '''
+    if len(tasks) == 0:
+        return []
+
+    cpus = available_cpus()
+    if mem_budget is None:
+        mem_budget = memory_budget()
+    n_slots, cpus_per_slot = plan_slots(len(tasks), features, len(cpus), mem_budget=mem_budget, max_slots=max_slots, margin=margin)
+    slots = [cpus[k*cpus_per_slot:(k+1)*cpus_per_slot] for k in range(n_slots)]
+    print(f'running {len(tasks)} tasks in {n_slots} slots of {cpus_per_slot} CPUs')
+
+    ctx = mp.get_context('fork')
+    pending = list(tasks)
+    free = list(range(n_slots))
+    running = {}
+    failed = []
+
+    while pending or running:
+        # start tasks on free slots
+        while pending and free:
+            task = pending.pop(0)
+            slot = free.pop(0)
+            process = ctx.Process(target=_run_pinned, args=(slots[slot], task['func'], task.get('args', ())), name=task['name'])
+            process.start()
+            running[process.sentinel] = (process, slot, task['name'], time.time())
+            print(f'started {task["name"]} on slot {slot}')
+
+        # wait for any task to finish
+        for sentinel in wait(list(running.keys())):
+            process, slot, name, start_time = running.pop(sentinel)
+            process.join()
+            free.append(slot)
+            if process.exitcode != 0:
+                failed.append(name)
+                print(f'{name} failed with exit code {process.exitcode}')
+            else:
+                print(f'{name} complete in {(time.time() - start_time)/3600:.2f} hours')
+
+    return failed
@@ -0,0 +1,95 @@
+'''
+precision.py - floating point precision of the sound speed perturbations, environments and outputs
+
+The perturbations, environment slices and Green's functions are stored as
+float64 / complex128 by default. Setting ``precision=float32`` in the .env
+file (or ``set_precision('float32')``) halves the memory and file size of
+every array that passes through ``as_real`` / ``as_complex``: the merged
+internal wave realizations (merge_dciw.py, internal_waves.merge_sections),
+the flat earth transformed environment (pe.build_environment), the written
+Green's functions (pe.write_gf) and the loaders of realizations and Green's
+function ensembles (pe.load_dciw, pe.read_gf). Coordinates are not cast.
+Use simulation/pe_simulation/validate_precision.py to check the effect on the
+arrivals of a node before switching a campaign to float32.
+'''
+
+import os
+from contextlib import contextmanager
+import numpy as np
+import xarray as xr
+
+# (real, complex) dtype of every precision
+dtypes = {
+    'float64':(np.float64, np.complex128),
+    'float32':(np.float32, np.complex64),
+}
+
+_precision = None
+
+
+def get_precision():
+    '''
+    get_precision - current precision, set_precision if called, else the precision environment variable (default float64)
+    '''
+    name = _precision if _precision is not None else os.environ.get('precision', 'float64')
+    if name not in dtypes:
+        raise ValueError(f'unknown precision {name}, expected one of {list(dtypes)}')
+    return name
+
+
+def set_precision(name : str):
+    '''
+    set_precision - set the precision of this process, None to use the precision environment variable again
+    '''
+    global _precision
+    if (name is not None) and (name not in dtypes):
+        raise ValueError(f'unknown precision {name}, expected one of {list(dtypes)}')
+    _precision = name
+
+
+@contextmanager
+def using(name : str):
+    '''
+    using - context manager that sets the precision inside a block
+    '''
+    previous = _precision
+    set_precision(name)
+    try:
+        yield
+    finally:
+        set_precision(previous)
+
+
+def real_dtype():
+    return dtypes[get_precision()][0]
+
+
+def complex_dtype():
+    return dtypes[get_precision()][1]
+
+
+def _cast(x, kind : str, dtype):
+    # kind is the numpy dtype kind that is cast, 'f' or 'c'
+    if isinstance(x, xr.Dataset):
+        return x.assign({name: _cast(da, kind, dtype) for name, da in x.data_vars.items()})
+    if np.dtype(x.dtype).kind == kind:
+        return x.astype(dtype, copy=False)
+    return x
+
+
+def as_real(x):
+    '''
+    as_real - cast the floating point data of an array, DataArray or Dataset to the real dtype of the current precision
+
+    integer and complex data are returned unchanged
+    '''
+    return _cast(x, 'f', real_dtype())
+
+
+def as_complex(x):
+    '''
+    as_complex - cast the complex data of an array, DataArray or Dataset to the complex dtype of the current precision
+
+    real and integer data are returned unchanged
+    '''
+    return _cast(x, 'c', complex_dtype())
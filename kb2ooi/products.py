@@ -0,0 +1,496 @@
+'''
+products.py - cache of derived products keyed by hashes of their inputs and parameters
+
+The notebooks recompute their derived arrays from the simulation and analysis
+files on every run, and the scripts skip work when the output file exists,
+which neither notices changed inputs nor outputs that were overwritten.
+
+``ProductCache`` stores derived products in ``<data_directory>products/``
+under a key that hashes the product name, the code of the function that
+computes it, its parameters and the content of its input files. A product
+is returned from the cache while nothing changed and recomputed when any of
+these changes. Entries are evicted least recently used first when the cache
+is larger than its budget (``product_cache_budget`` in .env, GB).
+
+Content hashes of input files are remembered with their size and
+modification time, so unchanged files are only read once.
+
+usage:
+    # notebooks and scripts, fns is hashed by content, the other arguments by value
+    @products.cached(inputs=['fns'])
+    def mean_arrival(fns, depth):
+        ...
+
+    # scripts that write their own outputs
+    if products.is_current(fno, inputs=[fn], params=params):
+        return
+    ...
+    products.record(fno, inputs=[fn], params=params)
+'''
+
+import os
+import sys
+import json
+import time
+import fcntl
+import pickle
+import hashlib
+import inspect
+import functools
+import contextlib
+import importlib.metadata
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+# size of the blocks read to hash files [bytes]
+block_size = 2**24
+
+
+def default_cache_dir():
+    return f'{os.environ["data_directory"]}products/'
+
+
+def default_budget():
+    '''
+    default_budget - disk budget of the cache [bytes], product_cache_budget [GB] in .env, 100 GB if not set
+    '''
+    return int(float(os.environ.get('product_cache_budget', 100))*1e9)
+
+
+def _write_json(fn : str, content):
+    tmp = f'{fn}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(content, f, indent=2, default=str)
+    os.replace(tmp, fn)
+
+
+@contextlib.contextmanager
+def _locked(fn : str):
+    # exclusive lock on fn.lock for a read-modify-write of fn by several processes
+    with open(f'{fn}.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _read_json(fn : str):
+    try:
+        with open(fn) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def _flatten(inputs):
+    if isinstance(inputs, (str, os.PathLike)):
+        return [os.fspath(inputs)]
+    return [fn for item in inputs for fn in _flatten(item)]
+
+
+def file_hash(fn : str, hash_dir : str = None):
+    '''
+    file_hash - content hash of a file, or of all files in a directory
+
+    hashes are remembered in ``<hash_dir>file_hashes.json`` with the size and
+    modification time of the file, and reused while these do not change. The
+    file is updated under a lock and replaced atomically, so hashes added by
+    concurrent processes are not lost
+    '''
+    fn = os.path.abspath(fn)
+    if os.path.isdir(fn):
+        h = hashlib.sha1()
+        for root, _, files in sorted(os.walk(fn)):
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                h.update(os.path.relpath(path, fn).encode())
+                h.update(file_hash(path, hash_dir).encode())
+        return h.hexdigest()
+
+    stat = os.stat(fn)
+    hash_dir = default_cache_dir() if hash_dir is None else hash_dir
+    os.makedirs(hash_dir, exist_ok=True)
+    memo_fn = f'{hash_dir}file_hashes.json'
+    memo = _read_json(memo_fn) or {}
+    entry = memo.get(fn)
+    if (entry is not None) and (entry['size'] == stat.st_size) and (entry['mtime_ns'] == stat.st_mtime_ns):
+        return entry['hash']
+
+    h = hashlib.sha1()
+    with open(fn, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+
+    # re-read under the lock, other processes may have added hashes in the meantime
+    with _locked(memo_fn):
+        memo = _read_json(memo_fn) or {}
+        memo[fn] = {'size':stat.st_size, 'mtime_ns':stat.st_mtime_ns, 'hash':h.hexdigest()}
+        _write_json(memo_fn, memo)
+    return h.hexdigest()
+
+
+def value_hash(value):
+    '''
+    value_hash - hash of a parameter value (arrays, xarray and pandas objects by content, everything else as json)
+    '''
+    h = hashlib.sha1()
+    if isinstance(value, (xr.DataArray, xr.Dataset)):
+        ds = value.to_dataset(name=value.name or '__values__') if isinstance(value, xr.DataArray) else value
+        for name in sorted(ds.variables, key=str):
+            h.update(str(name).encode())
+            h.update(value_hash(ds[name].values).encode())
+        h.update(json.dumps(ds.attrs, sort_keys=True, default=str).encode())
+    elif isinstance(value, np.ndarray):
+        h.update(str(value.dtype).encode())
+        h.update(str(value.shape).encode())
+        h.update(np.ascontiguousarray(value).tobytes() if value.dtype != object else json.dumps(value.tolist(), default=str).encode())
+    elif isinstance(value, (pd.DataFrame, pd.Series)):
+        h.update(pd.util.hash_pandas_object(value, index=True).values.tobytes())
+        h.update(json.dumps(list(map(str, getattr(value, 'columns', [value.name])))).encode())
+    elif isinstance(value, (list, tuple)) and any(isinstance(v, (np.ndarray, xr.DataArray, xr.Dataset, pd.DataFrame, pd.Series)) for v in value):
+        for v in value:
+            h.update(value_hash(v).encode())
+    elif isinstance(value, dict) and any(isinstance(v, (np.ndarray, xr.DataArray, xr.Dataset, pd.DataFrame, pd.Series)) for v in value.values()):
+        for k in sorted(value, key=str):
+            h.update(str(k).encode())
+            h.update(value_hash(value[k]).encode())
+    else:
+        h.update(json.dumps(value, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+
+def _code_hash(func):
+    '''
+    _code_hash - hash of the source of func, the bytecode if the source is not available
+    '''
+    try:
+        code = inspect.getsource(func).encode()
+    except (OSError, TypeError):
+        code = func.__code__.co_code
+    return hashlib.sha1(code).hexdigest()
+
+
+def code_version(func):
+    '''
+    code_version - package version and source hash of a function from another module
+
+    the source of a cached function is part of its key, but not the code it
+    calls. Pass code_version of the functions it depends on as a parameter,
+    so the product is recomputed when they change
+    '''
+    package = func.__module__.split('.')[0]
+    try:
+        version = importlib.metadata.version(package)
+    except importlib.metadata.PackageNotFoundError:
+        version = getattr(sys.modules.get(package), '__version__', 'unknown')
+    try:
+        code = _code_hash(func)[:12]
+    except AttributeError:
+        # compiled functions have neither source nor bytecode
+        code = 'compiled'
+    return f'{package} {version} {code}'
+
+
+def _is_complex(value):
+    if isinstance(value, xr.DataArray):
+        return value.dtype.kind == 'c'
+    return any(value[name].dtype.kind == 'c' for name in value.variables)
+
+
+class ProductCache:
+    '''
+    ProductCache - derived products on disk with least recently used eviction
+
+    every entry is a product file (netcdf for xarray objects, parquet for
+    pandas objects and pickle for everything else) and ``<key>.json`` with the
+    name, inputs, parameters, size and last access of the product
+
+    Parameters
+    ----------
+    cache_dir : str
+        default_cache_dir() if None
+    budget : int
+        disk budget [bytes], default_budget() if None
+    '''
+
+    def __init__(self, cache_dir : str = None, budget : int = None):
+        self.cache_dir = default_cache_dir() if cache_dir is None else cache_dir
+        self.budget = default_budget() if budget is None else budget
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, name : str, inputs=(), params : dict = None, code : str = None):
+        '''
+        key - hash of the product name, content of the input files, parameters and code
+        '''
+        h = hashlib.sha1()
+        h.update(name.encode())
+        h.update((code or '').encode())
+        for fn in _flatten(inputs):
+            h.update(fn.encode())
+            h.update(file_hash(fn, self.cache_dir).encode())
+        for param, value in sorted((params or {}).items()):
+            h.update(param.encode())
+            h.update(value_hash(value).encode())
+        return f'{name}-{h.hexdigest()[:20]}'
+
+    def _meta_path(self, key):
+        return f'{self.cache_dir}{key}.json'
+
+    def _entries(self):
+        return [fn[:-5] for fn in os.listdir(self.cache_dir) if fn.endswith('.json') and fn != 'file_hashes.json']
+
+    def get(self, key : str):
+        '''
+        get - cached product, None if it is not in the cache
+        '''
+        meta = _read_json(self._meta_path(key))
+        if (meta is None) or not os.path.exists(f'{self.cache_dir}{meta["file"]}'):
+            return None
+        fn = f'{self.cache_dir}{meta["file"]}'
+        if meta['format'] == 'netcdf':
+            with xr.open_dataset(fn) as ds:
+                value = ds.load()
+            if meta['type'] == 'DataArray':
+                value = value[list(value.data_vars)[0]].rename(meta.get('array_name'))
+        elif meta['format'] == 'parquet':
+            value = pd.read_parquet(fn)
+            if meta['type'] == 'Series':
+                value = value.iloc[:, 0]
+        else:
+            with open(fn, 'rb') as f:
+                value = pickle.load(f)
+
+        meta['last_access'] = time.time()
+        _write_json(self._meta_path(key), meta)
+        return value
+
+    def put(self, key : str, value, **meta):
+        '''
+        put - store a product and evict least recently used products over the budget, meta is stored with it
+        '''
+        if isinstance(value, (xr.DataArray, xr.Dataset)) and not _is_complex(value):
+            fmt, ext = 'netcdf', 'nc'
+        elif isinstance(value, (pd.DataFrame, pd.Series)):
+            fmt, ext = 'parquet', 'parquet'
+        else:
+            fmt, ext = 'pickle', 'pkl'
+
+        fn = f'{self.cache_dir}{key}.{ext}'
+        tmp = f'{fn}.{os.getpid()}.tmp'
+        if fmt == 'netcdf':
+            ds = value.to_dataset(name='__values__') if isinstance(value, xr.DataArray) else value
+            ds.to_netcdf(tmp)
+        elif fmt == 'parquet':
+            (value.to_frame() if isinstance(value, pd.Series) else value).to_parquet(tmp)
+        else:
+            with open(tmp, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, fn)
+
+        meta.update({
+            'file':os.path.basename(fn),
+            'format':fmt,
+            'type':type(value).__name__,
+            'array_name':value.name if isinstance(value, xr.DataArray) else None,
+            'size':os.path.getsize(fn),
+            'created':time.time(),
+            'last_access':time.time(),
+        })
+        _write_json(self._meta_path(key), meta)
+        self.evict(keep=key)
+
+    def get_or_compute(self, name : str, func, inputs=(), params : dict = None, code : str = None):
+        '''
+        get_or_compute - cached product, or func(**params) stored in the cache
+
+        Parameters
+        ----------
+        name : str
+            product name, used in the file names
+        func : callable
+            computes the product from params
+        inputs : list
+            files (or directories) the product is computed from, hashed by content
+        params : dict
+            keyword arguments of func, hashed by value
+        code : str
+            version of the code of func, changes the key when the code changes
+        '''
+        params = {} if params is None else params
+        key = self.key(name, inputs, params, code)
+        value = self.get(key)
+        if value is None:
+            value = func(**params)
+            self.put(key, value, name=name, inputs=_flatten(inputs), params={k: str(v)[:200] for k, v in params.items()})
+        return value
+
+    def usage(self):
+        '''
+        usage - entries of the cache with their size and last access, least recently used first
+        '''
+        entries = {key: _read_json(self._meta_path(key)) for key in self._entries()}
+        frame = pd.DataFrame([{'key':key, 'name':meta['name'], 'size':meta['size'], 'last_access':meta['last_access']} for key, meta in entries.items() if meta is not None])
+        if len(frame) == 0:
+            return frame
+        return frame.sort_values('last_access').reset_index(drop=True)
+
+    def evict(self, budget : int = None, keep : str = None):
+        '''
+        evict - remove least recently used entries until the cache fits in budget
+
+        Returns
+        -------
+        list
+            keys of the removed entries
+        '''
+        budget = self.budget if budget is None else budget
+        usage = self.usage()
+        if len(usage) == 0:
+            return []
+        total = usage['size'].sum()
+        removed = []
+        for entry in usage.itertuples():
+            if total <= budget:
+                break
+            if entry.key == keep:
+                continue
+            self.remove(entry.key)
+            total -= entry.size
+            removed.append(entry.key)
+        return removed
+
+    def remove(self, key : str):
+        meta = _read_json(self._meta_path(key))
+        for fn in ([f'{self.cache_dir}{meta["file"]}'] if meta else []) + [self._meta_path(key)]:
+            try:
+                os.remove(fn)
+            except FileNotFoundError:
+                pass
+
+    def clear(self, name : str = None):
+        '''
+        clear - remove all entries, or all entries of a product name
+        '''
+        for entry in self.usage().itertuples():
+            if (name is None) or (entry.name == name):
+                self.remove(entry.key)
+
+
+def cached(inputs=(), name : str = None, cache : ProductCache = None):
+    '''
+    cached - decorator that returns the product of a function from the cache
+
+    the arguments named in inputs are file paths (or lists of paths) hashed by
+    content, all other arguments are hashed by value, and the source code of
+    the function is part of the key
+
+    Parameters
+    ----------
+    inputs : list
+        names of the arguments that are input files
+    name : str
+        product name, the function name if None
+    cache : ProductCache
+        ProductCache() (created on first use) if None
+    '''
+    def decorator(func):
+        signature = inspect.signature(func)
+        code = _code_hash(func)
+        product = func.__name__ if name is None else name
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            product_cache = ProductCache() if cache is None else cache
+            files = [bound.arguments[arg] for arg in inputs]
+            key = product_cache.key(product, files, {k: v for k, v in bound.arguments.items() if k not in inputs}, code)
+            value = product_cache.get(key)
+            if value is None:
+                value = func(*bound.args, **bound.kwargs)
+                params = {k: str(v)[:200] for k, v in bound.arguments.items() if k not in inputs}
+                product_cache.put(key, value, name=product, inputs=_flatten(files), params=params)
+            return value
+        return wrapper
+    return decorator
+
+
+def _record_path(fn : str):
+    return f'{fn}.inputs.json'
+
+
+def _fingerprint(fn : str):
+    stat = os.stat(fn)
+    return {'size':stat.st_size, 'mtime_ns':stat.st_mtime_ns}
+
+
+def is_current(outputs, inputs=(), params : dict = None, hash_dir : str = None):
+    '''
+    is_current - whether outputs written by a script are up to date
+
+    True if every output exists, was recorded with record, has not changed
+    since and was computed from the same inputs (by content) and params
+    '''
+    outputs = _flatten(outputs)
+    key = None
+    for fn in outputs:
+        record_ = _read_json(_record_path(fn))
+        if (record_ is None) or not os.path.exists(fn) or (record_['output'] != _fingerprint(fn)):
+            return False
+        if key is None:
+            key = ProductCache(hash_dir).key('', inputs, params)
+        if record_['key'] != key:
+            return False
+    return True
+
+
+def record(outputs, inputs=(), params : dict = None, hash_dir : str = None, adopted : bool = False):
+    '''
+    record - store the input hashes and params of outputs written by a script, next to every output
+
+    adopted marks outputs that were not written by this run (see adopt)
+    '''
+    key = ProductCache(hash_dir).key('', inputs, params)
+    for fn in _flatten(outputs):
+        _write_json(_record_path(fn), {
+            'key':key,
+            'output':_fingerprint(fn),
+            'inputs':_flatten(inputs),
+            'params':params,
+            'recorded':time.time(),
+            'adopted':adopted,
+        })
+
+
+def adopt(outputs, inputs=(), params = None, hash_dir : str = None):
+    '''
+    adopt - record existing outputs that have no record, with the params they were written with
+
+    outputs written before the scripts recorded their inputs would otherwise
+    never be current and be computed again. The params must be those the
+    outputs were actually written with, not the current settings, so that
+    is_current with other settings still recomputes them.
+
+    Parameters
+    ----------
+    outputs : str or list
+    inputs : list
+        files the outputs were computed from
+    params : dict or callable
+        params of the outputs, or a function that reads them from the first
+        output (e.g. internal_waves.stored_params)
+
+    Returns
+    -------
+    bool
+        True if the outputs were adopted, i.e. all of them exist and none has a record
+    '''
+    outputs = _flatten(outputs)
+    if not all(os.path.exists(fn) and not os.path.exists(_record_path(fn)) for fn in outputs):
+        return False
+    if callable(params):
+        params = params(outputs[0])
+    record(outputs, inputs, params, hash_dir, adopted=True)
+    return True
@@ -0,0 +1,162 @@
+'''
+reception_quality.py - per transmission noise, SNR and quality flags of the stacked receptions
+
+The stacks written by compute_receptions.py (|matched filter output| with
+dimensions transmission and shorttime, one variable per node) are read once
+per node. Every transmission gets the noise RMS in the noise region of the
+node (``noise_bounds``, the shorttime ranges picked in
+ArrivalStatistics.ipynb, or the part of the MLS period outside the predicted
+arrival window for nodes without one), the band averaged noise level, the
+peak in the predicted arrival window (travel time table, see
+kb2ooi/travel_times.py) and its SNR, and bit flags for transmissions that
+should not be used. The result is a columnar table (one row per band, node
+and transmission) written as parquet.
+'''
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from kb2ooi import travel_times
+
+# quality flags, combined with bitwise or
+flags = {
+    'missing':1,      # more than max_missing of the samples are NaN
+    'low_snr':2,      # peak SNR below min_snr
+    'noisy':4,        # noise RMS above noisy_factor times the median of the node
+    'edge_peak':8,    # peak on the edge of the arrival window
+}
+
+
+# shorttime [s] of the noise region of every node, from ArrivalStatistics.ipynb
+noise_bounds = {
+    'AXCC1':(17, 27),
+    'AXEC2':(17, 27),
+    'AXBA1':(17, 27),
+    'HYS14':(17, 27),
+    'LJ01C':(17, 27),
+    'PC01A':(5, 15),
+    'PC03A':(17, 27),
+}
+
+
+def arrival_mask(shorttime : np.ndarray, node : str, table : xr.Dataset):
+    '''
+    arrival_mask - samples of the stack (shorttime) in the predicted arrival window
+
+    absolute time = shorttime + mls_integer*mls_period + mls_period/2, and the
+    window is wrapped into a single MLS period
+    '''
+    entry = table.sel({'node':node})
+    period = table.attrs.get('mls_period', travel_times.mls_period)
+    time = shorttime + int(entry['mls_integer'])*period + period/2
+    start = float(entry['window_start'])
+    length = float(entry['window_end']) - start
+    return np.mod(time - start, period) <= length
+
+
+def noise_mask(shorttime : np.ndarray, node : str, table : xr.Dataset):
+    '''
+    noise_mask - samples of the stack (shorttime) used for the noise, noise_bounds of node (inclusive)
+
+    the samples outside the predicted arrival window for nodes without noise_bounds
+    '''
+    if node not in noise_bounds:
+        return ~arrival_mask(shorttime, node, table)
+    start, end = noise_bounds[node]
+    return (shorttime >= start) & (shorttime <= end)
+
+
+def node_quality(stack : xr.DataArray, in_arrival : np.ndarray, in_noise : np.ndarray = None, min_snr : float = 10, noisy_factor : float = 3, max_missing : float = 0.1):
+    '''
+    node_quality - quality of every transmission of one node, vectorized over transmissions
+
+    Parameters
+    ----------
+    stack : xr.DataArray
+        |stack| (transmission, shorttime)
+    in_arrival : np.ndarray
+        bool (shorttime,), samples in the arrival window
+    in_noise : np.ndarray
+        bool (shorttime,), samples of the noise, outside the arrival window if None
+    min_snr : float
+        peak SNR [dB] below which transmissions are flagged low_snr
+    noisy_factor : float
+        noise RMS relative to the median of the node above which transmissions are flagged noisy
+    max_missing : float
+        fraction of NaN samples above which transmissions are flagged missing
+
+    Returns
+    -------
+    pd.DataFrame
+        indexed by transmission
+    '''
+    x = stack.transpose('transmission', 'shorttime').values
+    noise = x[:, ~in_arrival if in_noise is None else in_noise]
+    arrival = x[:, in_arrival]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        noise_power = np.nanmean(noise**2, axis=1)
+        # per component RMS of the complex matched filter output
+        noise_rms = np.sqrt(noise_power) / np.sqrt(2)
+        filled = np.where(np.isfinite(arrival), arrival, -np.inf)
+        peak_idx = np.argmax(filled, axis=1)
+        peak = filled[np.arange(len(filled)), peak_idx]
+        peak = np.where(np.isfinite(peak), peak, np.nan)
+        peak_snr = 20*np.log10(peak / noise_rms)
+        noise_level = 10*np.log10(noise_power)
+
+    shorttime = stack.shorttime.values
+    missing = np.isnan(x).mean(axis=1)
+    median_noise = np.nanmedian(noise_rms) if np.isfinite(noise_rms).any() else np.nan
+
+    flag = np.zeros(len(x), dtype=np.int32)
+    flag |= np.where(missing > max_missing, flags['missing'], 0).astype(np.int32)
+    flag |= np.where(~(peak_snr >= min_snr), flags['low_snr'], 0).astype(np.int32)
+    flag |= np.where(noise_rms > noisy_factor*median_noise, flags['noisy'], 0).astype(np.int32)
+    flag |= np.where((peak_idx == 0) | (peak_idx == arrival.shape[1] - 1), flags['edge_peak'], 0).astype(np.int32)
+
+    return pd.DataFrame(
+        {
+            'noise_rms':noise_rms,
+            'noise_level_db':noise_level,
+            'peak':peak,
+            'peak_snr_db':peak_snr,
+            'peak_shorttime':shorttime[in_arrival][peak_idx] if in_arrival.any() else np.nan,
+            'missing_fraction':missing,
+            'flags':flag,
+        },
+        index=pd.Index(stack.transmission.values, name='transmission'),
+    )
+
+
+def quality_table(stacks : xr.Dataset, table : xr.Dataset, band : str, **kwargs):
+    '''
+    quality_table - one pass over the stacks of every node
+
+    Parameters
+    ----------
+    stacks : xr.Dataset
+        stacks from compute_receptions.py, one variable per node
+    table : xr.Dataset
+        travel time table
+    band : str
+        name of the stacks (e.g. 'bb' or 'lf'), the first level of the index
+    **kwargs
+        passed to node_quality
+
+    Returns
+    -------
+    pd.DataFrame
+        indexed by (band, node, transmission), nodes in both stacks have a row per band
+    '''
+    frames = {}
+    for node in stacks.data_vars:
+        if node not in table.node:
+            print(f'{node} is not in the travel time table, skipping')
+            continue
+        stack = stacks[node].load()
+        in_arrival = arrival_mask(stack.shorttime.values, node, table)
+        in_noise = noise_mask(stack.shorttime.values, node, table)
+        frames[(band, node)] = node_quality(stack, in_arrival, in_noise, **kwargs)
+    return pd.concat(frames, names=['band', 'node', 'transmission'])
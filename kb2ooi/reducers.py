@@ -0,0 +1,185 @@
+'''
+reducers.py - reduce range resolved RAM output to the products that are written
+
+Range resolved runs (``rdec > 0``, e.g. TL_iw_range.py) return the complex
+field on the full (frequency, depth, range) grid, but the products that are
+used are much smaller: transmission loss on a display grid, depth averaged
+TL, or the field at a few receivers. A reducer is updated with consecutive
+blocks of range steps and only keeps its own product.
+
+bighorn.run_ram returns the whole field at the end of the run, so the field
+is passed to the reducers in blocks afterwards. This reduces the size of the
+written output, not the peak memory of the run, which is still set by the
+full range resolved field.
+'''
+
+import numpy as np
+import xarray as xr
+import bighorn
+
+
+class Reducer:
+    '''
+    Reducer - base class, subclasses implement update and result
+
+    update is called with consecutive blocks (..., depth, range) of the
+    complex field in range order
+    '''
+
+    def update(self, block : xr.DataArray):
+        raise NotImplementedError
+
+    def result(self):
+        raise NotImplementedError
+
+
+class _Decimated(Reducer):
+    # keeps every range_step-th range and depth_step-th depth of the field,
+    # counted from the start of the run so that blocks can have any length
+
+    def __init__(self, range_step : int = 1, depth_step : int = 1):
+        self.range_step = range_step
+        self.depth_step = depth_step
+        self._n_range = 0
+        self._blocks = []
+
+    def _transform(self, block):
+        raise NotImplementedError
+
+    def update(self, block : xr.DataArray):
+        offset = (-self._n_range) % self.range_step
+        self._n_range += block.sizes['range']
+        block = block.isel({'range':slice(offset, None, self.range_step), 'depth':slice(None, None, self.depth_step)})
+        if block.sizes['range'] > 0:
+            self._blocks.append(self._transform(block))
+
+    def result(self):
+        return xr.concat(self._blocks, dim='range')
+
+
+class Amplitude(_Decimated):
+    '''
+    Amplitude - pressure magnitude |p| on a decimated (range, depth) grid
+
+    averages over realizations should be taken of |p| before converting to dB
+    '''
+
+    def _transform(self, block):
+        return np.abs(block).astype(np.float32)
+
+
+class PartMagnitude(_Decimated):
+    '''
+    PartMagnitude - (|Re p| + |Im p|) / 2 on a decimated (range, depth) grid
+
+    the quantity that map.ipynb averaged over realizations for the TL panel,
+    when it opened the ``_Gfz_real`` and ``_Gfz_imag`` files of every
+    realization together and took the mean of their magnitudes
+    '''
+
+    def _transform(self, block):
+        return ((np.abs(block.real) + np.abs(block.imag))/2).astype(np.float32)
+
+
+class TL(_Decimated):
+    '''
+    TL - transmission loss 20 log10 |p| [dB] on a decimated (range, depth) grid
+    '''
+
+    def _transform(self, block):
+        return (20*np.log10(np.abs(block))).astype(np.float32)
+
+
+class DepthAveragedTL(Reducer):
+    '''
+    DepthAveragedTL - 10 log10 of the depth averaged intensity [dB] at every range step
+
+    Parameters
+    ----------
+    depth_range : tuple
+        (min, max) depth [m] of the average, full depth if None
+    '''
+
+    def __init__(self, depth_range : tuple = None):
+        self.depth_range = depth_range
+        self._blocks = []
+
+    def update(self, block : xr.DataArray):
+        if self.depth_range is not None:
+            block = block.sel({'depth':slice(*self.depth_range)})
+        self._blocks.append((np.abs(block)**2).mean('depth'))
+
+    def result(self):
+        return (10*np.log10(xr.concat(self._blocks, dim='range'))).astype(np.float32)
+
+
+class Receivers(Reducer):
+    '''
+    Receivers - complex field at selected receivers
+
+    Parameters
+    ----------
+    receivers : dict
+        {name: (range [km], depth [m])}, the nearest grid point is used
+    '''
+
+    def __init__(self, receivers : dict):
+        self.receivers = receivers
+        self._values = {}
+
+    def update(self, block : xr.DataArray):
+        r_max = float(block.range[-1])
+        for name, (r, z) in self.receivers.items():
+            if (name not in self._values) and (r <= r_max):
+                self._values[name] = block.sel({'range':r, 'depth':z}, method='nearest')
+
+    def result(self):
+        names = [name for name in self.receivers if name in self._values]
+        return xr.concat([self._values[name] for name in names], dim='receiver').assign_coords({'receiver':names})
+
+
+class Field(Reducer):
+    '''
+    Field - the full complex field, only used if it is explicitly requested
+    '''
+
+    def __init__(self):
+        self._blocks = []
+
+    def update(self, block : xr.DataArray):
+        self._blocks.append(block.copy())
+
+    def result(self):
+        return xr.concat(self._blocks, dim='range')
+
+
+def run_reduced(env, reducers : dict, block_size : int = 100, **run_args):
+    '''
+    run_reduced - run RAM and return the products of the reducers instead of the field
+
+    the field is released before anything is written, but it is held in full
+    while the reducers run
+
+    Parameters
+    ----------
+    env : envy.EnvironmentRAM
+    reducers : dict
+        {name: Reducer}
+    block_size : int
+        number of range steps passed to the reducers at once
+    **run_args
+        passed to bighorn.run_ram, rdec should be > 0
+
+    Returns
+    -------
+    dict
+        {name: reducer.result()}
+    '''
+    gf = bighorn.run_ram(env, **run_args)
+    for start in range(0, gf.sizes['range'], block_size):
+        block = gf.isel({'range':slice(start, start + block_size)})
+        for reducer in reducers.values():
+            reducer.update(block)
+    del gf
+
+    return {name: reducer.result() for name, reducer in reducers.items()}
@@ -0,0 +1,344 @@
+'''
+resources.py - predict wall time and peak memory of PE tasks and pick SLURM allocations
+
+The prediction is a small linear cost model. PE work scales with
+(number of frequencies) x (range steps) x (depth points) x (pade terms) and is
+split across CPUs, while environment preparation (interpolation, flat earth
+transform) scales with the size of the sound speed grid. Coefficients start
+from rough defaults and are refit with non-negative least squares once enough
+finished jobs have been recorded in the job history file.
+'''
+
+import os
+import json
+import time
+import resource
+import numpy as np
+from scipy.optimize import nnls
+
+# partition limits, ckpt-g2 is preemptible so only short tasks are sent there
+partitions = {
+    'cpu-g2': {'max_time': 36*3600, 'max_cpus': 40, 'max_mem': 180},
+    'ckpt-g2': {'max_time': 3*3600, 'max_cpus': 40, 'max_mem': 180},
+}
+
+# cpu counts that are tried when choosing an allocation
+cpu_options = [10, 20, 30, 40]
+
+# default coefficients used until there is enough job history
+#   wall time [s] = c0 + c1 * pe_work / n_cpus + c2 * env_work
+#   peak rss [B]  = m0 + m1 * env_cells + m2 * env_cells * n_cpus
+default_time_coefs = np.array([300, 1.2e5, 60])
+default_mem_coefs = np.array([10e9, 400, 32])
+
+# PE parameters used by run_PE_monte_carlo.py
+mc_params = {
+    'num_range_points': 3000,
+    'dr': 10,
+    'dz': 2,
+    'zmax': 6200,
+    'n_pade': 8,
+    'Fs': 300,
+    'T0': 10,
+    'bw': (37.5, 112.5),
+}
+
+
+def history_path():
+    '''
+    history_path - path of the job history file (JSON lines)
+    '''
+    return f'{os.environ["data_directory"]}logs/pe_history.jsonl'
+
+
+def num_frequencies(Fs : float, T0 : float, bw : tuple):
+    '''
+    num_frequencies - number of frequencies solved by bighorn.run_ram
+
+    The frequency spacing is 1/T0 and only frequencies inside of the band
+    (and below the nyquist frequency) are solved.
+
+    Parameters
+    ----------
+    Fs : float
+        sampling rate [Hz]
+    T0 : float
+        length of time window [s]
+    bw : tuple
+        (lower, upper) frequency band [Hz]
+
+    Returns
+    -------
+    n_freq : int
+    '''
+    f = np.arange(int(Fs*T0)) / T0
+    return int(np.sum((f >= bw[0]) & (f <= bw[1]) & (f <= Fs/2)))
+
+
+def task_features(path_length : float, num_range_points : int, dr : float, dz : float, zmax : float, n_pade : int, Fs : float, T0 : float, bw : tuple):
+    '''
+    task_features - compute cost model features for a single PE task
+
+    Parameters
+    ----------
+    path_length : float
+        length of the path from source to receiver [km]
+    num_range_points : int
+        number of range profiles in the sound speed slice
+    dr : float
+        PE range step [m]
+    dz : float
+        PE depth step [m]
+    zmax : float
+        maximum depth of the PE grid [m]
+    n_pade : int
+        number of pade terms (RAM parameter np)
+    Fs, T0, bw :
+        arguments passed to bighorn.run_ram
+
+    Returns
+    -------
+    features : dict
+        pe_work (units of 1e12 grid point updates), env_work (units of 1e6
+        sound speed grid points) and env_cells
+    '''
+    n_freq = num_frequencies(Fs, T0, bw)
+    n_range = path_length*1000 / dr
+    n_depth = zmax / dz
+
+    return {
+        'n_freq': n_freq,
+        'pe_work': n_freq * n_range * n_depth * n_pade / 1e12,
+        'env_work': num_range_points * n_depth / 1e6,
+        'env_cells': num_range_points * n_depth,
+    }
+
+
+def time_design(features : dict, n_cpus : int):
+    return [1, features['pe_work'] / n_cpus, features['env_work']]
+
+
+def mem_design(features : dict, n_cpus : int):
+    return [1, features['env_cells'], features['env_cells'] * n_cpus]
+
+
+def load_history(fn : str = None, cold_only : bool = True):
+    '''
+    load_history - read finished job records from the job history file
+
+    Parameters
+    ----------
+    fn : str
+        history file, default is history_path()
+    cold_only : bool
+        skip records of warm worker processes (see record_job) and records
+        written before they were tagged
+
+    Returns
+    -------
+    records : list
+        list of dictionaries, empty if there is no history yet
+    '''
+    if fn is None:
+        fn = history_path()
+    if not os.path.exists(fn):
+        return []
+
+    records = []
+    with open(fn, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            # warm worker records do not measure the peak memory of a cold job, and
+            # records without the warm tag summed the children over n_cpus
+            if cold_only and (record.get('warm', True) is not False):
+                continue
+            if ('wall_time' in record) and ('max_rss' in record):
+                records.append(record)
+    return records
+
+
+def fit_coefficients(records : list):
+    '''
+    fit_coefficients - refit cost model coefficients from job history
+
+    Falls back to default coefficients if there are not enough records.
+
+    Parameters
+    ----------
+    records : list
+        job records returned by load_history
+
+    Returns
+    -------
+    time_coefs : np.array
+    mem_coefs : np.array
+    '''
+    if len(records) < 2*len(default_time_coefs):
+        return default_time_coefs, default_mem_coefs
+
+    A_t = np.array([time_design(r['features'], r['n_cpus']) for r in records], dtype=float)
+    A_m = np.array([mem_design(r['features'], r['n_cpus']) for r in records], dtype=float)
+    t = np.array([r['wall_time'] for r in records], dtype=float)
+    m = np.array([r['max_rss'] for r in records], dtype=float)
+
+    # scale columns so nnls is well conditioned
+    st = A_t.max(axis=0)
+    sm = A_m.max(axis=0)
+    time_coefs, _ = nnls(A_t / st, t)
+    mem_coefs, _ = nnls(A_m / sm, m)
+
+    return time_coefs / st, mem_coefs / sm
+
+
+def predict(features : dict, n_cpus : int, coefs : tuple = None):
+    '''
+    predict - predict wall time and peak memory for a PE task
+
+    Parameters
+    ----------
+    features : dict
+        output of task_features
+    n_cpus : int
+        number of CPUs used by the task
+    coefs : tuple
+        (time_coefs, mem_coefs), if None they are fit from the job history
+
+    Returns
+    -------
+    wall_time : float
+        predicted wall time [s]
+    max_rss : float
+        predicted peak memory [bytes]
+    '''
+    if coefs is None:
+        coefs = fit_coefficients(load_history())
+    time_coefs, mem_coefs = coefs
+
+    wall_time = float(np.dot(time_design(features, n_cpus), time_coefs))
+    max_rss = float(np.dot(mem_design(features, n_cpus), mem_coefs))
+    return wall_time, max_rss
+
+
+def choose_allocation(features : dict, coefs : tuple = None, margin : float = 1.5):
+    '''
+    choose_allocation - choose partition, walltime, number of CPUs and memory
+
+    The preemptible ckpt-g2 partition is used only if the task is predicted to
+    finish (with margin) inside of its time limit. Otherwise the smallest number
+    of CPUs that fits inside of the cpu-g2 time limit is used.
+
+    Parameters
+    ----------
+    features : dict
+        output of task_features
+    coefs : tuple
+        (time_coefs, mem_coefs), if None they are fit from the job history
+    margin : float
+        safety factor applied to predicted wall time and memory
+
+    Returns
+    -------
+    allocation : dict
+        keys partition, n_cpus, time (seconds), mem (GB), predicted_time,
+        predicted_mem
+    '''
+    if coefs is None:
+        coefs = fit_coefficients(load_history())
+
+    def build(partition, n_cpus):
+        wall_time, max_rss = predict(features, n_cpus, coefs)
+        requested_time = int(np.ceil(wall_time*margin / 900) * 900)
+        mem = int(np.ceil(max_rss*margin / 1e9 / 10) * 10)
+        return {
+            'partition': partition,
+            'n_cpus': n_cpus,
+            'time': max(requested_time, 900),
+            'mem': mem,
+            'predicted_time': wall_time,
+            'predicted_mem': max_rss,
+        }
+
+    def fits(allocation):
+        limits = partitions[allocation['partition']]
+        return (allocation['time'] <= limits['max_time']) and (allocation['mem'] <= limits['max_mem'])
+
+    for n_cpus in cpu_options:
+        allocation = build('ckpt-g2', n_cpus)
+        if fits(allocation):
+            return allocation
+
+    for n_cpus in cpu_options:
+        allocation = build('cpu-g2', n_cpus)
+        if fits(allocation):
+            return allocation
+
+    # nothing fits, request the limit and let the job run as long as possible
+    allocation = build('cpu-g2', cpu_options[-1])
+    allocation['time'] = partitions['cpu-g2']['max_time']
+    allocation['mem'] = min(allocation['mem'], partitions['cpu-g2']['max_mem'])
+    print(f'warning: predicted task does not fit in any partition, requesting limits {allocation}')
+    return allocation
+
+
+def format_time(seconds : int):
+    '''
+    format_time - format seconds as a SLURM time string (HH:MM:SS)
+    '''
+    seconds = int(seconds)
+    return f'{seconds//3600}:{(seconds % 3600)//60:02}:{seconds % 60:02}'
+
+
+def record_job(features : dict, n_cpus : int, wall_time : float, fn : str = None, warm : bool = False, **kwargs):
+    '''
+    record_job - append a finished job to the job history file
+
+    Peak memory is the measured peak RSS of the job, ru_maxrss of the process
+    or of its largest child process (RAM runs in process). In a long running
+    worker (pe_worker.py) ru_maxrss is the peak over the lifetime of the
+    process and has no import overhead, so these records are tagged warm and
+    not used by fit_coefficients, which sizes cold SLURM jobs.
+
+    Parameters
+    ----------
+    features : dict
+        output of task_features
+    n_cpus : int
+        number of CPUs used by the task
+    wall_time : float
+        wall time of the task [s]
+    fn : str
+        history file, default is history_path()
+    warm : bool
+        whether the job ran in a process that had already run other jobs or
+        had its inputs loaded
+    **kwargs
+        extra fields to store with the record (e.g. node, realization)
+    '''
+    if fn is None:
+        fn = history_path()
+    os.makedirs(os.path.dirname(fn), exist_ok=True)
+
+    # ru_maxrss is in kilobytes on linux
+    rss_self = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    rss_children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+
+    record = {
+        'features': features,
+        'n_cpus': n_cpus,
+        'wall_time': wall_time,
+        'max_rss': max(rss_self, rss_children),
+        'warm': bool(warm),
+        'finished': time.time(),
+        'slurm_job_id': os.environ.get('SLURM_JOB_ID'),
+        'partition': os.environ.get('SLURM_JOB_PARTITION'),
+        **kwargs,
+    }
+
+    with open(fn, 'a') as f:
+        f.write(json.dumps(record) + '\n')
@@ -0,0 +1,221 @@
+'''
+shared_env.py - environment arrays in shared memory for process pool workers
+
+Passing a (range, depth) sound speed slice to a process pool pickles the whole
+array to every worker and pickles the results back. ``SharedEnvironment``
+places the sound speed, bathymetry and bottom property arrays in
+``multiprocessing.shared_memory`` (or in memory mapped .npy files when a
+directory is given), and workers only receive small handles (name, shape,
+dtype, coordinates) and the index range they work on. ``attach`` returns
+DataArrays that are views of the shared buffers.
+
+``flat_earth_c`` uses this for the flat earth transform: the input slice and
+the output are shared buffers, and every worker transforms a block of ranges
+with envy.flat_earth_c in place. It reports the bytes sent to and from the
+workers and the peak RSS of every worker.
+'''
+
+import os
+import pickle
+import resource
+import tempfile
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+import xarray as xr
+
+
+def _allocate(shape : tuple, dtype, memmap_dir : str = None, name : str = 'array'):
+    # returns the array, a handle and the object that owns the buffer
+    dtype = np.dtype(dtype)
+    if memmap_dir is None:
+        shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape))*dtype.itemsize, 1))
+        array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        return array, {'name':shm.name, 'shape':shape, 'dtype':dtype.str}, shm
+    os.makedirs(memmap_dir, exist_ok=True)
+    # unique file in memmap_dir, whether or not it ends with a separator
+    fd, path = tempfile.mkstemp(suffix='.npy', prefix=f'{name}_{os.getpid()}_', dir=memmap_dir)
+    os.close(fd)
+    array = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+    return array, {'path':path, 'shape':shape, 'dtype':dtype.str}, array
+
+
+def _attach_array(handle : dict):
+    # returns the array and the object that keeps its buffer alive
+    if 'path' in handle:
+        array = np.load(handle['path'], mmap_mode='r+')
+        return array, array
+    shm = shared_memory.SharedMemory(name=handle['name'])
+    return np.ndarray(handle['shape'], dtype=np.dtype(handle['dtype']), buffer=shm.buf), shm
+
+
+def _release(owner, unlink : bool):
+    if isinstance(owner, shared_memory.SharedMemory):
+        owner.close()
+        if unlink:
+            owner.unlink()
+    elif isinstance(owner, np.memmap) and unlink:
+        path = owner.filename
+        del owner
+        os.remove(path)
+
+
+class SharedEnvironment:
+    '''
+    SharedEnvironment - DataArrays copied once into shared buffers
+
+    Parameters
+    ----------
+    memmap_dir : str
+        directory for memory mapped .npy files, shared memory is used if None
+    **arrays
+        DataArrays to share, e.g. ssp=..., bathy=..., cb=...
+
+    Use as a context manager so the buffers are removed when it exits.
+    '''
+
+    def __init__(self, memmap_dir : str = None, **arrays):
+        self.memmap_dir = memmap_dir
+        self.handles = {}
+        self.arrays = {}
+        self._owners = []
+        for name, da in arrays.items():
+            if da is not None:
+                self.add(name, da)
+
+    def add(self, name : str, da : xr.DataArray):
+        '''
+        add - copy a DataArray into a shared buffer
+        '''
+        self.arrays[name], self.handles[name] = self.allocate(name, da.shape, da.dtype, da.dims, {k: v for k, v in da.coords.items()}, da.attrs)
+        self.arrays[name][...] = da.values
+        return self.arrays[name]
+
+    def allocate(self, name : str, shape : tuple, dtype, dims : tuple, coords : dict, attrs : dict = None):
+        '''
+        allocate - empty shared buffer with a handle that workers can attach to
+        '''
+        array, handle, owner = _allocate(tuple(shape), dtype, self.memmap_dir, name)
+        self._owners.append(owner)
+        coords = {k: (v.dims, np.asarray(v.values)) if isinstance(v, xr.DataArray) else v for k, v in coords.items()}
+        return array, {'array':handle, 'dims':tuple(dims), 'coords':coords, 'attrs':dict(attrs or {})}
+
+    def close(self):
+        for owner in self._owners:
+            _release(owner, unlink=True)
+        self._owners = []
+        self.arrays = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def attach(handle : dict, index : dict = None):
+    '''
+    attach - DataArray view of a shared buffer from its handle
+
+    Parameters
+    ----------
+    handle : dict
+        SharedEnvironment.handles entry
+    index : dict
+        {dim: slice} of the view, e.g. the block of ranges of a worker
+
+    Returns
+    -------
+    da : xr.DataArray
+        view of the shared buffer, writes go to the shared buffer
+    owner
+        object that keeps the buffer alive, keep a reference while da is used
+    '''
+    array, owner = _attach_array(handle['array'])
+    dims = handle['dims']
+    index = index or {}
+    slices = tuple(index.get(dim, slice(None)) for dim in dims)
+    coords = {}
+    for name, (coord_dims, values) in handle['coords'].items():
+        coords[name] = (coord_dims, values[tuple(index.get(dim, slice(None)) for dim in coord_dims)])
+    da = xr.DataArray(array[slices], dims=dims, coords=coords, attrs=handle['attrs'])
+    return da, owner
+
+
+def _flat_earth_block(ssp_handle : dict, out_handle : dict, start : int, end : int):
+    import envy
+
+    ssp, ssp_owner = attach(ssp_handle, {'range':slice(start, end)})
+    out, out_owner = attach(out_handle, {'range':slice(start, end)})
+    block = envy.flat_earth_c(ssp, verbose=False)
+    out.values[...] = block.transpose(*out.dims).values
+    del ssp, out
+    _release(ssp_owner, unlink=False)
+    _release(out_owner, unlink=False)
+    return os.getpid(), resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+
+
+def flat_earth_c(ssp : xr.DataArray, n_cpus : int = 1, chunk_size : int = 360, memmap_dir : str = None, verbose : bool = True):
+    '''
+    flat_earth_c - envy.flat_earth_c over blocks of ranges with shared input and output buffers
+
+    Parameters
+    ----------
+    ssp : xr.DataArray
+        sound speed (range, depth)
+    n_cpus : int
+        number of worker processes
+    chunk_size : int
+        number of ranges per block
+    memmap_dir : str
+        use memory mapped files in this directory instead of shared memory
+    verbose : bool
+        print the transfer report
+
+    Returns
+    -------
+    ssp_f : xr.DataArray
+        flat earth transformed sound speed
+    report : dict
+        array_bytes (size of ssp), transfer_bytes (pickled arguments and
+        results of all blocks) and worker_rss ({pid: peak RSS bytes})
+    '''
+    import envy
+
+    ssp = ssp.transpose('range', ...)
+    n_range = ssp.sizes['range']
+    bounds = [(start, min(start + chunk_size, n_range)) for start in range(0, n_range, chunk_size)]
+
+    # the first block gives the depth grid of the transformed slice
+    first = envy.flat_earth_c(ssp.isel({'range':slice(*bounds[0])}), verbose=False).transpose('range', ...)
+    range_coords = {k: v for k, v in ssp.coords.items() if set(v.dims) <= {'range'}}
+    other_coords = {k: v for k, v in first.coords.items() if 'range' not in v.dims}
+
+    with SharedEnvironment(memmap_dir=memmap_dir, ssp=ssp) as shared:
+        out, out_handle = shared.allocate('ssp_f', (n_range,) + first.shape[1:], first.dtype, first.dims, {**range_coords, **other_coords}, first.attrs)
+        out[:first.sizes['range']] = first.values
+
+        tasks = [(shared.handles['ssp'], out_handle, start, end) for start, end in bounds[1:]]
+        transfer_bytes = 0
+        worker_rss = {}
+        if len(tasks) > 0:
+            ctx = mp.get_context('fork')
+            with ctx.Pool(min(n_cpus, len(tasks))) as pool:
+                for result in pool.starmap(_flat_earth_block, tasks):
+                    pid, rss = result
+                    worker_rss[pid] = max(worker_rss.get(pid, 0), rss)
+                    transfer_bytes += len(pickle.dumps(result))
+            transfer_bytes += sum(len(pickle.dumps(task)) for task in tasks)
+
+        ssp_f = xr.DataArray(np.array(out), dims=first.dims, coords={**range_coords, **other_coords}, attrs=first.attrs)
+
+    report = {
+        'array_bytes':int(ssp.nbytes),
+        'transfer_bytes':int(transfer_bytes),
+        'n_blocks':len(bounds),
+        'worker_rss':worker_rss,
+    }
+    if verbose:
+        rss = list(worker_rss.values()) or [0]
+        print(f'flat earth: {len(bounds)} blocks, {transfer_bytes/1e6:.2f} MB transferred for a {ssp.nbytes/1e6:.1f} MB slice, worker peak RSS {max(rss)/1e9:.2f} GB')
+    return ssp_f, report
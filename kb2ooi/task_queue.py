@@ -0,0 +1,132 @@
+'''
+task_queue.py - minimal file based task queue shared by workers on different nodes
+
+Each task is a small JSON file. Workers claim a task by renaming it from
+``pending/`` to ``running/``, which is atomic on a shared filesystem, so two
+workers can never claim the same task. Finished tasks are moved to ``done/``
+or ``failed/``. Tasks left in ``running/`` by a preempted worker are put back
+with ``requeue_stale``.
+'''
+
+import os
+import json
+import time
+import socket
+
+states = ['pending', 'running', 'done', 'failed']
+
+
+def default_queue_dir(name : str):
+    return f'{os.environ["data_directory"]}logs/queue/{name}/'
+
+
+class TaskQueue:
+    '''
+    TaskQueue - directory backed queue of JSON tasks
+
+    Parameters
+    ----------
+    queue_dir : str
+        directory of the queue, sub directories are created for every state
+    '''
+
+    def __init__(self, queue_dir : str):
+        self.queue_dir = queue_dir
+        for state in states:
+            os.makedirs(os.path.join(queue_dir, state), exist_ok=True)
+
+    def _path(self, state, task_id):
+        return os.path.join(self.queue_dir, state, f'{task_id}.json')
+
+    def list(self, state : str = 'pending'):
+        '''
+        list - sorted task ids in a given state
+        '''
+        return sorted(fn[:-5] for fn in os.listdir(os.path.join(self.queue_dir, state)) if fn.endswith('.json'))
+
+    def put(self, task_id : str, task : dict):
+        '''
+        put - add a task, unless it is already pending or running
+
+        Returns
+        -------
+        bool
+            True if the task was added
+        '''
+        if os.path.exists(self._path('pending', task_id)) or os.path.exists(self._path('running', task_id)):
+            return False
+
+        # write to a temporary file first so workers never read a partial task
+        tmp = os.path.join(self.queue_dir, f'.{task_id}.{os.getpid()}.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(task, f)
+        os.replace(tmp, self._path('pending', task_id))
+        return True
+
+    def claim(self):
+        '''
+        claim - claim the next pending task
+
+        Returns
+        -------
+        task_id : str
+            None if the queue is empty
+        task : dict
+        '''
+        for task_id in self.list('pending'):
+            try:
+                os.rename(self._path('pending', task_id), self._path('running', task_id))
+            except FileNotFoundError:
+                # claimed by another worker
+                continue
+
+            with open(self._path('running', task_id), 'r') as f:
+                task = json.load(f)
+            task['claimed'] = time.time()
+            task['host'] = socket.gethostname()
+            task['job_id'] = os.environ.get('SLURM_JOB_ID')
+            with open(self._path('running', task_id), 'w') as f:
+                json.dump(task, f)
+            return task_id, task
+
+        return None, None
+
+    def finish(self, task_id : str, failed : bool = False, **info):
+        '''
+        finish - move a running task to done (or failed)
+        '''
+        with open(self._path('running', task_id), 'r') as f:
+            task = json.load(f)
+        task.update(info)
+        task['finished'] = time.time()
+
+        state = 'failed' if failed else 'done'
+        with open(self._path(state, task_id), 'w') as f:
+            json.dump(task, f, default=str)
+        os.remove(self._path('running', task_id))
+
+    def release(self, task_id : str):
+        '''
+        release - put a running task back into pending (e.g. not enough time left)
+        '''
+        os.rename(self._path('running', task_id), self._path('pending', task_id))
+
+    def requeue_stale(self, max_age : float):
+        '''
+        requeue_stale - return running tasks older than max_age seconds to pending
+
+        Returns
+        -------
+        int
+            number of tasks that were requeued
+        '''
+        n = 0
+        now = time.time()
+        for task_id in self.list('running'):
+            if now - os.path.getmtime(self._path('running', task_id)) > max_age:
+                try:
+                    self.release(task_id)
+                    n += 1
+                except FileNotFoundError:
+                    continue
+        return n
@@ -0,0 +1,171 @@
+'''
+time_coherence.py - streaming estimate of the time coherence of the PE arrivals
+
+The time coherence runs (run_PE_time_coherence.py) write one Green's
+function per time step of the same internal wave realization, one MLS
+transmission (``time_step``) apart. ``CoherenceEstimator`` is updated with the
+field at the receiver depth of each time step, in time order. It keeps the
+last ``max_lag`` steps and running (Welford) mean and variance of the
+normalized cross product for every lag, so memory does not grow with the
+number of time steps and the coherence curve with confidence bounds can be
+read at any point. ``update_from_files`` consumes the time steps that have
+been written so far and stops at the first step that is missing or can not
+be read yet. Time steps are written with pe.write_gf, which renames complete
+files into place.
+'''
+
+import os
+from collections import deque
+import numpy as np
+import xarray as xr
+from scipy import stats
+
+from kb2ooi import precision
+
+# time between time steps of the time coherence experiment [s], one MLS transmission
+time_step = 27.28
+# number of time steps, time_idx in [0, 42] in KB2OOI_time_func.m
+n_time_steps = 43
+
+
+class CoherenceEstimator:
+    '''
+    CoherenceEstimator - running coherence vs lag from fields in time order
+
+    The complex coherence of a pair of time steps separated by lag is
+    vdot(g_t, g_t+lag) / (|g_t||g_t+lag|) over frequency. The estimate at each
+    lag is the magnitude of the mean over all pairs, with a normal
+    confidence interval from the standard error of the mean.
+
+    Parameters
+    ----------
+    max_lag : int
+        largest lag [time steps]
+    '''
+
+    def __init__(self, max_lag : int):
+        self.max_lag = max_lag
+        self.n_steps = 0
+        self._buffer = deque(maxlen=max_lag)
+        self._n = np.zeros(max_lag + 1, dtype=int)
+        self._mean = np.zeros(max_lag + 1, dtype=complex)
+        self._m2 = np.zeros(max_lag + 1)
+
+    def update(self, g):
+        '''
+        update - add the field (frequency,) of the next time step
+        '''
+        g = np.asarray(g, dtype=complex).ravel()
+        g = g / np.linalg.norm(g)
+
+        # lag 0 and every lag to the previous steps in the buffer
+        gammas = [np.vdot(g, g)] + [np.vdot(prev, g) for prev in reversed(self._buffer)]
+        for lag, gamma in enumerate(gammas):
+            self._n[lag] += 1
+            delta = gamma - self._mean[lag]
+            self._mean[lag] += delta / self._n[lag]
+            self._m2[lag] += np.real(np.conj(delta)*(gamma - self._mean[lag]))
+
+        self._buffer.append(g)
+        self.n_steps += 1
+
+    def result(self, confidence : float = 0.95):
+        '''
+        result - coherence vs lag with confidence bounds
+
+        Returns
+        -------
+        xr.Dataset
+            coherence, lower, upper and n_pairs with lag [s] coordinate, only
+            lags with at least one pair
+        '''
+        lags = np.nonzero(self._n > 0)[0]
+        n = self._n[lags]
+        coherence = np.abs(self._mean[lags])
+
+        var = np.full(len(lags), np.nan)
+        var[n > 1] = self._m2[lags][n > 1] / (n[n > 1] - 1)
+        z = stats.norm.ppf(0.5 + confidence/2)
+        se = np.sqrt(var / n)
+
+        return xr.Dataset(
+            {
+                'coherence':('lag', coherence),
+                'lower':('lag', np.clip(coherence - z*se, 0, 1)),
+                'upper':('lag', np.clip(coherence + z*se, 0, 1)),
+                'n_pairs':('lag', n),
+            },
+            coords={'lag':lags*time_step, 'lag_steps':('lag', lags)},
+            attrs={'n_steps':self.n_steps, 'confidence':confidence, 'time_step':time_step},
+        )
+
+    def save(self, fn : str):
+        '''
+        save - write the estimator state, so that it can be resumed with load
+        '''
+        buffer = np.array(self._buffer) if len(self._buffer) > 0 else np.zeros((0, 0), dtype=complex)
+        tmp = f'{fn}.{os.getpid()}.tmp.npz'
+        np.savez(tmp, max_lag=self.max_lag, n_steps=self.n_steps, buffer=buffer, n=self._n, mean=self._mean, m2=self._m2)
+        os.replace(tmp, fn)
+
+    @classmethod
+    def load(cls, fn : str, max_lag : int = None):
+        '''
+        load - estimator from a state written by save
+
+        raises ValueError if max_lag is given and differs from the max_lag of the state
+        '''
+        state = np.load(fn)
+        if (max_lag is not None) and (int(state['max_lag']) != max_lag):
+            raise ValueError(f'{fn} was written with max_lag {int(state["max_lag"])}, not {max_lag}. Remove it to start over with the new max_lag')
+        estimator = cls(int(state['max_lag']))
+        estimator.n_steps = int(state['n_steps'])
+        estimator._buffer.extend(list(state['buffer']))
+        estimator._n = state['n']
+        estimator._mean = state['mean']
+        estimator._m2 = state['m2']
+        return estimator
+
+
+def receiver_field(fnr : str, fni : str, depth : float):
+    '''
+    receiver_field - Green's function (frequency,) at the receiver depth from a real / imaginary file pair
+    '''
+    gf_real = xr.open_dataarray(fnr).sel({'depth':depth}, method='nearest').load()
+    gf_imag = xr.open_dataarray(fni).sel({'depth':depth}, method='nearest').load()
+    return precision.as_complex(gf_real + 1j*gf_imag).values
+
+
+def update_from_files(estimator : CoherenceEstimator, file_paths, depth : float, n_steps : int = None):
+    '''
+    update_from_files - update the estimator with every time step written since the last update
+
+    Parameters
+    ----------
+    estimator : CoherenceEstimator
+    file_paths : callable
+        file_paths(step) returns the (real, imaginary) file names of a time step
+    depth : float
+        receiver depth [m]
+    n_steps : int
+        total number of time steps, no limit if None
+
+    Returns
+    -------
+    int
+        number of time steps added
+    '''
+    added = 0
+    while (n_steps is None) or (estimator.n_steps < n_steps):
+        fnr, fni = file_paths(estimator.n_steps)
+        if not (os.path.exists(fnr) and os.path.exists(fni)):
+            break
+        try:
+            g = receiver_field(fnr, fni, depth)
+        except (OSError, ValueError) as e:
+            # a time step that is still being written without pe.write_gf, retried on the next update
+            print(f'time step {estimator.n_steps} could not be read ({e}), stopping')
+            break
+        estimator.update(g)
+        added += 1
+    return added
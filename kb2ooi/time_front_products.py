@@ -0,0 +1,209 @@
+'''
+time_front_products.py - precomputed time front tiles for figures and panel apps
+
+The time front figures convert the full (frequency, depth) Green's function of
+every node to time and take 20 log10 |g| each time they are drawn.
+``build_time_front`` does this once after time_fronts.py. The periodic time
+series is unwrapped over ``time_range`` (relative to the travel time offset
+fs_integer*T0 + alignment_offset of the travel time table, which is applied
+to the time coordinate, windowed runs with a shorter T0 are unwrapped
+around their travel time first) and stored in a zarr store as int16 dB
+tiles (zstd compressed, chunked in depth and time) with a pyramid of levels
+coarsened by 2 in depth and time.
+``open_time_front`` slices a time / depth window from the coarsest level that
+still has the requested number of pixels, so zooming does not recompute FFTs.
+'''
+
+import os
+import json
+import numpy as np
+import xarray as xr
+import numcodecs
+import bighorn
+
+from kb2ooi import pe, travel_times
+from kb2ooi.tl_products import select_level, quantizable, tl_step, fill_value
+
+# time_fronts.py output name of each case, the climate run is written to
+# iw_climate_<node> and the perturbed run to climate_<node>
+case_files = {
+    'climate':'iw_climate_{node}_Gfz',
+    'iw':'climate_{node}_Gfz',
+}
+
+
+def time_offset(node : str):
+    '''
+    time_offset - travel time offset [s] applied to the time front of node, from the travel time table
+    '''
+    return travel_times.time_offset(node)
+
+
+def default_product_dir():
+    return f'{os.environ["data_directory"]}timefront_products/'
+
+
+def product_path(node : str, product_dir : str = None):
+    if product_dir is None:
+        product_dir = default_product_dir()
+    return f'{product_dir}{node}.zarr'
+
+
+def to_time_front(gf : xr.DataArray, node : str, time_range : tuple = (-5, 10), Fs : float = None, T0 : float = None, bw : tuple = None):
+    '''
+    to_time_front - 20 log10 |g| (depth, time) with the travel time offset of node applied
+
+    Parameters
+    ----------
+    gf : xr.DataArray
+        Green's function (frequency, depth) from time_fronts.py
+    node : str
+        hydrophone name
+    time_range : tuple
+        relative time range [s] of the output, the periodic time series is
+        repeated if it is longer than T0
+    Fs, T0, bw
+        arguments used for bighorn.run_ram, taken from the attributes of gf
+        (pe.run_attrs) or pe.run_args if None
+
+    The offset fs_integer*T0 counts periods of the T0 of the travel time
+    table (pe.run_args['T0']). A windowed run (time_fronts.py --window,
+    pe.window_run_args) is periodic in its own, shorter T0, so it is
+    unwrapped to absolute time around the travel time of the run
+    (pe.window_to_time) and put on the same time axis. Times outside its
+    window of length T0 are NaN.
+    '''
+    Fs = Fs if Fs is not None else gf.attrs.get('Fs', pe.run_args['Fs'])
+    T0 = T0 if T0 is not None else gf.attrs.get('T0', pe.run_args['T0'])
+    bw = bw if bw is not None else tuple(gf.attrs.get('bw', pe.run_args['bw']))
+
+    n_start = int(np.floor(time_range[0]*Fs))
+    n_end = int(np.ceil(time_range[1]*Fs))
+    table = travel_times.load_table()
+    time = np.arange(n_start, n_end)/Fs + travel_times.time_offset(node, table)
+    if T0 == table.attrs['T0']:
+        gt = bighorn.convert_to_time(gf, Fs, T0, bw)
+        gt = gt.isel({'time':np.arange(n_start, n_end) % gt.sizes['time']})
+        gt = gt.assign_coords({'time':time})
+    else:
+        travel_time = gf.attrs.get('travel_time', travel_times.travel_time(node, table=table))
+        gt = pe.window_to_time(gf, travel_time, T0, Fs, T0, bw)
+        gt = gt.assign_coords({'time':gt.time.values + float(table['alignment_offset'].sel({'node':node}))})
+        gt = gt.reindex({'time':time}, method='nearest', tolerance=0.5/Fs)
+
+    tf = 20*np.log10(np.abs(gt))
+    return tf.where(np.isfinite(tf)).transpose('depth', 'time').astype(np.float32)
+
+
+def coarsen(tf : xr.DataArray, factor : int = 2):
+    '''
+    coarsen - maximum dB over factor x factor (depth, time) cells, so arrivals stay visible
+    '''
+    return tf.coarsen({'depth':factor, 'time':factor}, boundary='trim').max()
+
+
+def build_time_front(node : str, timefront_dir : str = None, product_dir : str = None, cases : list = None, time_range : tuple = (-5, 10), n_levels : int = 4, tile : tuple = (256, 512)):
+    '''
+    build_time_front - write the time front tiles of node
+
+    Parameters
+    ----------
+    node : str
+        hydrophone name
+    timefront_dir : str
+        directory of the time_fronts.py outputs, <data_directory>timefront/ if None
+    product_dir : str
+        output directory, <data_directory>timefront_products/ if None
+    cases : list
+        cases in case_files, all if None
+    time_range : tuple
+        relative time range [s]
+    n_levels : int
+        number of pyramid levels, level k is coarsened by 2**k
+    tile : tuple
+        (depth, time) chunk shape
+
+    Returns
+    -------
+    report : dict
+        shape and bytes of every case and level
+    '''
+    if timefront_dir is None:
+        timefront_dir = f'{os.environ["data_directory"]}timefront/'
+    if cases is None:
+        cases = list(case_files)
+    store = product_path(node, product_dir)
+    os.makedirs(os.path.dirname(store), exist_ok=True)
+
+    report = {'node':node, 'time_offset':time_offset(node), 'time_range':list(time_range), 'cases':{}}
+    for case in cases:
+        fn = f'{timefront_dir}{case_files[case].format(node=node)}'
+        gf = pe.read_gf(f'{fn}_real.nc', f'{fn}_imag.nc')
+        tf = to_time_front(gf, node, time_range)
+
+        levels = []
+        for level in range(n_levels):
+            if level > 0:
+                tf = coarsen(tf)
+            ds = quantizable(tf)[0].to_dataset(name='tf')
+            ds.attrs.update({'node':node, 'case':case, 'level':level, 'factor':2**level, 'time_offset':time_offset(node)})
+            encoding = {'tf':{
+                'dtype':'int16',
+                'scale_factor':tl_step,
+                '_FillValue':fill_value,
+                'compressor':numcodecs.Zstd(level=9),
+                'chunks':(min(tile[0], ds.sizes['depth']), min(tile[1], ds.sizes['time'])),
+            }}
+            ds.to_zarr(store, group=f'{case}/level_{level}', mode='w', encoding=encoding)
+            levels.append({'level':level, 'shape':[int(ds.sizes['depth']), int(ds.sizes['time'])]})
+        report['cases'][case] = levels
+
+    with open(f'{store}/report.json', 'w') as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def open_time_front(node : str, case : str = 'climate', time_lim : tuple = None, depth_lim : tuple = None, pixels : tuple = None, level : int = None, product_dir : str = None):
+    '''
+    open_time_front - time front [dB] of node in absolute travel time
+
+    Parameters
+    ----------
+    node : str
+        hydrophone name
+    case : str
+        'climate' or 'iw'
+    time_lim : tuple
+        absolute time limits [s], full time range if None
+    depth_lim : tuple
+        depth limits [m] in either order, full depth if None
+    pixels : tuple
+        (depth, time) pixels of the panel, the level is chosen so that the
+        selected window has at least this many points. Finest level if None
+    level : int
+        pyramid level, overrides pixels
+
+    Returns
+    -------
+    xr.DataArray
+        (depth, time), loaded lazily
+    '''
+    store = product_path(node, product_dir)
+    with open(f'{store}/report.json') as f:
+        report = json.load(f)
+
+    indexers = {}
+    if time_lim is not None:
+        indexers['time'] = slice(min(time_lim), max(time_lim))
+    if depth_lim is not None:
+        indexers['depth'] = slice(min(depth_lim), max(depth_lim))
+
+    if level is None:
+        level = 0
+        if pixels is not None:
+            # shape of the window at every level
+            full = xr.open_zarr(store, group=f'{case}/level_0')['tf'].sel(indexers)
+            shapes = [[full.sizes['depth'] // 2**lvl['level'], full.sizes['time'] // 2**lvl['level']] for lvl in report['cases'][case]]
+            level = select_level(shapes, pixels)
+
+    return xr.open_zarr(store, group=f'{case}/level_{level}')['tf'].sel(indexers)
@@ -0,0 +1,294 @@
+'''
+tl_products.py - quantized, multiresolution transmission loss products for figures
+
+``build_product`` reduces the range resolved PE output of all realizations in
+``tl_iws/`` for a node to transmission loss in dB. ``tl`` has the definition
+of the original map.ipynb panel, which opened the ``_Gfz_real`` and
+``_Gfz_imag`` files of all realizations together: 20 log10 of the mean of
+|Re p| and |Im p| over realizations. ``tl_median`` is 20 log10 of the median
+|p| over realizations. ``baseline_tl`` recomputes the original panel from the
+full fields, to compare with the product. TL is stored in a zarr store as int16 with a fixed dB
+step (``tl_step``), clipped to the range int16 can hold (``tl_limits``, about
++-327 dB), zstd compressed in chunks along range, and as a pyramid of
+levels that are each coarsened by 2 in range and depth. ``open_product``
+returns the coarsest level that still has at least the requested number of
+pixels, so figures only read what they can show.
+'''
+
+import os
+import glob
+import json
+import numpy as np
+import xarray as xr
+import numcodecs
+
+# quantization step of the stored TL [dB]
+tl_step = 0.01
+fill_value = np.iinfo(np.int16).min
+# range of TL [dB] that int16 with tl_step can hold, fill_value is reserved for missing values
+tl_limits = ((fill_value + 1)*tl_step, np.iinfo(np.int16).max*tl_step)
+
+
+def default_product_dir():
+    return f'{os.environ["data_directory"]}tl_products/'
+
+
+def product_path(node : str, product_dir : str = None):
+    if product_dir is None:
+        product_dir = default_product_dir()
+    return f'{product_dir}{node}_tl.zarr'
+
+
+def _gf_paths(node : str, tl_dir : str):
+    fnrs = sorted(glob.glob(f'{tl_dir}{node}_*_Gfz_real.nc'))
+    return fnrs, [fn.replace('_real.nc', '_imag.nc') for fn in fnrs]
+
+
+def load_magnitudes(node : str, tl_dir : str = None):
+    '''
+    load_magnitudes - |p| and (|Re p| + |Im p|) / 2 (realization, depth, range) of every realization of node in tl_iws/
+
+    uses the display grid products of TL_iw_range.py (``*_amplitude.nc`` and
+    ``*_part_magnitude.nc``) if they exist, otherwise the full complex fields
+    (``*_Gfz_real/imag.nc``)
+
+    Returns
+    -------
+    magnitudes : xr.Dataset
+        amplitude and part_magnitude
+    input_bytes : int
+        size of the files that were read
+    '''
+    if tl_dir is None:
+        tl_dir = f'{os.environ["data_directory"]}tl_iws/'
+
+    fns = sorted(glob.glob(f'{tl_dir}{node}_*_amplitude.nc'))
+    fn_parts = [fn.replace('_amplitude.nc', '_part_magnitude.nc') for fn in fns]
+    if (len(fns) > 0) and all(os.path.exists(fn) for fn in fn_parts):
+        realizations = [
+            xr.Dataset({'amplitude':xr.open_dataarray(fn).load(), 'part_magnitude':xr.open_dataarray(fn_part).load()})
+            for fn, fn_part in zip(fns, fn_parts)
+        ]
+        input_bytes = sum(os.path.getsize(fn) for fn in fns + fn_parts)
+    else:
+        fnrs, fnis = _gf_paths(node, tl_dir)
+        realizations = []
+        for fnr, fni in zip(fnrs, fnis):
+            gf_real = xr.open_dataarray(fnr).load()
+            gf_imag = xr.open_dataarray(fni).load()
+            realizations.append(xr.Dataset({
+                'amplitude':np.abs(gf_real + 1j*gf_imag).astype(np.float32),
+                'part_magnitude':((np.abs(gf_real) + np.abs(gf_imag))/2).astype(np.float32),
+            }))
+        input_bytes = sum(os.path.getsize(fn) for fn in fnrs + fnis)
+
+    if len(realizations) == 0:
+        raise FileNotFoundError(f'no transmission loss files for {node} in {tl_dir}')
+
+    magnitudes = xr.concat(realizations, dim='realization')
+    # single frequency runs, drop the frequency dimension
+    magnitudes = magnitudes.squeeze(drop=True).transpose('realization', 'depth', 'range')
+    return magnitudes, input_bytes
+
+
+def baseline_tl(node : str, tl_dir : str = None):
+    '''
+    baseline_tl - TL [dB] of the original map.ipynb panel from the full complex fields
+
+    the real and imaginary files of all realizations are concatenated along
+    one dimension and 20 log10 of their mean magnitude is taken, as map.ipynb
+    did with ``open_mfdataset`` over ``tl_iws/*.nc`` (first frequency)
+    '''
+    if tl_dir is None:
+        tl_dir = f'{os.environ["data_directory"]}tl_iws/'
+    fnrs, fnis = _gf_paths(node, tl_dir)
+    if len(fnrs) == 0:
+        raise FileNotFoundError(f'no _Gfz_real.nc files for {node} in {tl_dir}')
+    tl = xr.concat([xr.open_dataarray(fn) for fn in fnrs + fnis], dim='realizations')
+    return 20*np.log10(np.abs(tl)[:,0,:,:].mean('realizations')).compute()
+
+
+def coarsen(magnitudes, factor : int = 2):
+    '''
+    coarsen - block average magnitudes over factor x factor (depth, range) cells
+    '''
+    return magnitudes.coarsen({'depth':factor, 'range':factor}, boundary='trim').mean()
+
+
+def to_tl(magnitudes : xr.Dataset):
+    '''
+    to_tl - TL [dB] of the mean part magnitude (as map.ipynb) and of the median |p| over realizations
+    '''
+    ds = xr.Dataset({
+        'tl':20*np.log10(magnitudes['part_magnitude'].mean('realization')),
+        'tl_median':20*np.log10(magnitudes['amplitude'].median('realization')),
+    })
+    # |p| = 0 is stored as missing
+    return ds.where(np.isfinite(ds))
+
+
+def quantizable(x):
+    '''
+    quantizable - clip TL [dB] to the range that the int16 encoding can hold
+
+    values beyond tl_limits (and +inf) are set to the nearest limit, NaN and
+    -inf (|p| = 0) are set to NaN and stored as fill_value, so nothing wraps
+    around when the scaled values are cast to int16
+
+    Parameters
+    ----------
+    x : xr.DataArray or xr.Dataset
+        TL [dB]
+
+    Returns
+    -------
+    clipped : same type as x
+    n_clipped : int
+        number of finite or +inf values that were set to a limit
+    '''
+    keep = np.isfinite(x) | (x == np.inf)
+    outside = keep & ((x < tl_limits[0]) | (x > tl_limits[1]))
+    if isinstance(outside, xr.Dataset):
+        n_clipped = int(sum(int(outside[var].sum()) for var in outside.data_vars))
+    else:
+        n_clipped = int(outside.sum())
+    return x.where(keep).clip(*tl_limits), n_clipped
+
+
+def _encoding(ds : xr.Dataset, range_chunk : int):
+    compressor = numcodecs.Zstd(level=9)
+    return {
+        var: {
+            'dtype':'int16',
+            'scale_factor':tl_step,
+            '_FillValue':fill_value,
+            'compressor':compressor,
+            'chunks':(ds.sizes['depth'], min(range_chunk, ds.sizes['range'])),
+        }
+        for var in ds.data_vars
+    }
+
+
+def build_product(node : str, tl_dir : str = None, product_dir : str = None, n_levels : int = 4, range_chunk : int = 512, compare : bool = False):
+    '''
+    build_product - write the TL pyramid of node
+
+    Parameters
+    ----------
+    node : str
+        hydrophone name
+    tl_dir : str
+        directory of the TL_iw_range.py outputs, <data_directory>tl_iws/ if None
+    product_dir : str
+        output directory, <data_directory>tl_products/ if None
+    n_levels : int
+        number of pyramid levels, level k is coarsened by 2**k
+    range_chunk : int
+        chunk length along range
+    compare : bool
+        compare the stored level 0 tl with baseline_tl, which reads the full
+        complex fields (TL_iw_range.py --save_field)
+
+    Returns
+    -------
+    report : dict
+        input bytes, bytes and shape of every level, the maximum
+        quantization error [dB], the number of values clipped to tl_limits
+        and, with compare, the largest difference to baseline_tl [dB]
+    '''
+    magnitudes, input_bytes = load_magnitudes(node, tl_dir)
+    store = product_path(node, product_dir)
+    os.makedirs(os.path.dirname(store), exist_ok=True)
+
+    report = {'node':node, 'n_realizations':int(magnitudes.sizes['realization']), 'input_bytes':input_bytes, 'levels':[]}
+    for level in range(n_levels):
+        if level > 0:
+            magnitudes = coarsen(magnitudes)
+        ds, n_clipped = quantizable(to_tl(magnitudes).astype(np.float32))
+        ds.attrs.update({'node':node, 'level':level, 'factor':2**level})
+        ds.to_zarr(store, group=f'level_{level}', mode='w', encoding=_encoding(ds, range_chunk))
+
+        stored = xr.open_zarr(store, group=f'level_{level}')['tl'].values
+        valid = np.isfinite(ds['tl'].values)
+        report['levels'].append({
+            'level':level,
+            'shape':[int(ds.sizes['depth']), int(ds.sizes['range'])],
+            'bytes':_store_bytes(f'{store}/level_{level}'),
+            'max_error':float(np.max(np.abs(stored[valid] - ds['tl'].values[valid]))),
+            'n_clipped':n_clipped,
+        })
+
+    if compare:
+        report['baseline'] = compare_baseline(node, xr.open_zarr(store, group='level_0')['tl'], tl_dir)
+
+    with open(f'{store}/report.json', 'w') as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def compare_baseline(node : str, tl : xr.DataArray, tl_dir : str = None):
+    '''
+    compare_baseline - difference [dB] between a stored tl level and baseline_tl at its grid points
+
+    Returns
+    -------
+    dict
+        max_difference and rms_difference [dB] and the number of points
+    '''
+    baseline = baseline_tl(node, tl_dir).sel({'depth':tl.depth, 'range':tl.range}, method='nearest')
+    difference = tl.values - baseline.transpose('depth', 'range').values
+    valid = np.isfinite(difference)
+    return {
+        'max_difference':float(np.max(np.abs(difference[valid]))),
+        'rms_difference':float(np.sqrt(np.mean(difference[valid]**2))),
+        'n_points':int(valid.sum()),
+    }
+
+
+def _store_bytes(path : str):
+    return sum(os.path.getsize(os.path.join(root, fn)) for root, _, fns in os.walk(path) for fn in fns)
+
+
+def select_level(shapes : list, pixels : tuple):
+    '''
+    select_level - coarsest level with at least pixels (depth, range) points
+
+    Parameters
+    ----------
+    shapes : list
+        (depth, range) shape of every level, finest first
+    pixels : tuple
+        (depth, range) pixels of the figure panel
+    '''
+    for level in range(len(shapes) - 1, -1, -1):
+        if (shapes[level][0] >= pixels[0]) and (shapes[level][1] >= pixels[1]):
+            return level
+    return 0
+
+
+def open_product(node : str, pixels : tuple = None, level : int = None, product_dir : str = None):
+    '''
+    open_product - TL dataset of node at the level that matches the figure resolution
+
+    Parameters
+    ----------
+    node : str
+        hydrophone name
+    pixels : tuple
+        (depth, range) pixels of the figure panel, finest level if None
+    level : int
+        pyramid level, overrides pixels
+
+    Returns
+    -------
+    xr.Dataset
+        tl and tl_median [dB]
+    '''
+    store = product_path(node, product_dir)
+    if level is None:
+        level = 0
+        if pixels is not None:
+            with open(f'{store}/report.json') as f:
+                shapes = [lvl['shape'] for lvl in json.load(f)['levels']]
+            level = select_level(shapes, pixels)
+    return xr.open_zarr(store, group=f'level_{level}')
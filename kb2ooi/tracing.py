@@ -0,0 +1,237 @@
+'''
+tracing.py - lightweight per-stage timing and memory tracing for pipeline scripts
+
+Each traced process writes one JSON line per stage with wall time, CPU time
+(including finished child processes) and the peak RSS of the stage. The
+stage peak is sampled from /proc/self/statm by a background thread (every
+``sample_interval`` seconds, so spikes shorter than that can be missed),
+because ru_maxrss is the peak over the lifetime of the process and every
+stage after the peak would report it. ru_maxrss of the process and of its
+children is stored as lifetime_max_rss(_children). Lines are appended as soon
+as a stage ends, so jobs that are killed or preempted still leave a partial
+trace. Stages are sequential, calling ``stage`` again ends the previous stage::
+
+    tracer = tracing.Tracer('run_PE_monte_carlo', node=node)
+    tracer.stage('environment fetch')
+    ...
+    tracer.stage('ram')
+    ...
+    tracer.close()
+
+``stage`` can also be used as a context manager.
+'''
+
+import os
+import json
+import time
+import socket
+import resource
+import threading
+
+# interval of the RSS samples [s]
+sample_interval = 0.05
+
+
+def default_trace_dir():
+    '''
+    default_trace_dir - directory that traces are written to
+
+    ``<data_directory>logs/traces/`` if data_directory is set, otherwise
+    ``logs/traces/`` relative to the working directory
+    '''
+    return f'{os.environ.get("data_directory", "")}logs/traces/'
+
+
+def _usage():
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    child_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        'wall': time.perf_counter(),
+        'cpu': self_usage.ru_utime + self_usage.ru_stime + child_usage.ru_utime + child_usage.ru_stime,
+        # ru_maxrss is in kilobytes on linux, peak over the lifetime of the process
+        'lifetime_max_rss': self_usage.ru_maxrss * 1024,
+        'lifetime_max_rss_children': child_usage.ru_maxrss * 1024,
+    }
+
+
+def current_rss():
+    '''
+    current_rss - resident set size of this process [bytes], None where /proc is not available
+    '''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class _RSSSampler(threading.Thread):
+    '''
+    _RSSSampler - peak RSS since the last reset, sampled in a daemon thread
+    '''
+
+    def __init__(self, interval : float = sample_interval):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._peak = current_rss()
+        self.available = self._peak is not None
+
+    def sample(self):
+        rss = current_rss()
+        if rss is None:
+            return
+        with self._lock:
+            self._peak = max(self._peak or 0, rss)
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.sample()
+
+    def reset(self):
+        '''
+        reset - peak since the last reset, and start a new one
+        '''
+        self.sample()
+        with self._lock:
+            peak, self._peak = self._peak, current_rss()
+        return peak
+
+    def stop(self):
+        self._stop_event.set()
+
+
+class Tracer:
+    '''
+    Tracer - record wall time, CPU time and peak RSS for stages of a script
+
+    Parameters
+    ----------
+    script : str
+        name of the entry point (e.g. 'run_PE_monte_carlo')
+    trace_dir : str
+        directory to write JSON lines to, default is default_trace_dir()
+    **tags
+        extra fields stored with every record (e.g. node, realization)
+    '''
+
+    def __init__(self, script : str, trace_dir : str = None, **tags):
+        if trace_dir is None:
+            trace_dir = default_trace_dir()
+        os.makedirs(trace_dir, exist_ok=True)
+
+        self.script = script
+        self.tags = tags
+        self.job_id = os.environ.get('SLURM_JOB_ID')
+        self.array_id = os.environ.get('SLURM_ARRAY_TASK_ID')
+        # CPUs this process may run on, tasks pinned by kb2ooi.pe_tasks only charge their slot
+        self.n_cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+        self.host = socket.gethostname()
+        self.pid = os.getpid()
+        self.fn = f'{trace_dir}{script}_{self.job_id or "local"}_{self.pid}.jsonl'
+
+        self._current = None
+        self._start = _usage()
+        self._start_time = time.time()
+        self._sampler = _RSSSampler()
+        self._peak = None
+        if self._sampler.available:
+            self._sampler.start()
+
+    def stage(self, name : str):
+        '''
+        stage - end the current stage (if any) and start stage ``name``
+
+        Returns the tracer, so ``with tracer.stage(name):`` ends the stage
+        when the block exits.
+        '''
+        self.end()
+        self._sampler.reset()
+        self._current = (name, _usage(), time.time())
+        return self
+
+    def end(self):
+        '''
+        end - end the current stage and write its record
+        '''
+        if self._current is None:
+            return
+        name, start, start_time = self._current
+        self._current = None
+        stage_peak = self._sampler.reset() if self._sampler.available else None
+        if stage_peak is not None:
+            self._peak = max(self._peak or 0, stage_peak)
+        self._write(name, start, start_time, stage_peak)
+
+    def close(self):
+        '''
+        close - end the current stage and write a total record for the script
+        '''
+        self.end()
+        peak = self._sampler.reset() if self._sampler.available else None
+        if peak is not None:
+            self._peak = max(self._peak or 0, peak)
+        self._sampler.stop()
+        self._write('total', self._start, self._start_time, self._peak)
+
+    def _write(self, name, start, start_time, stage_max_rss):
+        stop = _usage()
+        record = {
+            'script': self.script,
+            'stage': name,
+            'start': start_time,
+            'wall_time': stop['wall'] - start['wall'],
+            'cpu_time': stop['cpu'] - start['cpu'],
+            'stage_max_rss': stage_max_rss,
+            'lifetime_max_rss': stop['lifetime_max_rss'],
+            'lifetime_max_rss_children': stop['lifetime_max_rss_children'],
+            'n_cpus': self.n_cpus,
+            'job_id': self.job_id,
+            'array_id': self.array_id,
+            'host': self.host,
+            'pid': self.pid,
+            **self.tags,
+        }
+        with open(self.fn, 'a') as f:
+            f.write(json.dumps(record, default=str) + '\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.end()
+        return False
+
+
+def load_traces(trace_dir : str = None):
+    '''
+    load_traces - read all trace records in a directory
+
+    Parameters
+    ----------
+    trace_dir : str
+        directory containing trace files, default is default_trace_dir()
+
+    Returns
+    -------
+    records : list
+        list of dictionaries, one per stage
+    '''
+    if trace_dir is None:
+        trace_dir = default_trace_dir()
+    if not os.path.exists(trace_dir):
+        return []
+
+    records = []
+    for fn in sorted(os.listdir(trace_dir)):
+        if not fn.endswith('.jsonl'):
+            continue
+        with open(os.path.join(trace_dir, fn), 'r') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # partially written line from a killed job
+                    continue
+    return records
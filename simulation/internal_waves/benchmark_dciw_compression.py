@@ -0,0 +1,92 @@
+'''
+benchmark_dciw_compression.py - file size, write / read throughput and sound speed error of compressed realizations
+
+Writes one merged realization uncompressed (as merge_dciw.py did before) and
+with internal_waves.write_realization for every tolerance, reads it back and
+reports the size, throughput and largest sound speed error. The results are
+written to <data_directory>iws/compression_benchmark.json.
+
+usage:
+    python simulation/internal_waves/benchmark_dciw_compression.py iws/realizations/dciw_001.nc --tolerances 1e-4 1e-3 1e-2
+'''
+import os
+import sys
+import json
+import time
+import shutil
+import pathlib
+import argparse
+import tempfile
+import numpy as np
+import xarray as xr
+from dotenv import load_dotenv
+
+# make repository modules importable when run as a script
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent.parent))
+from kb2ooi import internal_waves
+
+
+def benchmark(dciw : xr.DataArray, fn : str, write, repeats : int = 3):
+    '''
+    benchmark - best write / read time of a realization with the writer write(dciw, fn)
+    '''
+    write_times, read_times = [], []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        write(dciw, fn)
+        write_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        stored = xr.open_dataarray(fn).load()
+        read_times.append(time.perf_counter() - start)
+        stored.close()
+
+    error = np.abs(stored.values.astype(float) - dciw.values.astype(float))
+    return {
+        'bytes':os.path.getsize(fn),
+        'write_MBps':dciw.nbytes/1e6/min(write_times),
+        'read_MBps':dciw.nbytes/1e6/min(read_times),
+        'max_error':float(np.nanmax(error)),
+        'rms_error':float(np.sqrt(np.nanmean(error**2))),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark compressed realization files')
+    parser.add_argument('realization', type=str, help='realization file, relative to data_directory')
+    parser.add_argument('--tolerances', type=float, nargs='*', default=[1e-4, 1e-3, 1e-2], help='rounding tolerances [m/s]')
+    parser.add_argument('--complevel', type=int, default=4, help='zlib compression level')
+    parser.add_argument('--repeats', type=int, default=3, help='number of writes / reads per case')
+    args = parser.parse_args()
+
+    # load .env file
+    current_file_path = pathlib.Path(__file__).resolve()
+    env_path = f'{current_file_path.parent.parent.parent}/.env'
+    load_dotenv(env_path)
+
+    dciw = xr.open_dataarray(f'{os.environ["data_directory"]}{args.realization}').load()
+    tmp_dir = tempfile.mkdtemp()
+    fn = f'{tmp_dir}/dciw.nc'
+
+    cases = {'uncompressed':lambda da, fn: da.to_netcdf(fn)}
+    cases['lossless'] = lambda da, fn: internal_waves.write_realization(da, fn, tolerance=None, complevel=args.complevel)
+    for tolerance in args.tolerances:
+        cases[f'{tolerance:g} m/s'] = lambda da, fn, tolerance=tolerance: internal_waves.write_realization(da, fn, tolerance=tolerance, complevel=args.complevel)
+
+    results = {}
+    try:
+        for name, write in cases.items():
+            results[name] = benchmark(dciw, fn, write, args.repeats)
+            if name.endswith('m/s'):
+                results[name]['keepbits'] = internal_waves.keepbits(dciw.values, float(name.split()[0]))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    print(f'{"case":>14} {"size [MB]":>10} {"ratio":>6} {"write [MB/s]":>13} {"read [MB/s]":>12} {"max err [m/s]":>14}')
+    for name, result in results.items():
+        ratio = results['uncompressed']['bytes'] / result['bytes']
+        print(f'{name:>14} {result["bytes"]/1e6:10.1f} {ratio:6.1f} {result["write_MBps"]:13.0f} {result["read_MBps"]:12.0f} {result["max_error"]:14.2e}')
+
+    out_fn = f'{os.environ["data_directory"]}iws/compression_benchmark.json'
+    with open(out_fn, 'w') as f:
+        json.dump({'realization':args.realization, 'shape':list(dciw.shape), 'dtype':str(dciw.dtype), 'results':results}, f, indent=2)
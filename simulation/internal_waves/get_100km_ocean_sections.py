@@ -1,53 +1,60 @@
 """
 get_100km_ocean_sections.py - get 100km average sections of the ocean
-    along the tracts between KB and OOI Oregon Shelf hydrophone in
+    along the tracts between KB and the OOI hydrophones in
     order to compute internal wave perturbations. These results are used
     as the input to iwGM/scripts/KB_OOI_IW.m
+
+Hydrophones with nearly the same bearing from KB share a single
+envy.get_TSC_slice to the farthest hydrophone of the group; the nearer
+hydrophones use that slice up to their along-track range. The cross-track
+distance of each hydrophone from the shared path is printed.
+
+usage:
+    python get_100km_ocean_sections.py                    # all hydrophones
+    python get_100km_ocean_sections.py --hydrophones LJ01D
 """
+import os
+import sys
+import argparse
+import pathlib
+
+# make repository modules importable when run as a script
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent.parent))
+
+hydrophones = ['AXCC1','AXEC2','AXBA1','HYS14','HYSB1','LJ01C','PC01A','PC03A', 'LJ01A', 'LJ01D']
 
 if __name__ == '__main__':
     from kaooi.coordinates import coords
     import xarray as xr
     import envy
-    import gsw
-    from tqdm import tqdm
-    import numpy as np
-    import pathlib
-    import os
     from dotenv import load_dotenv
+    from kb2ooi import internal_waves, paths
+
+    parser = argparse.ArgumentParser(description='100 km averaged ocean sections between KB and the hydrophones')
+    parser.add_argument('--hydrophones', type=str, nargs='*', default=hydrophones, help='hydrophones to compute sections for')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='bearing tolerance for sharing a TSC slice [degrees]')
+    parser.add_argument('--num_range_points', type=int, default=1000, help='range points of the slice to the farthest hydrophone of a group')
+    args = parser.parse_args()
 
     # load .env file
     current_file_path = pathlib.Path(__file__).resolve()
     env_path = f'{current_file_path.parent.parent.parent}/.env'
     load_dotenv(env_path)
 
-    hydrophone = 'LJ01D'
-
-    T, S, C = envy.get_TSC_slice(coords['KB'], coords[hydrophone], 1000, fillna=True)
-    tsc = xr.Dataset({'T':T, 'S':S, 'C':C})
-
-    sections = []
-    for k in range(int((C.range[-2] - 100)/50) + 1):
-        
-        tsc_sec = tsc.sel({'range':slice(50*k, 50*(k+1)+50)})
-        mean_lat = tsc_sec.lat.mean()
-        mean_range = tsc_sec.range.mean()
-        tsc_sec = tsc_sec.mean('range').assign_coords({'lat':mean_lat})
-        
-        N2, pmid = gsw.Nsquared(tsc_sec.S, tsc_sec.T, tsc.depth, lat=tsc_sec.lat, )
-        N2 = xr.DataArray(N2, dims=['depth'], coords={'depth':tsc_sec.depth[:-1]})
-        pmid = xr.DataArray(pmid, dims=['depth'], coords={'depth':tsc_sec.depth[:-1]})
-        section = tsc_sec.merge({'N2':N2, 'pmid':pmid})
-        section = section.expand_dims({'range':[float(mean_range)]})#, create_index_for_new_dim=False).assign_coords({'range':float(mean_range)})
-
-        sections.append(section)
-    sections = xr.concat(sections, dim='range')
-
-    sections_interp = sections.interp({'depth':np.arange(0,5000)}, method='linear')
-
     # check that directory exists
     file_dir = f'{os.environ['data_directory']}/iws/'
     if not os.path.exists(file_dir):
         os.makedirs(file_dir)
 
-    sections_interp.to_netcdf(f'{file_dir}/KB_2_{hydrophone}.nc')
\ No newline at end of file
+    for group in paths.group_paths(args.hydrophones, tolerance=args.tolerance):
+        reference = group['reference']
+        print(f'fetching TSC slice KB to {reference} for {group["nodes"]}...')
+        T, S, C = envy.get_TSC_slice(coords['KB'], coords[reference], args.num_range_points, fillna=True)
+        tsc = xr.Dataset({'T':T, 'S':S, 'C':C}).load()
+
+        for hydrophone in group['nodes']:
+            along_track, cross_track = group['offsets'][hydrophone]
+            print(f'    {hydrophone}: {along_track:.1f} km along {reference} path, {cross_track:.2f} km cross track')
+
+            sections = internal_waves.compute_sections(tsc.sel({'range':slice(0, along_track)}))
+            sections.to_netcdf(f'{file_dir}/KB_2_{hydrophone}.nc')
@@ -9,6 +9,12 @@ import numpy as np
 import xarray as xr
 from tqdm import tqdm
 import h5py
+import sys
+import argparse
+
+# make repository modules importable when run as a script
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent.parent))
+from kb2ooi import internal_waves, precision, products, tracing
 
 def open_iw_mat(fn, start_idx=0):
     '''
@@ -33,7 +39,7 @@ def open_iw_mat(fn, start_idx=0):
     print('loading sections into memory...')
     for k in tqdm(range(start_idx, fo['sectioniw']['dciw'].shape[0])):
         
-        dciw = fo[fo['sectioniw']['dciw'][k][0]][:]
+        dciw = precision.as_real(fo[fo['sectioniw']['dciw'][k][0]][:])
         xiw = fo[fo['sectioniw']['xiw'][k][0]][:]
         ziw = fo[fo['sectioniw']['ziw'][k][0]][:]
         
@@ -69,98 +75,63 @@ def merge_iw(fn : str, start_idx : int = 0, verbose : bool=True):
 
     dciws = open_iw_mat(fn, start_idx)
 
-    dr = float(dciws[0].range[1] - dciws[0].range[0])
-
-    def get_factors(x):
-        factors = []
-        for i in range(1, int(x + 1)):
-            if x % i == 0:
-                factors.append(i)
-        return factors
-
-    factors = np.array(get_factors(50e3))
-
-    # get dr that is integer divisible by (100/2)km
-    # largest integer factor of 100km that is larger that dr
-    dr_bin = int(np.max((factors - (dr*1000))[(factors - (dr*1000)) < 0]) + dr*1000)/1000
-
-    ro_idx = np.arange(0, len(dciws))
-
-    ro = ro_idx*50
-
-    rs = []
-    for k in range(len(ro)):
-        rs.append(np.arange(ro[k], ro[k] + 100, dr_bin))
-
-        dciws_interp = []
-
-    # interpolate and reassign coordinates to sections
-    print('interpolating and reassigning coordinates...')
-    for k, dciw in enumerate(tqdm(dciws)):
-        # interpolate to change in range of dr_bin
-        dciws_interp.append(dciw.interp({'range':np.arange(0,100,dr_bin)}))
-
-        # make sure range is first dimension
-        dciws_interp[k] = dciws_interp[k].transpose('range', 'depth')
-        # add cosine taper
-        cos_tap = np.expand_dims(np.cos(np.linspace(-np.pi/2, np.pi/2, dciws_interp[k].sizes['range']))**2, 1)
-        if k == 0:
-            cos_tap[:int(dciws_interp[k].sizes['range']/2)] = 1
-        elif k == (len(dciws)-1):
-            cos_tap[int(dciws_interp[k].sizes['range']/2):] = 1
-        dciws_interp[k] = dciws_interp[k] * cos_tap
-        # reassign range relative coordinates
-        dciws_interp[k] = dciws_interp[k].assign_coords({'range':np.arange(0,100,dr_bin) + 50*k})
-
-    # merge sections
-    print('merging sections...')
-    dciws_mixed = dciws_interp[0]
-    for k in tqdm(range(1,len(dciws_interp))):
-        #dciws_mixed = dciws_interp[k] + dciws_mixed
-
-        a,b = xr.align(dciws_mixed, dciws_interp[k], fill_value=0, join='outer')
-        dciws_mixed = a+b
-
-    return dciws_mixed
+    return internal_waves.merge_sections(dciws, verbose=verbose)
 
-def process_file(fn):
-    """Process a single file and save the result"""
+def process_file(fn, tolerance=internal_waves.dciw_tolerance, complevel=4, force=False):
+    """Process a single file and save the result, rounded to tolerance [m/s] and compressed"""
     try:
         file_base = fn[-12:-4]
         print(f'merging dciw realization {file_base}...')
         
         fno = f'{os.environ['data_directory']}iws/realizations/{file_base}.nc'
         
-        # Skip if file exists
-        if os.path.exists(fno):
-            print(f'file already exists for {file_base}, skipping...')
-            return None
+        # Skip if the file was written from the same section file and settings
+        params = {'tolerance':tolerance, 'complevel':complevel, 'precision':precision.get_precision()}
+        if not force:
+            # files merged before the inputs were recorded are recorded with the settings
+            # they were written with, and only kept if these are the current settings
+            if products.adopt(fno, inputs=[fn], params=internal_waves.stored_params):
+                print(f'file exists for {file_base} without a record, recorded with its settings')
+            if products.is_current(fno, inputs=[fn], params=params):
+                print(f'file is up to date for {file_base}, skipping...')
+                return None
             
+        tracer = tracing.Tracer('merge_dciw', realization=file_base)
+        tracer.stage('merge')
         dciw = merge_iw(fn)
-        dciw.to_netcdf(fno)
+        tracer.stage('write')
+        report = internal_waves.write_realization(dciw, fno, tolerance=tolerance, complevel=complevel)
+        print(f'{file_base}: kept {report["keepbits"]} mantissa bits, max error {report["max_error"]:.2e} m/s')
+        products.record(fno, inputs=[fn], params=params)
+        tracer.close()
         return file_base
         
     except Exception as e:
         print(f"Error processing {fn}: {str(e)}")
         return None
 
-def main():
+def main(tolerance, complevel, force=False):
     fs = fsspec.filesystem('')
     fns = fs.glob(f'{os.environ['data_directory']}iws/realizations/sections/*.mat')
     
     # Use number of CPUs for parallel processing
     with Pool(processes=5) as pool:
-        results = list(tqdm(pool.imap(process_file, fns), total=len(fns)))
+        results = list(tqdm(pool.imap(partial(process_file, tolerance=tolerance, complevel=complevel, force=force), fns), total=len(fns)))
     
     # Filter out None results and print summary
     completed = [r for r in results if r is not None]
     print(f"Processed {len(completed)} files successfully")
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='merge iwGM sections into realizations')
+    parser.add_argument('--tolerance', type=float, default=internal_waves.dciw_tolerance, help='largest rounding error of the stored perturbation [m/s], negative for no rounding')
+    parser.add_argument('--complevel', type=int, default=4, help='zlib compression level')
+    parser.add_argument('--force', action='store_true', help='merge every realization again, including existing files and files that are up to date')
+    args = parser.parse_args()
 
     # load .env file
     current_file_path = pathlib.Path(__file__).resolve()
     env_path = f'{current_file_path.parent.parent.parent}/.env'
     load_dotenv(env_path)
 
-    main()
+    main(args.tolerance if args.tolerance >= 0 else None, args.complevel, args.force)
@@ -1,5 +1,12 @@
 """
 Run the RAM model, but save the range dimension of the Green's function
+
+The field returned by RAM is reduced (kb2ooi.reducers) to |p| and
+(|Re p| + |Im p|) / 2 on a decimated display grid, depth averaged TL and the
+field at the receiver before
+anything is written. The full complex field is only written with
+--save_field. This reduces the output size, the peak memory of the run is
+still that of the full range resolved field.
 """
 # create mixed iw perturbation
 import os
@@ -15,6 +22,10 @@ import argparse
 import pathlib
 from dotenv import load_dotenv
 
+# make repository modules importable when run as a script
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent.parent))
+from kb2ooi import pe, precision, reducers, tracing
+
 if __name__ == '__main__':
 
     # Set up argument parser
@@ -22,6 +33,9 @@ if __name__ == '__main__':
     parser.add_argument('node', type=str, help='Node identifier (e.g. AXCC1)')
     parser.add_argument('dciw_filepath', type=str, 
                     help='Path to dciw realization file (e.g. /path/to/dciw_001.nc)')
+    parser.add_argument('--range_step', type=int, default=2, help='decimation of the output range steps for the TL products')
+    parser.add_argument('--depth_step', type=int, default=2, help='decimation of the output depths for the TL products')
+    parser.add_argument('--save_field', action='store_true', help='also save the full complex field (Gfz_real / Gfz_imag)')
 
     args = parser.parse_args()
 
@@ -34,115 +48,63 @@ if __name__ == '__main__':
     node = args.node
     dciw_filepath = args.dciw_filepath
 
-    realization = int(dciw_filepath[-6:-3])
+    realization = pe.realization_index(dciw_filepath)
 
-    fnr = f'{os.environ['data_directory']}tl_iws/{node}_{realization:02}_Gfz_real.nc'
-    fni = f'{os.environ['data_directory']}tl_iws/{node}_{realization:02}_Gfz_imag.nc'
+    out_dir = f'{os.environ['data_directory']}tl_iws/'
+    fn_amp = f'{out_dir}{node}_{realization:02}_amplitude.nc'
+    fn_part = f'{out_dir}{node}_{realization:02}_part_magnitude.nc'
+    fn_depth = f'{out_dir}{node}_{realization:02}_tl_depth_averaged.nc'
+    fn_rec = f'{out_dir}{node}_{realization:02}_receivers.nc'
+    fnr = f'{out_dir}{node}_{realization:02}_Gfz_real.nc'
+    fni = f'{out_dir}{node}_{realization:02}_Gfz_imag.nc'
 
     # check if simulation has already been run:
-    if os.path.exists(fnr) and os.path.exists(fni):
+    products = [fn_amp, fn_part, fn_depth, fn_rec] + ([fnr, fni] if args.save_field else [])
+    if all(os.path.exists(fn) for fn in products):
         print(f'simulation file already exists for {node}, skipping...')
         sys.exit()
 
+    tracer = tracing.Tracer('TL_iw_range', node=node, realization=realization)
+    tracer.stage('environment fetch')
     print('loading environment')
-    ssp = envy.get_ssp_slice(
-        coords['KB'],
-        coords[node],
-        num_range_points=3000,
-        fillna=True,
-        climate=True,
-    ).load()
-
-    bathy = envy.get_bathymetry_slice(
-        coords['KB'],
-        coords[node],
-        num_range_points=3000,
-    ).load()
+    ssp, bathy = pe.load_path(node, num_range_points=3000, climate=True)
 
     # load iw perturbations
-    dciw = xr.open_dataarray(dciw_filepath)
+    dciw = pe.load_dciw(dciw_filepath)
 
     # combine climate and iw perturbations
-    ssp_dciw = ssp.interp({'range':dciw.range}) + dciw.interp({'depth':ssp.depth}, kwargs={'bounds_error':False, 'fill_value':'extrapolate'})
+    tracer.stage('interpolation')
+    ssp_dciw = pe.add_perturbation(ssp, dciw)
 
     # flat earth transform sound speed and bathymetry
-    print('computing flat earth transform...')
-    ssp_dciw_f = envy.flat_earth_c(ssp_dciw, verbose=True)
-    ssp_f = envy.flat_earth_c(ssp, verbose=True)
-    bathy_f = envy.flat_earth_bathy(bathy)
-
-    # Bottom properties
-    cb = xr.DataArray(
-        np.ones((1,ssp_dciw_f.sizes['range'])),
-        dims=['depth','range'],
-        coords={
-            'range':ssp_dciw_f.range,
-            'depth':np.array([6000])}
-    )
-
-    rhob = xr.DataArray(
-        np.ones((1,ssp_dciw_f.sizes['range'])),
-        dims=['depth','range'],
-        coords={
-            'range':ssp_dciw_f.range,
-            'depth':np.array([6000])}
-    )
-
-    attn = xr.DataArray(
-        np.ones((1,ssp_dciw_f.sizes['range'])),
-        dims=['depth','range'],
-        coords = {
-            'depth':np.array([6000]),
-            'range':ssp_dciw_f.range
-        }
-    )
-
-    cb.loc[:,:30] = bighorn.bottom_props['med_silt']['soundSpeed']
-    cb.loc[:,30:] = bighorn.bottom_props['clay']['soundSpeed']
-    if node in ['AXBA1', 'AXCC1', 'AXEC2', 'PC03A']:
-        cb.loc[:,3555:] = bighorn.bottom_props['rock']['soundSpeed']
-
-    rhob.loc[:,:30] = bighorn.bottom_props['med_silt']['density']
-    rhob.loc[:,30:] = bighorn.bottom_props['clay']['density']
-    if node in ['AXBA1', 'AXCC1', 'AXEC2', 'PC03A']:
-        rhob.loc[:,3555:] = bighorn.bottom_props['rock']['density']
-
-    attn.loc[:,:30] = bighorn.bottom_props['med_silt']['soundAttenuation']
-    attn.loc[:,30:] = bighorn.bottom_props['clay']['soundAttenuation']
-    if node in ['AXBA1', 'AXCC1', 'AXEC2', 'PC03A']:
-        attn.loc[:,3555:] = bighorn.bottom_props['rock']['soundAttenuation']
-                
-    input_params = {
-        'title':node,
-        'freq':75,
-        'zs':depths['KB']+10,
-        'zr':0,
-        'rmax':bathy_f.range[-1]*1000,
-        'dr':10,
-        'ndr':100,
-        'zmax':6200,
-        'dz':2,
-        'ndz':5,
-        'zmplt':6200,
-        'c0':1500,
-        'np':8,
-        'ns':1,
-        'rs':10000,
-        'bathymetry':bathy_f,
-        'soundspeed':ssp_dciw_f,
-        'cb':cb,
-        'rhob':rhob,
-        'attn':attn,
+    tracer.stage('flat earth')
+    env_dciw = pe.build_environment(node, ssp_dciw, bathy, ndr=100)
+
+    # products computed from the field returned by RAM, which is held in full while they run,
+    # so this only reduces what is written (the full field only with --save_field), not peak memory
+    reducers_ = {
+        'amplitude':reducers.Amplitude(range_step=args.range_step, depth_step=args.depth_step),
+        'part_magnitude':reducers.PartMagnitude(range_step=args.range_step, depth_step=args.depth_step),
+        'depth_averaged':reducers.DepthAveragedTL(),
+        'receivers':reducers.Receivers({node:(float(bathy.range[-1]), depths[node])}),
     }
+    if args.save_field:
+        reducers_['field'] = reducers.Field()
 
-    env_dciw = envy.EnvironmentRAM(**input_params)
-
+    tracer.stage('ram')
     print('running ram...')
     # run RAM
-    gf_iw = bighorn.run_ram(env_dciw, Fs=300, T0 = 10, bw = (75,75), zdec=1, rdec = 1)
+    products = reducers.run_reduced(env_dciw, reducers_, Fs=300, T0=10, bw=(75,75), zdec=1, rdec=1)
 
     # save output
-    gf_iw.real.to_netcdf(fnr)
-    gf_iw.imag.to_netcdf(fni)
-
-    print(f'{node} complete.')
\ No newline at end of file
+    tracer.stage('write')
+    products['amplitude'].to_netcdf(fn_amp)
+    products['part_magnitude'].to_netcdf(fn_part)
+    products['depth_averaged'].to_netcdf(fn_depth)
+    receivers_ = precision.as_complex(products['receivers'])
+    xr.Dataset({'real':receivers_.real, 'imag':receivers_.imag}).to_netcdf(fn_rec)
+    if args.save_field:
+        pe.write_gf(products['field'], fnr, fni)
+    tracer.close()
+
+    print(f'{node} complete.')
@@ -8,10 +8,21 @@ import time
 from typing import List, Dict
 from textwrap import dedent
 import os
+import sys
 import pathlib
 from dotenv import load_dotenv
+import geopy.distance as geo
+from kaooi.coordinates import coords
 
+# make repository modules importable when run as a script
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent.parent))
+from kb2ooi import resources
 
+# maximum number of queued jobs per partition
+max_jobs = {
+    'cpu-g2': 8,
+    'ckpt-g2': 5,
+}
 
 def get_slurm_jobs() -> Dict[str, int]:
     """Get count of running/pending jobs per partition with specific names"""
@@ -39,7 +50,28 @@ def get_slurm_jobs() -> Dict[str, int]:
         
     return jobs
 
-def submit_job(py_input: str, partition: str) -> bool:
+def get_allocation(py_input: str, coefs: tuple = None) -> Dict:
+    """
+    Predict the SLURM allocation for a single PE task
+
+    Parameters
+    ----------
+    py_input : str
+        '<node> <dciw_filepath>' arguments of run_PE_monte_carlo.py
+    coefs : tuple
+        cost model coefficients, see resources.fit_coefficients
+
+    Returns
+    -------
+    dict
+        allocation returned by resources.choose_allocation
+    """
+    node = py_input.split(' ')[0]
+    path_length = geo.great_circle(coords['KB'], coords[node]).km
+    features = resources.task_features(path_length, **resources.mc_params)
+    return resources.choose_allocation(features, coefs=coefs)
+
+def submit_job(py_input: str, allocation: Dict) -> bool:
     """
     Submit a single SLURM job
     
@@ -50,6 +82,8 @@ def submit_job(py_input: str, partition: str) -> bool:
     """
 
     try:
+        partition = allocation['partition']
+
         # Validate inputs
         if not py_input or not partition:
             raise ValueError("py_input and partition must not be empty")
@@ -57,34 +91,22 @@ def submit_job(py_input: str, partition: str) -> bool:
         if partition not in ['cpu-g2', 'ckpt-g2']:
             raise ValueError(f"Invalid partition: {partition}")
         log_str = py_input.replace(' ', '').replace(os.environ['data_directory'],'').replace('/','')
-        if partition == 'cpu-g2':
-            slurm_script = dedent(f"""
-                #!/bin/bash
-                #SBATCH --account=coenv
-                #SBATCH --cpus-per-task=20 #number of CPUs
-                #SBATCH --mem=80GB #RAM
-                #SBATCH --partition={partition}
-                #SBATCH --time=36:00:00 #time limit 1 hour
-                #SBATCH -J PE
-                #SBATCH --output=logs/mc/pe_mc_{log_str}.out
-                #SBATCH --error=logs/mc/pe_mc_{log_str}.err
-
-                python simulation/monte_carlo_iws/run_PE_monte_carlo.py {py_input}
-            """).strip()
-        elif partition == 'ckpt-g2':
-            slurm_script = dedent(f"""
-                #!/bin/bash
-                #SBATCH --account=coenv
-                #SBATCH --cpus-per-task=20 #number of CPUs
-                #SBATCH --mem=80GB #RAM
-                #SBATCH --partition={partition}
-                #SBATCH --time=3:00:00 #time limit 8 hours
-                #SBATCH -J PEckpt
-                #SBATCH --output=logs/mc/pe_mc_{log_str}.out
-                #SBATCH --error=logs/mc/pe_mc_{log_str}.err
-
-                python simulation/monte_carlo_iws/run_PE_monte_carlo.py {py_input}
-            """).strip()
+
+        # job names are used by get_slurm_jobs to count jobs per partition
+        job_name = 'PE' if partition == 'cpu-g2' else 'PEckpt'
+        slurm_script = dedent(f"""
+            #!/bin/bash
+            #SBATCH --account=coenv
+            #SBATCH --cpus-per-task={allocation['n_cpus']} #number of CPUs
+            #SBATCH --mem={allocation['mem']}GB #RAM
+            #SBATCH --partition={partition}
+            #SBATCH --time={resources.format_time(allocation['time'])} #predicted {allocation['predicted_time']/3600:.1f} hours
+            #SBATCH -J {job_name}
+            #SBATCH --output=logs/mc/pe_mc_{log_str}.out
+            #SBATCH --error=logs/mc/pe_mc_{log_str}.err
+
+            python simulation/monte_carlo_iws/run_PE_monte_carlo.py {py_input}
+        """).strip()
         
         # Write temporary script file
         script_file = f"tmp_submit_{time.time()}.sh"
@@ -106,33 +128,26 @@ def submit_job(py_input: str, partition: str) -> bool:
 def main(py_inputs: List[str]):
     # Create logs directory
     subprocess.run("mkdir -p logs", shell=True)
+
+    # predict allocation for every task, short tasks are routed to ckpt-g2
+    coefs = resources.fit_coefficients(resources.load_history())
+    allocations = {py_input: get_allocation(py_input, coefs) for py_input in py_inputs}
     
     # Track which inputs have been submitted
     submitted = set()
     
     while len(submitted) < len(py_inputs):
         current_jobs = get_slurm_jobs()
-        
-        # Check cpu-g2 partition (maintain 1 job)
-        if current_jobs['cpu-g2'] < 8:
-            for input_str in py_inputs:
-                if input_str not in submitted:
-                    submit_job(input_str, 'cpu-g2')
-                    submitted.add(input_str)
-                    break
-        
-        # Check ckpt-g2 partition (maintain 5 jobs)
-        while current_jobs['ckpt-g2'] < 0:
-            submitted_new = False
-            for input_str in py_inputs:
-                if input_str not in submitted:
-                    submit_job(input_str, 'ckpt-g2')
-                    submitted.add(input_str)
-                    current_jobs['ckpt-g2'] += 1
-                    submitted_new = True
-                    break
-            if not submitted_new:
-                break
+
+        for input_str in py_inputs:
+            if input_str in submitted:
+                continue
+
+            partition = allocations[input_str]['partition']
+            if current_jobs[partition] < max_jobs[partition]:
+                if submit_job(input_str, allocations[input_str]):
+                    current_jobs[partition] += 1
+                submitted.add(input_str)
                 
         time.sleep(30)  # Wait before next check
 
@@ -0,0 +1,246 @@
+"""
+pe_worker.py - long lived PE worker that works through a queue of (node, realization) tasks
+
+Instead of starting a cold python process for every PE task, one worker is
+started per SLURM allocation. It keeps the heavy imports loaded and holds
+per-node environment slices and recent realizations in an LRU cache, so an
+allocation can work through many tasks without restart cost. Results are
+written with the same run_task used by run_PE_monte_carlo.py.
+
+usage:
+    # fill the queue with every node / realization that has not been run
+    python simulation/monte_carlo_iws/pe_worker.py enqueue
+
+    # work through the queue (see pe_worker.job)
+    python simulation/monte_carlo_iws/pe_worker.py run --max_hours 36
+
+    # generate realizations 1-50 in memory instead of reading iws/realizations/
+    python simulation/monte_carlo_iws/pe_worker.py enqueue --generate 50
+    python simulation/monte_carlo_iws/pe_worker.py run --max_hours 36 --cache_realizations
+
+    # run RAM once for hydrophones on (nearly) the same bearing from KB
+    python simulation/monte_carlo_iws/pe_worker.py enqueue --share_paths 0.1
+
+    # time coherence experiment, 43 time steps of one realization generated in memory
+    python simulation/monte_carlo_iws/pe_worker.py enqueue --queue tc --nodes LJ01C --time_steps 43
+
+    # the same, with the time steps evolved by a phase advance (checked at the last step)
+    python simulation/monte_carlo_iws/pe_worker.py enqueue --queue tc --nodes LJ01C --time_steps 43 --phase_advance
+    python simulation/monte_carlo_iws/pe_worker.py run --queue tc
+"""
+import os
+import sys
+import time
+import argparse
+import pathlib
+import functools
+import traceback
+import json
+import fsspec
+from geopy.distance import geodesic
+from kaooi.coordinates import coords
+from dotenv import load_dotenv
+
+# make repository modules importable when run as a script
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent.parent))
+from kb2ooi import internal_waves, paths, pe, resources, time_coherence
+from kb2ooi.task_queue import TaskQueue, default_queue_dir
+from run_PE_monte_carlo import run_task
+
+nodes = ['AXCC1','AXEC2','AXBA1','HYS14','LJ01C','PC01A','PC03A', 'LJ01A', 'LJ01D']
+
+
+def enqueue(queue : TaskQueue, nodes : list, generate : int = None, share_paths : float = None, time_steps : int = None, phase_advance : bool = False):
+    '''
+    enqueue - add every (node, realization) without output to the queue
+
+    tasks are ordered by realization, so that workers working through the
+    queue reuse the cached realization for consecutive nodes
+
+    Parameters
+    ----------
+    queue : TaskQueue
+    nodes : list
+        nodes to run
+    generate : int
+        if given, realizations 1 to generate are generated in memory by the
+        worker instead of being read from iws/realizations/
+    share_paths : float
+        if given, nodes with bearings from KB within share_paths degrees are
+        run as a single task to the farthest node of the group, if they passed
+        validate_shared_path.py against their own run. The geometric error of
+        every node is written to mc_iws/shared_paths.json
+    time_steps : int
+        if given, time steps 0 to time_steps-1 of the time coherence
+        experiment are enqueued instead of realizations. The perturbation of
+        each step is generated in memory with iwGMtfast
+        (internal_waves.generate_time_step) and the output is written to
+        time_coherence_iws/
+    phase_advance : bool
+        evolve the time steps from the spectral amplitudes of a single
+        realization instead (internal_waves.IWTimeSeries). The phase advance
+        is checked against iwGMtfast at the last time step, and the worker
+        falls back to iwGMtfast per step if the check fails
+    '''
+    out_dir = f'{os.environ["data_directory"]}mc_iws/'
+    if time_steps is not None:
+        out_dir = f'{os.environ["data_directory"]}time_coherence_iws/'
+    if share_paths is None:
+        groups = [{'reference':node, 'nodes':[node]} for node in nodes]
+    else:
+        # only nodes whose shifted Green's function passed validate_shared_path.py share a run
+        groups, rejected = pe.validated_groups(paths.group_paths(nodes, tolerance=share_paths))
+        for node in rejected:
+            print(f'{node} has no passing shared path validation, running it on its own path')
+        os.makedirs(out_dir, exist_ok=True)
+        with open(f'{out_dir}shared_paths.json', 'w') as f:
+            json.dump({'tolerance':share_paths, 'groups':groups}, f, indent=2)
+        for group in groups:
+            for node, (along_track, cross_track) in group['offsets'].items():
+                print(f'{node}: {along_track:.1f} km along {group["reference"]} path, {cross_track:.2f} km cross track')
+
+    if time_steps is not None:
+        tasks = [(step, None) for step in range(time_steps)]
+    elif generate is None:
+        fs = fsspec.filesystem('')
+        fns = sorted(fs.glob(f'{os.environ["data_directory"]}iws/realizations/*.nc'))
+        tasks = [(pe.realization_index(fn), fn) for fn in fns]
+    else:
+        tasks = [(realization, None) for realization in range(1, generate+1)]
+
+    n = 0
+    for realization, fn in tasks:
+        for group in groups:
+            node = group['reference']
+            if all(pe.output_exists(*pe.output_paths(out_dir, member, realization)) for member in group['nodes']):
+                continue
+            task = {'node':node, 'dciw_filepath':fn, 'realization':realization}
+            if time_steps is not None:
+                task['time_step'] = realization
+                if phase_advance:
+                    task['check_time'] = (time_steps - 1)*time_coherence.time_step
+            if len(group['nodes']) > 1:
+                task['group'] = group
+            if queue.put(f'{realization:03}_{node}', task):
+                n += 1
+    print(f'added {n} tasks to {queue.queue_dir}')
+
+
+def work(queue : TaskQueue, max_hours : float, cache_size : int, cache_realizations : bool = False, margin : float = 1.2):
+    '''
+    work - claim and run tasks until the queue is empty or the allocation runs out
+
+    Parameters
+    ----------
+    queue : TaskQueue
+    max_hours : float
+        wall time of the allocation, tasks that are not predicted to finish in
+        the remaining time are left in the queue
+    cache_size : int
+        number of node environment slices to keep in memory
+    cache_realizations : bool
+        whether generated realizations are written to iws/generated/ for reuse
+        by other workers
+    margin : float
+        safety factor on predicted task wall time
+    '''
+    start_time = time.time()
+    n_cpus = int(os.environ.get('SLURM_CPUS_PER_TASK', os.cpu_count()))
+    coefs = resources.fit_coefficients(resources.load_history())
+
+    @functools.lru_cache(maxsize=cache_size)
+    def get_path(node):
+        return pe.load_path(node, num_range_points=3000, climate=True)
+
+    @functools.lru_cache(maxsize=1)
+    def get_ocean_sections():
+        return internal_waves.load_ocean_sections()
+
+    @functools.lru_cache(maxsize=2)
+    def get_dciw(dciw_filepath, realization):
+        if dciw_filepath is not None:
+            return pe.load_dciw(dciw_filepath)
+        cache_dir = f'{os.environ["data_directory"]}iws/generated/' if cache_realizations else None
+        return internal_waves.generate_realization(realization, cache_dir=cache_dir, tsc=get_ocean_sections())
+
+    @functools.lru_cache(maxsize=1)
+    def get_time_series(check_time):
+        # spectral amplitudes of the time coherence realization, same seed as KB2OOI_time_func.m
+        try:
+            series = internal_waves.IWTimeSeries(seed=0, t_check=check_time, tsc=get_ocean_sections())
+        except ValueError as e:
+            print(f'phase advance rejected ({e}), using iwGMtfast for every time step')
+            return None
+        print(f'phase advance differs from iwGMtfast at {check_time:.2f} s by at most {series.check_error:.3f} (relative rms)')
+        return series
+
+    def get_time_step(task):
+        t = task['time_step']*time_coherence.time_step
+        series = get_time_series(task['check_time']) if 'check_time' in task else None
+        if series is None:
+            return internal_waves.generate_time_step(t, seed=0, tsc=get_ocean_sections(), verbose=False)
+        return series.at(t)
+
+    n_done = 0
+    while True:
+        task_id, task = queue.claim()
+        if task_id is None:
+            print('queue is empty.')
+            break
+
+        node = task['node']
+        features = resources.task_features(geodesic(coords['KB'], coords[node]).km, **resources.mc_params)
+        predicted_time, _ = resources.predict(features, n_cpus, coefs)
+        remaining = max_hours*3600 - (time.time() - start_time)
+        if predicted_time*margin > remaining:
+            print(f'{remaining/3600:.1f} hours left, not enough time for {task_id}, stopping.')
+            queue.release(task_id)
+            break
+
+        print(f'running task {task_id}...')
+        try:
+            out_dir = None
+            if 'time_step' in task:
+                dciw = get_time_step(task)
+                out_dir = f'{os.environ["data_directory"]}time_coherence_iws/'
+            else:
+                dciw = get_dciw(task['dciw_filepath'], task['realization'])
+            run_task(node, task['dciw_filepath'], path=get_path(node), dciw=dciw, realization=task['realization'], group=task.get('group'), out_dir=out_dir)
+            queue.finish(task_id)
+            n_done += 1
+        except Exception as e:
+            traceback.print_exc()
+            queue.finish(task_id, failed=True, error=str(e))
+
+    print(f'worker finished {n_done} tasks in {(time.time() - start_time)/3600:.2f} hours')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='warm PE worker for Monte Carlo tasks')
+    parser.add_argument('command', choices=['enqueue', 'run', 'requeue'], help='fill the queue, work through it, or requeue stale tasks')
+    parser.add_argument('--queue', type=str, default='mc', help='name of the queue')
+    parser.add_argument('--nodes', type=str, nargs='*', default=nodes, help='nodes to enqueue')
+    parser.add_argument('--max_hours', type=float, default=36, help='wall time of the allocation [hours]')
+    parser.add_argument('--cache_size', type=int, default=len(nodes), help='number of node environments kept in memory')
+    parser.add_argument('--generate', type=int, default=None, help='enqueue realizations 1..N that are generated in memory')
+    parser.add_argument('--cache_realizations', action='store_true', help='write generated realizations to iws/generated/ for reuse')
+    parser.add_argument('--share_paths', type=float, default=None, help='run nodes with bearings within this tolerance [degrees] as one task')
+    parser.add_argument('--time_steps', type=int, default=None, help='enqueue time steps 0..N-1 of the time coherence experiment, generated in memory')
+    parser.add_argument('--phase_advance', action='store_true', help='evolve the time steps by a phase advance of one realization instead of iwGMtfast per step')
+    args = parser.parse_args()
+
+    # load .env file
+    current_file_path = pathlib.Path(__file__).resolve()
+    env_path = f'{current_file_path.parent.parent.parent}/.env'
+    load_dotenv(env_path)
+
+    queue = TaskQueue(default_queue_dir(args.queue))
+
+    if args.command == 'enqueue':
+        enqueue(queue, args.nodes, args.generate, args.share_paths, args.time_steps, args.phase_advance)
+    elif args.command == 'requeue':
+        # tasks of preempted workers (older than the cpu-g2 time limit)
+        n = queue.requeue_stale(max_age=36*3600)
+        print(f'requeued {n} stale tasks')
+    else:
+        work(queue, args.max_hours, args.cache_size, args.cache_realizations)
@@ -10,136 +10,122 @@ from geopy.distance import geodesic
 import sys
 import argparse
 import pathlib
+import time
 from dotenv import load_dotenv
 
-if __name__ == '__main__':
-
-    # Set up argument parser
-    parser = argparse.ArgumentParser(description='Monte Carlo simulation script')
-    parser.add_argument('node', type=str, help='Node identifier (e.g. AXCC1)')
-    parser.add_argument('dciw_filepath', type=str, 
-                    help='Path to dciw realization file (e.g. /path/to/dciw_001.nc)')
-
-    args = parser.parse_args()
-
-    # load .env file
-    current_file_path = pathlib.Path(__file__).resolve()
-    env_path = f'{current_file_path.parent.parent.parent}/.env'
-    load_dotenv(env_path)
-
-    # Replace hardcoded values with command line arguments
-    node = args.node
-    dciw_filepath = args.dciw_filepath
-
-    realization = int(dciw_filepath[-6:-3])
-
-    fnr = f'{os.environ['data_directory']}mc_iws/{node}_{realization:02}_Gfz_real.nc'
-    fni = f'{os.environ['data_directory']}mc_iws/{node}_{realization:02}_Gfz_imag.nc'
+# make repository modules importable when run as a script
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent.parent))
+from kb2ooi import internal_waves, pe, resources, tracing
+
+
+def run_task(node : str, dciw_filepath : str = None, path : tuple = None, dciw : xr.DataArray = None, realization : int = None, group : dict = None, out_dir : str = None):
+    '''
+    run_task - run PE for a single node and internal wave realization
+
+    Parameters
+    ----------
+    node : str
+        node identifier (e.g. AXCC1)
+    dciw_filepath : str
+        path to dciw realization file (e.g. /path/to/dciw_001.nc)
+    path : tuple
+        (ssp, bathy) already loaded for this node, loaded with pe.load_path if None
+    dciw : xr.DataArray
+        already loaded realization, opened from dciw_filepath if None
+    realization : int
+        realization index, taken from dciw_filepath if None. If neither
+        dciw_filepath or dciw are given, the realization is generated in memory
+    group : dict
+        shared path group from kb2ooi.paths.group_paths with node as reference.
+        RAM is run once to node and the Green's function of every node in the
+        group is written
+    out_dir : str
+        output directory, <data_directory>mc_iws/ if None
+
+    Returns
+    -------
+    bool
+        True if the simulation was run, False if the output already exists
+    '''
+    start_time = time.time()
+    path_given, dciw_given = path is not None, dciw is not None
+    if realization is None:
+        realization = pe.realization_index(dciw_filepath)
+    if out_dir is None:
+        out_dir = f'{os.environ['data_directory']}mc_iws/'
+    nodes = [node] if group is None else group['nodes']
 
     # check if simulation has already been run:
-    if os.path.exists(fnr) and os.path.exists(fni):
-        print(f'simulation file already exists for {node}, skipping...')
-        sys.exit()
+    if all(pe.output_exists(*pe.output_paths(out_dir, member, realization)) for member in nodes):
+        print(f'simulation file already exists for {nodes}, skipping...')
+        return False
 
+    tracer = tracing.Tracer('run_PE_monte_carlo', node=node, realization=realization, nodes=','.join(nodes))
+    tracer.stage('environment fetch')
     print('loading environment')
-    ssp = envy.get_ssp_slice(
-        coords['KB'],
-        coords[node],
-        num_range_points=3000,
-        fillna=True,
-        climate=True,
-    ).load()
-
-    bathy = envy.get_bathymetry_slice(
-        coords['KB'],
-        coords[node],
-        num_range_points=3000,
-    ).load()
+    if path is None:
+        path = pe.load_path(node, num_range_points=3000, climate=True)
+    ssp, bathy = path
 
     # load iw perturbations
-    dciw = xr.open_dataarray(dciw_filepath)
+    if (dciw is None) and (dciw_filepath is not None):
+        dciw = pe.load_dciw(dciw_filepath)
+    elif dciw is None:
+        tracer.stage('iw generation')
+        dciw = internal_waves.generate_realization(realization)
 
     # combine climate and iw perturbations
-    ssp_dciw = ssp.interp({'range':dciw.range}) + dciw.interp({'depth':ssp.depth}, kwargs={'bounds_error':False, 'fill_value':'extrapolate'})
+    tracer.stage('interpolation')
+    ssp_dciw = pe.add_perturbation(ssp, dciw)
 
     # flat earth transform sound speed and bathymetry
-    print('computing flat earth transform...')
-    ssp_dciw_f = envy.flat_earth_c(ssp_dciw, verbose=True)
-    ssp_f = envy.flat_earth_c(ssp, verbose=True)
-    bathy_f = envy.flat_earth_bathy(bathy)
-
-    # Bottom properties
-    cb = xr.DataArray(
-        np.ones((1,ssp_dciw_f.sizes['range'])),
-        dims=['depth','range'],
-        coords={
-            'range':ssp_dciw_f.range,
-            'depth':np.array([6000])}
-    )
-
-    rhob = xr.DataArray(
-        np.ones((1,ssp_dciw_f.sizes['range'])),
-        dims=['depth','range'],
-        coords={
-            'range':ssp_dciw_f.range,
-            'depth':np.array([6000])}
-    )
-
-    attn = xr.DataArray(
-        np.ones((1,ssp_dciw_f.sizes['range'])),
-        dims=['depth','range'],
-        coords = {
-            'depth':np.array([6000]),
-            'range':ssp_dciw_f.range
-        }
-    )
-
-    cb.loc[:,:30] = bighorn.bottom_props['med_silt']['soundSpeed']
-    cb.loc[:,30:] = bighorn.bottom_props['clay']['soundSpeed']
-    if node in ['AXBA1', 'AXCC1', 'AXEC2', 'PC03A']:
-        cb.loc[:,3555:] = bighorn.bottom_props['rock']['soundSpeed']
-
-    rhob.loc[:,:30] = bighorn.bottom_props['med_silt']['density']
-    rhob.loc[:,30:] = bighorn.bottom_props['clay']['density']
-    if node in ['AXBA1', 'AXCC1', 'AXEC2', 'PC03A']:
-        rhob.loc[:,3555:] = bighorn.bottom_props['rock']['density']
-
-    attn.loc[:,:30] = bighorn.bottom_props['med_silt']['soundAttenuation']
-    attn.loc[:,30:] = bighorn.bottom_props['clay']['soundAttenuation']
-    if node in ['AXBA1', 'AXCC1', 'AXEC2', 'PC03A']:
-        attn.loc[:,3555:] = bighorn.bottom_props['rock']['soundAttenuation']
-                
-    input_params = {
-        'title':node,
-        'freq':75,
-        'zs':depths['KB']+10,
-        'zr':0,
-        'rmax':bathy_f.range[-1]*1000,
-        'dr':10,
-        'ndr':14,
-        'zmax':6200,
-        'dz':2,
-        'ndz':5,
-        'zmplt':6200,
-        'c0':1500,
-        'np':8,
-        'ns':1,
-        'rs':10000,
-        'bathymetry':bathy_f,
-        'soundspeed':ssp_dciw_f,
-        'cb':cb,
-        'rhob':rhob,
-        'attn':attn,
-    }
-
-    env_dciw = envy.EnvironmentRAM(**input_params)
+    tracer.stage('flat earth')
+    env_dciw = pe.build_environment(node, ssp_dciw, bathy)
 
+    tracer.stage('ram')
     print('running ram...')
     # run RAM
-    gf_iw = bighorn.run_ram(env_dciw, Fs=300, T0 = 10, bw = (37.5, 112.5), zdec=1, rdec = -1)
+    gf_iw = bighorn.run_ram(env_dciw, **pe.run_args)
 
     # save output
-    gf_iw.real.to_netcdf(fnr)
-    gf_iw.imag.to_netcdf(fni)
+    tracer.stage('write')
+    if group is None:
+        pe.write_gf(gf_iw, *pe.output_paths(out_dir, node, realization))
+    else:
+        gfs, _ = pe.extract_receivers(gf_iw, group['offsets'], node)
+        for member, gf in gfs.items():
+            pe.write_gf(gf, *pe.output_paths(out_dir, member, realization))
+
+    # record wall time and memory for the task manager resource model
+    features = resources.task_features(geodesic(coords['KB'], coords[node]).km, **resources.mc_params)
+    n_cpus = int(os.environ.get('SLURM_CPUS_PER_TASK', os.cpu_count()))
+    # tasks from pe_worker.py get their path and realization from the worker caches
+    warm = (path_given or dciw_given)
+    resources.record_job(features, n_cpus, time.time() - start_time, warm=warm, node=node, realization=realization)
+    tracer.close()
+
+    print(f'{node} complete.')
+    return True
+
+
+if __name__ == '__main__':
+
+    # Set up argument parser
+    parser = argparse.ArgumentParser(description='Monte Carlo simulation script')
+    parser.add_argument('node', type=str, help='Node identifier (e.g. AXCC1)')
+    parser.add_argument('dciw_filepath', type=str,
+                    help='Path to dciw realization file (e.g. /path/to/dciw_001.nc), or the realization index with --generate')
+    parser.add_argument('--generate', action='store_true',
+                    help='generate the realization in memory from its index instead of reading it from disk')
+
+    args = parser.parse_args()
+
+    # load .env file
+    current_file_path = pathlib.Path(__file__).resolve()
+    env_path = f'{current_file_path.parent.parent.parent}/.env'
+    load_dotenv(env_path)
 
-    print(f'{node} complete.')
\ No newline at end of file
+    if args.generate:
+        run_task(args.node, realization=int(args.dciw_filepath))
+    else:
+        run_task(args.node, args.dciw_filepath)
@@ -12,6 +12,10 @@ import argparse
 import pathlib
 from dotenv import load_dotenv
 
+# make repository modules importable when run as a script
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent.parent))
+from kb2ooi import pe, tracing
+
 if __name__ == '__main__':
 
     # Set up argument parser
@@ -41,6 +45,8 @@ if __name__ == '__main__':
         print(f'simulation file already exists for {node}, skipping...')
         sys.exit()
 
+    tracer = tracing.Tracer('run_PE_time_coherence', node=node, realization=realization)
+    tracer.stage('environment fetch')
     print('loading environment')
     ssp = envy.get_ssp_slice(
         coords['KB'],
@@ -60,9 +66,11 @@ if __name__ == '__main__':
     dciw = xr.open_dataarray(dciw_filepath)
 
     # combine climate and iw perturbations
+    tracer.stage('interpolation')
     ssp_dciw = ssp.interp({'range':dciw.range}) + dciw.interp({'depth':ssp.depth}, kwargs={'bounds_error':False, 'fill_value':'extrapolate'})
 
     # flat earth transform sound speed and bathymetry
+    tracer.stage('flat earth')
     print('computing flat earth transform...')
     ssp_dciw_f = envy.flat_earth_c(ssp_dciw, verbose=True)
     ssp_f = envy.flat_earth_c(ssp, verbose=True)
@@ -134,12 +142,15 @@ if __name__ == '__main__':
 
     env_dciw = envy.EnvironmentRAM(**input_params)
 
+    tracer.stage('ram')
     print('running ram...')
     # run RAM
     gf_iw = bighorn.run_ram(env_dciw, Fs=300, T0 = 10, bw = (37.5, 112.5), zdec=1, rdec = -1)
 
     # save output
-    gf_iw.real.to_netcdf(fnr)
-    gf_iw.imag.to_netcdf(fni)
+    tracer.stage('write')
+    # atomic, analysis/time_coherence.py reads time steps while later ones are running
+    pe.write_gf(gf_iw, fnr, fni)
+    tracer.close()
 
     print(f'{node} complete.')
\ No newline at end of file
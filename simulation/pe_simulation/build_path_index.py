@@ -0,0 +1,82 @@
+# build the path index (great circle points and grid stencils) for every node
+import os
+import sys
+import json
+import time
+import pathlib
+import argparse
+import envy
+from kaooi.coordinates import coords
+from dotenv import load_dotenv
+
+# make repository modules importable when run as a script
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent.parent))
+from kb2ooi import path_index, tracing
+
+nodes = ['AXCC1', 'AXEC2', 'AXBA1', 'HYS14', 'LJ01C', 'PC01A', 'PC03A', 'LJ01A', 'LJ01D']
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Precompute great circle points and grid stencils of the paths from KB')
+    parser.add_argument('--nodes', type=str, nargs='*', default=nodes, help='nodes to index')
+    parser.add_argument('--num_range_points', type=int, nargs='*', default=[5000, 3000], help='resolutions to index, the largest is built and the others are derived from it')
+    parser.add_argument('--compare', action='store_true', help='compare the gathered slices of every resolution with envy, pe.load_path only uses the index for paths that pass')
+    args = parser.parse_args()
+
+    # load .env file
+    current_file_path = pathlib.Path(__file__).resolve()
+    env_path = f'{current_file_path.parent.parent.parent}/.env'
+    load_dotenv(env_path)
+
+    grids = {name: path_index.open_grid(name) for name in path_index.grid_paths}
+    resolutions = sorted(args.num_range_points, reverse=True)
+
+    # earlier comparisons of other paths are kept
+    out_fn = path_index.report_path()
+    report = {}
+    if os.path.exists(out_fn):
+        with open(out_fn) as f:
+            report = json.load(f)
+
+    for node in args.nodes:
+        tracer = tracing.Tracer('build_path_index', node=node)
+        entry = report.setdefault(f'KB_{node}', {})
+        for num_range_points in resolutions:
+            tracer.stage(f'index {num_range_points}')
+            start = time.perf_counter()
+            index = path_index.get_index('KB', node, num_range_points, grids=grids)
+            # a rebuilt or derived index has to be compared again
+            entry[str(num_range_points)] = {'index_time':time.perf_counter() - start, 'passed':False}
+
+        if args.compare:
+            for num_range_points in resolutions:
+                tracer.stage(f'compare {num_range_points}')
+                result = entry[str(num_range_points)]
+                ok = True
+                for climate in [True, False]:
+                    start = time.perf_counter()
+                    ssp, bathy = path_index.load_path(node, num_range_points=num_range_points, climate=climate)
+                    gather_time = time.perf_counter() - start
+                    start = time.perf_counter()
+                    ssp_envy = envy.get_ssp_slice(coords['KB'], coords[node], num_range_points=num_range_points, fillna=True, climate=climate).load()
+                    bathy_envy = envy.get_bathymetry_slice(coords['KB'], coords[node], num_range_points=num_range_points).load()
+                    envy_time = time.perf_counter() - start
+                    ssp_diff = path_index.compare_slices(ssp, ssp_envy.interp({'depth':ssp.depth}))
+                    bathy_diff = path_index.compare_slices(bathy, bathy_envy)
+                    case = 'climate' if climate else 'monthly'
+                    result.update({
+                        f'{case}_gather_time':gather_time,
+                        f'{case}_envy_time':envy_time,
+                        f'{case}_ssp_diff':ssp_diff,
+                        f'{case}_bathy_diff':bathy_diff,
+                    })
+                    ok = ok and path_index.passed(ssp_diff, 'ssp') and path_index.passed(bathy_diff, 'bathymetry')
+                result['passed'] = bool(ok)
+        tracer.close()
+        print(node, json.dumps(entry))
+
+    os.makedirs(os.path.dirname(out_fn), exist_ok=True)
+    tmp = f'{out_fn}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(report, f, indent=2)
+    os.replace(tmp, out_fn)
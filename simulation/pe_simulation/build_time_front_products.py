@@ -0,0 +1,31 @@
+# build the time front tiles used by TimeFronts.ipynb, run once after time_fronts.py
+import sys
+import pathlib
+import argparse
+from dotenv import load_dotenv
+
+# make repository modules importable when run as a script
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent.parent))
+from kb2ooi import time_front_products, tracing
+from time_fronts import hydrophones
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build time front tiles')
+    parser.add_argument('--nodes', type=str, nargs='*', default=hydrophones, help='hydrophones with time_fronts.py outputs')
+    parser.add_argument('--time_range', type=float, nargs=2, default=[-5, 10], help='time range relative to the travel time offset [s]')
+    parser.add_argument('--n_levels', type=int, default=4, help='number of pyramid levels')
+    args = parser.parse_args()
+
+    # load .env file
+    current_file_path = pathlib.Path(__file__).resolve()
+    env_path = f'{current_file_path.parent.parent.parent}/.env'
+    load_dotenv(env_path)
+
+    for node in args.nodes:
+        tracer = tracing.Tracer('build_time_front_products', node=node)
+        tracer.stage('time front product')
+        report = time_front_products.build_time_front(node, time_range=tuple(args.time_range), n_levels=args.n_levels)
+        tracer.close()
+        for case, levels in report['cases'].items():
+            print(f'{node} {case}: ' + ', '.join(f'level {lvl["level"]} {lvl["shape"]}' for lvl in levels))
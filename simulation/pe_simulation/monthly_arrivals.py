@@ -9,48 +9,33 @@ import pathlib
 from dotenv import load_dotenv
 import sys
 import argparse  # Add import for argument parsing
+import json
+from geopy.distance import geodesic
 
-if __name__ == '__main__':
-    # Set up argument parser
-    parser = argparse.ArgumentParser(description='Run monthly arrivals simulation')
-    parser.add_argument('--node', type=str, required=True, help='Node name (e.g., AXBA1, AXCC1)')
-    parser.add_argument('--month', type=int, required=True, choices=range(1, 13), help='Month (1-12)')
-    args = parser.parse_args()
-    
-    # Get command line arguments
-    node = args.node
-    month = args.month
-    
-    # load .env file
-    current_file_path = pathlib.Path(__file__).resolve()
-    env_path = f'{current_file_path.parent.parent.parent}/.env'
-    load_dotenv(env_path)
-
-    file_dir = f'{os.environ["data_directory"]}monthly_arrivals/'
-    env_file_dir = f'{file_dir}env_files/'
-
-    # check that file_dir and env_file_dir exist, if not create
-    if not os.path.exists(file_dir):
-        os.makedirs(file_dir)
-    if not os.path.exists(env_file_dir):
-        os.makedirs(env_file_dir)
+# make repository modules importable when run as a script
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent.parent))
+from kb2ooi import paths, pe, pe_tasks, resources, tracing
 
-    # Validate node exists in coords dictionary
-    if node not in coords:
-        print(f"Error: Node '{node}' not found in coordinates dictionary")
-        sys.exit(1)
 
-    print(f'running month {month}...')
+def output_paths(file_dir : str, node : str, month : int):
     fnr_cl = f'{file_dir}climate_Gtz_{node}_{month:02}_real.nc'
     fni_cl = f'{file_dir}climate_Gtz_{node}_{month:02}_imag.nc'
     fnr_iw = f'{file_dir}iw_climate_Gtz_{node}_{month:02}_iw_real.nc'
     fni_iw = f'{file_dir}iw_climate_Gtz_{node}_{month:02}_iw_imag.nc'
+    return fnr_cl, fni_cl, fnr_iw, fni_iw
 
-    # check if simulation has already been run:
-    if os.path.exists(fnr_cl) and os.path.exists(fnr_iw) and os.path.exists(fni_cl) and os.path.exists(fni_iw):
-        print(f'simulation files already exists for {node}, skipping...')
-        sys.exit()
 
+def load_path_data(node : str):
+    '''
+    load_path_data - load the monthly sound speed, bathymetry and iw perturbation once for all months
+
+    Returns
+    -------
+    dict
+        ssp (time, range, depth) on a 2 m depth grid, bathy and dciw
+    '''
+    tracer = tracing.Tracer('monthly_arrivals', node=node, month='all')
+    tracer.stage('environment fetch')
     ssp = envy.get_ssp_slice(
         coords['KB'],
         coords[node],
@@ -60,11 +45,10 @@ if __name__ == '__main__':
     ).load()
 
     # interpolate to 2m depth resolution
+    tracer.stage('interpolation')
     ssp = ssp.interp({'depth':np.hstack((np.arange(0,6000,2), 10000))})
 
-    # choose specific month
-    ssp = ssp.isel({'time':month-1})
-
+    tracer.stage('environment fetch')
     bathy = envy.get_bathymetry_slice(
         coords['KB'],
         coords[node],
@@ -72,125 +56,83 @@ if __name__ == '__main__':
     ).load()
 
     dciw_fn = f'{os.environ['data_directory']}/iws/realizations/dciw_001.nc'
-    dciw = xr.open_dataarray(dciw_fn)
+    dciw = pe.load_dciw(dciw_fn)
+    tracer.close()
+
+    return {'ssp':ssp, 'bathy':bathy, 'dciw':dciw}
+
+
+def write_outputs(gf : xr.DataArray, node : str, month : int, file_dir : str, offsets : dict, case : str):
+    '''
+    write_outputs - write the Green's function of node and of every node sharing its path
+    '''
+    if offsets is None:
+        gfs = {node:gf}
+    else:
+        gfs, _ = pe.extract_receivers(gf, offsets, node)
 
-    # combine climate and iw perturbations
-    ssp_dciw = ssp.interp({'range':dciw.range}) + dciw.interp({'depth':ssp.depth}, kwargs={'bounds_error':False, 'fill_value':'extrapolate'})
+    for member, gf_member in gfs.items():
+        fnr_cl, fni_cl, fnr_iw, fni_iw = output_paths(file_dir, member, month)
+        if case == 'climate':
+            pe.write_gf(gf_member, fnr_cl, fni_cl)
+        else:
+            pe.write_gf(gf_member, fnr_iw, fni_iw)
+
+
+def run_climate(node : str, month : int, data : dict, file_dir : str, ssp_tolerance : float, bathy_tolerance : float, offsets : dict = None):
+    '''
+    run_climate - run the climate PE for a single month and write the output when it finishes
+    '''
+    tracer = tracing.Tracer('monthly_arrivals', node=node, month=month, case='climate')
+
+    # choose specific month
+    tracer.stage('interpolation')
+    ssp = data['ssp'].isel({'time':month-1})
+
+    # only pass climate profile updates and bathymetry breakpoints that matter to RAM
+    tracer.stage('reduction')
+    ssp_reduced, ssp_report = pe.reduce_profiles(ssp, tolerance=ssp_tolerance)
+    bathy_reduced, bathy_report = pe.reduce_bathymetry(data['bathy'], tolerance=bathy_tolerance)
+    print(f'month {month} climate profiles: {ssp_report['n_profiles']} -> {ssp_report['n_reduced']}, max error {ssp_report['max_error']:.3f} m/s')
+    print(f'month {month} bathymetry points: {bathy_report['n_points']} -> {bathy_report['n_reduced']}, max error {bathy_report['max_error']:.2f} m')
+    with open(f'{file_dir}env_files/climate_{node}_{month:02}_reduction.json', 'w') as f:
+        json.dump({'soundspeed':ssp_report, 'bathymetry':bathy_report}, f, indent=2)
 
     # flat earth transform sound speed and bathymetry
-    print('computing flat earth transform...')
-    ssp_dciw_f = envy.flat_earth_c(ssp_dciw, verbose=True)
-    ssp_f = envy.flat_earth_c(ssp, verbose=True)
-    bathy_f = envy.flat_earth_bathy(bathy)
-
-
-    # Bottom properties
-    cb = xr.DataArray(
-        np.ones((1,ssp_dciw_f.sizes['range'])),
-        dims=['depth','range'],
-        coords={
-            'range':ssp_dciw_f.range,
-            'depth':np.array([6000])}
-    )
-
-    rhob = xr.DataArray(
-        np.ones((1,ssp_dciw_f.sizes['range'])),
-        dims=['depth','range'],
-        coords={
-            'range':ssp_dciw_f.range,
-            'depth':np.array([6000])}
-    )
-
-    attn = xr.DataArray(
-        np.ones((1,ssp_dciw_f.sizes['range'])),
-        dims=['depth','range'],
-        coords = {
-            'depth':np.array([6000]),
-            'range':ssp_dciw_f.range
-        }
-    )
-
-    cb.loc[:,:30] = bighorn.bottom_props['med_silt']['soundSpeed']
-    cb.loc[:,30:] = bighorn.bottom_props['clay']['soundSpeed']
-
-    rhob.loc[:,:30] = bighorn.bottom_props['med_silt']['density']
-    rhob.loc[:,30:] = bighorn.bottom_props['clay']['density']
-
-    attn.loc[:,:30] = bighorn.bottom_props['med_silt']['soundAttenuation']
-    attn.loc[:,30:] = bighorn.bottom_props['clay']['soundAttenuation']
-
-    # add axial seamount properties for axial nodes
-    if node in ['AXBA1', 'AXCC1', 'AXEC2', 'PC03A']:
-        cb.loc[:,3555:] = bighorn.bottom_props['rock']['soundSpeed']
-        rhob.loc[:,3555:] = bighorn.bottom_props['rock']['density']
-        attn.loc[:,3555:] = bighorn.bottom_props['rock']['soundAttenuation']
-
-    # add cascadia slope model for continental shelf nodes
-    if node in ['HYS14','LJ01C']:
-        cb.loc[:,3000:] = bighorn.bottom_props['cascadia-slope']['soundSpeed']
-        rhob.loc[:,3000:] = bighorn.bottom_props['cascadia-slope']['density']
-        attn.loc[:,3000:] = bighorn.bottom_props['cascadia-slope']['soundAttenuation']
-        
-    input_params_dciw = {
-        'title':node,
-        'freq':75,
-        'zs':depths['KB']+10,
-        'zr':0,
-        'rmax':bathy_f.range[-1]*1000,
-        'dr':10,
-        'ndr':14,
-        'zmax':6200,
-        'dz':2,
-        'ndz':5,
-        'zmplt':6200,
-        'c0':1500,
-        'np':8,
-        'ns':1,
-        'rs':10000,
-        'bathymetry':bathy_f,
-        'soundspeed':ssp_dciw_f,
-        'cb':cb,
-        'rhob':rhob,
-        'attn':attn,
-    }
-
-    input_params= {
-        'title':node,
-        'freq':75,
-        'zs':depths['KB']+10,
-        'zr':0,
-        'rmax':bathy.range[-1]*1000,
-        'dr':10,
-        'ndr':14,
-        'zmax':6200,
-        'dz':2,
-        'ndz':5,
-        'zmplt':6200,
-        'c0':1500,
-        'np':8,
-        'ns':1,
-        'rs':10000,
-        'bathymetry':bathy_f,
-        'soundspeed':ssp_f,
-        'cb':cb.interp({'range':ssp_f.range}, kwargs = {'bounds_error':False, 'fill_value':'extrapolate'}),
-        'rhob':rhob.interp({'range':ssp_f.range}, kwargs = {'bounds_error':False, 'fill_value':'extrapolate'}),
-        'attn':attn.interp({'range':ssp_f.range}, kwargs = {'bounds_error':False, 'fill_value':'extrapolate'})
-    }
-
-    env = envy.EnvironmentRAM(**input_params)
-    env_dciw = envy.EnvironmentRAM(**input_params_dciw)
+    tracer.stage('flat earth')
+    env = pe.build_environment(node, ssp_reduced, bathy_reduced, cascadia_slope=True, property_range=ssp.range)
 
     # run RAM
-    gf_cl = bighorn.run_ram(env, Fs=300, T0 = 10, bw = (37.5, 112.5), zdec=1, rdec = -1)
+    tracer.stage('ram climate')
+    gf_cl = bighorn.run_ram(env, **pe.run_args)
     # save output
-    gf_cl.real.to_netcdf(fnr_cl)
-    gf_cl.imag.to_netcdf(fni_cl)
+    tracer.stage('write climate')
+    write_outputs(gf_cl, node, month, file_dir, offsets, 'climate')
+    tracer.close()
 
-    gf_iw = bighorn.run_ram(env_dciw, Fs=300, T0 = 10, bw = (37.5, 112.5), zdec=1, rdec = -1)
+
+def run_iw(node : str, month : int, data : dict, file_dir : str, offsets : dict = None):
+    '''
+    run_iw - run the perturbed PE for a single month and write the output when it finishes
+    '''
+    tracer = tracing.Tracer('monthly_arrivals', node=node, month=month, case='iw')
+
+    # choose specific month and combine climate and iw perturbations
+    tracer.stage('interpolation')
+    ssp = data['ssp'].isel({'time':month-1})
+    ssp_dciw = pe.add_perturbation(ssp, data['dciw'])
+
+    # flat earth transform sound speed and bathymetry
+    tracer.stage('flat earth')
+    env_dciw = pe.build_environment(node, ssp_dciw, data['bathy'], cascadia_slope=True)
+
+    tracer.stage('ram iw')
+    gf_iw = bighorn.run_ram(env_dciw, **pe.run_args)
 
     # save output
-    gf_iw.real.to_netcdf(fnr_iw)
-    gf_iw.imag.to_netcdf(fni_iw)
+    tracer.stage('write iw')
+    write_outputs(gf_iw, node, month, file_dir, offsets, 'iw')
+    tracer.close()
 
     # inverse flat-earth transform depth coordinates
     # depths_climate_ife,_ = envy.eflatinv(gf_cl.depth.values, bathy.lat[-1].values)
@@ -200,5 +142,94 @@ if __name__ == '__main__':
     #gf_iw_ife = gf_iw.assign_coords({'depth':depths_iw_ife})
 
 
+if __name__ == '__main__':
+    # Set up argument parser
+    parser = argparse.ArgumentParser(description='Run monthly arrivals simulation')
+    parser.add_argument('--node', type=str, required=True, help='Node name (e.g., AXBA1, AXCC1)')
+    months_group = parser.add_mutually_exclusive_group(required=True)
+    months_group.add_argument('--month', type=int, nargs='+', choices=range(1, 13), help='Month(s) (1-12)')
+    months_group.add_argument('--all-months', action='store_true', help='run all 12 months')
+    parser.add_argument('--shared_nodes', type=str, nargs='*', default=[], help='nodes on (nearly) the same path as node, their Green\'s functions are taken from the run to node')
+    parser.add_argument('--max_parallel', type=int, default=None, help='maximum number of concurrent RAM runs')
+    parser.add_argument('--mem_budget', type=float, default=None, help='memory available to RAM runs [GB], taken from SLURM if not given')
+    parser.add_argument('--ssp_tolerance', type=float, default=0, help='sound speed tolerance for merging climate range profiles [m/s], 0 (default) to pass every profile')
+    parser.add_argument('--bathy_tolerance', type=float, default=0, help='depth tolerance for removing climate bathymetry breakpoints [m], 0 (default) to pass every breakpoint')
+    args = parser.parse_args()
+
+    # Get command line arguments
+    node = args.node
+    months = list(range(1, 13)) if args.all_months else sorted(set(args.month))
 
+    # load .env file
+    current_file_path = pathlib.Path(__file__).resolve()
+    env_path = f'{current_file_path.parent.parent.parent}/.env'
+    load_dotenv(env_path)
 
+    file_dir = f'{os.environ["data_directory"]}monthly_arrivals/'
+    env_file_dir = f'{file_dir}env_files/'
+
+    # check that file_dir and env_file_dir exist, if not create
+    if not os.path.exists(file_dir):
+        os.makedirs(file_dir)
+    if not os.path.exists(env_file_dir):
+        os.makedirs(env_file_dir)
+
+    # Validate node exists in coords dictionary
+    if node not in coords:
+        print(f"Error: Node '{node}' not found in coordinates dictionary")
+        sys.exit(1)
+
+    # only nodes whose shifted Green's function passed validate_shared_path.py share the run
+    for member in args.shared_nodes:
+        if not pe.shift_validated(member, node):
+            print(f'Error: {member} has no passing shared path validation against {node}, run validate_shared_path.py {node} {member}')
+            sys.exit(1)
+
+    # position of the shared nodes along the path to node
+    nodes = [node] + args.shared_nodes
+    offsets = None
+    if args.shared_nodes:
+        offsets = {member: paths.track_offsets(coords['KB'], coords[node], coords[member]) for member in nodes}
+        for member, (along_track, cross_track) in offsets.items():
+            print(f'{member}: {along_track:.1f} km along {node} path, {cross_track:.2f} km cross track')
+        with open(f'{env_file_dir}shared_paths_{node}.json', 'w') as f:
+            json.dump(offsets, f, indent=2)
+
+    def month_done(month, case):
+        # index of the real / imaginary file names of case in output_paths
+        k = 0 if case == 'climate' else 2
+        return all(pe.output_exists(*output_paths(file_dir, member, month)[k:k+2]) for member in nodes)
+
+    # skip months that have already been run before loading any data
+    months = [month for month in months if not (month_done(month, 'climate') and month_done(month, 'iw'))]
+    if len(months) == 0:
+        print(f'simulation files already exists for {node}, skipping...')
+        sys.exit()
+
+    # load path data once for all months
+    data = load_path_data(node)
+
+    # climate and perturbed runs of every month are independent tasks
+    tasks = []
+    for month in months:
+        if not month_done(month, 'climate'):
+            tasks.append({
+                'name':f'{node} {month:02} climate',
+                'func':run_climate,
+                'args':(node, month, data, file_dir, args.ssp_tolerance, args.bathy_tolerance, offsets),
+            })
+        if not month_done(month, 'iw'):
+            tasks.append({
+                'name':f'{node} {month:02} iw',
+                'func':run_iw,
+                'args':(node, month, data, file_dir, offsets),
+            })
+
+    features = resources.task_features(geodesic(coords['KB'], coords[node]).km, **{**resources.mc_params, 'num_range_points':5000})
+    mem_budget = args.mem_budget*1e9 if args.mem_budget is not None else None
+    failed = pe_tasks.run_tasks(tasks, features, mem_budget=mem_budget, max_slots=args.max_parallel)
+
+    if failed:
+        print(f'failed tasks: {failed}')
+        sys.exit(1)
+    print(f'{node} complete.')
@@ -0,0 +1,54 @@
+# find where the paths from KB to the nodes branch and how much marching a restart from the branch field would save
+import os
+import json
+import argparse
+import pathlib
+import sys
+from dotenv import load_dotenv
+
+# make repository modules importable when run as a script
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent.parent))
+from kb2ooi import branching, pe, tracing
+
+nodes = ['AXCC1','AXEC2','AXBA1','HYS14','LJ01C','PC01A','PC03A', 'LJ01A', 'LJ01D']
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Find the branch range of every node and the range a branch restart would save')
+    parser.add_argument('--nodes', type=str, nargs='*', default=nodes, help='nodes to compare')
+    parser.add_argument('--num_range_points', type=int, default=3000, help='number of range points in the sound speed slice')
+    parser.add_argument('--ssp_tolerance', type=float, default=0.5, help='maximum sound speed difference on the shared path [m/s]')
+    parser.add_argument('--bathy_tolerance', type=float, default=10, help='maximum bathymetry difference on the shared path [m]')
+    args = parser.parse_args()
+
+    # load .env file
+    current_file_path = pathlib.Path(__file__).resolve()
+    env_path = f'{current_file_path.parent.parent.parent}/.env'
+    load_dotenv(env_path)
+
+    file_dir = f'{os.environ["data_directory"]}timefront/env_files/'
+    os.makedirs(file_dir, exist_ok=True)
+
+    tracer = tracing.Tracer('plan_branches')
+    tracer.stage('environment fetch')
+    paths = {node: pe.load_path(node, num_range_points=args.num_range_points, climate=True) for node in args.nodes}
+
+    tracer.stage('plan')
+    plan = branching.plan_branches(paths, ssp_tolerance=args.ssp_tolerance, bathy_tolerance=args.bathy_tolerance, cascadia_slope=True)
+    marched = branching.marched_range(paths, plan)
+    tracer.close()
+
+    for node, (trunk, r_branch) in plan.items():
+        print(f'{node}: branches from {trunk} at {r_branch:.1f} km of {float(paths[node][1].range[-1]):.1f} km')
+    print(f'marched range: {marched["full"]:.0f} km for full runs, {marched["branched"]:.0f} km with branch restarts ({marched["ratio"]:.2f})')
+
+    report = {
+        'ssp_tolerance':args.ssp_tolerance,
+        'bathy_tolerance':args.bathy_tolerance,
+        'plan':{node: {'trunk':trunk, 'branch_range':r_branch} for node, (trunk, r_branch) in plan.items()},
+        'marched_range':marched,
+    }
+    fn = f'{file_dir}branch_plan.json'
+    tmp = f'{fn}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(report, f, indent=2)
+    os.replace(tmp, fn)
@@ -7,6 +7,14 @@ import xarray as xr
 import bighorn
 from dotenv import load_dotenv
 import pathlib
+import sys
+import json
+import argparse
+from geopy.distance import geodesic
+
+# make repository modules importable when run as a script
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent.parent))
+from kb2ooi import pe, pe_tasks, resources, shared_env, tracing, travel_times
 
 hydrophones = [
     "AXCC1",
@@ -17,14 +25,132 @@ hydrophones = [
     "HYS14",
 ]
 
+
+def load_node(node : str):
+    '''
+    load_node - fetch climate sound speed, bathymetry and iw perturbation for a node
+    '''
+    tracer = tracing.Tracer('time_fronts', node=node, case='path')
+    tracer.stage('environment fetch')
+    ssp = envy.get_ssp_slice(
+        coords['KB'],
+        coords[node],
+        num_range_points=5000,
+        fillna=True,
+        climate=True,
+    ).load()
+
+    bathy = envy.get_bathymetry_slice(
+        coords['KB'],
+        coords[node],
+        num_range_points=5000,
+    ).load()
+
+    dciw_fn = f'{os.environ['data_directory']}/iws/realizations/dciw_001.nc'
+    dciw = pe.load_dciw(dciw_fn)
+    tracer.close()
+    return ssp, bathy, dciw
+
+
+def run_climate(node : str, ssp : xr.DataArray, bathy : xr.DataArray, file_dir : str, fnr : str, fni : str, ssp_tolerance : float, bathy_tolerance : float, ram_args : dict = None):
+    '''
+    run_climate - reduce, flat earth transform and run RAM for the climate sound speed
+
+    ram_args are passed to bighorn.run_ram, pe.run_args if None
+    '''
+    ram_args = pe.run_args if ram_args is None else ram_args
+    tracer = tracing.Tracer('time_fronts', node=node, case='climate')
+
+    # only pass climate profile updates and bathymetry breakpoints that matter to RAM
+    tracer.stage('reduction')
+    ssp_reduced, ssp_report = pe.reduce_profiles(ssp, tolerance=ssp_tolerance)
+    bathy_reduced, bathy_report = pe.reduce_bathymetry(bathy, tolerance=bathy_tolerance)
+    print(f'{node} climate profiles: {ssp_report['n_profiles']} -> {ssp_report['n_reduced']}, max error {ssp_report['max_error']:.3f} m/s')
+    print(f'{node} bathymetry points: {bathy_report['n_points']} -> {bathy_report['n_reduced']}, max error {bathy_report['max_error']:.2f} m')
+    with open(f"{file_dir}env_files/climate_{node}_reduction.json", 'w') as f:
+        json.dump({'soundspeed':ssp_report, 'bathymetry':bathy_report}, f, indent=2)
+
+    tracer.stage('flat earth')
+    env = pe.build_environment(node, ssp_reduced, bathy_reduced, cascadia_slope=True, property_range=ssp.range)
+
+    # save environment file info for climate (no iw perturbations)
+    with open(f"{file_dir}env_files/climate_{node}_env.txt", 'w') as f:
+        f.write(env.__repr__())
+
+    ## saving output in earth flattened depth coordinates
+    # run RAM for climate profile
+    tracer.stage('ram climate')
+    gf_cl = bighorn.run_ram(env, **ram_args)
+    gf_cl.attrs.update(pe.run_attrs(ram_args, travel_times.travel_time(node)))
+
+    # save output
+    tracer.stage('write climate')
+    pe.write_gf(gf_cl, fnr, fni)
+    tracer.close()
+
+
+def run_iw(node : str, ssp : xr.DataArray, bathy : xr.DataArray, dciw : xr.DataArray, file_dir : str, fnr : str, fni : str, ram_args : dict = None):
+    '''
+    run_iw - add iw perturbation, flat earth transform and run RAM
+
+    ram_args are passed to bighorn.run_ram, pe.run_args if None
+    '''
+    ram_args = pe.run_args if ram_args is None else ram_args
+    tracer = tracing.Tracer('time_fronts', node=node, case='iw')
+
+    # combine climate and iw perturbations
+    tracer.stage('interpolation')
+    ssp_dciw = pe.add_perturbation(ssp, dciw)
+
+    # flat earth transform sound speed and bathymetry, using the CPUs of this task.
+    # workers attach to the slice in shared memory instead of receiving a copy
+    tracer.stage('flat earth')
+    ssp_dciw_f, report = shared_env.flat_earth_c(ssp_dciw, n_cpus=len(pe_tasks.available_cpus()), chunk_size=360)
+    with open(f"{file_dir}env_files/iw_climate_{node}_flat_earth.json", 'w') as f:
+        json.dump(report, f, indent=2)
+    env_dciw = pe.build_environment(node, ssp_dciw_f, bathy, cascadia_slope=True, flat_earth=False)
+
+    # save environment file info for iw perturbations
+    with open(f"{file_dir}env_files/iw_climate_{node}_env.txt", 'w') as f:
+        f.write(env_dciw.__repr__())
+
+    # run RAM for iw profile
+    tracer.stage('ram iw')
+    gf_iw = bighorn.run_ram(env_dciw, **ram_args)
+    gf_iw.attrs.update(pe.run_attrs(ram_args, travel_times.travel_time(node)))
+
+    # save output
+    tracer.stage('write iw')
+    pe.write_gf(gf_iw, fnr, fni)
+    tracer.close()
+
+    # inverse flat-earth transform depth coordinates
+    #depths_climate_ife,_ = envy.eflatinv(gf_cl.depth.values, bathy.lat[-1].values)
+    #depths_iw_ife,_ = envy.eflatinv(gf_iw.depth.values, bathy.lat[-1].values)
+    #gf_cl_ife = gf_cl.assign_coords({'depth':depths_climate_ife})
+    #gf_iw_ife = gf_iw.assign_coords({'depth':depths_iw_ife})
+
+
 # check __main__
 if __name__ == '__main__':
-    
+    parser = argparse.ArgumentParser(description='Run time front simulations')
+    parser.add_argument('--nodes', type=str, nargs='*', default=hydrophones, help='hydrophones to simulate')
+    parser.add_argument('--ssp_tolerance', type=float, default=0, help='sound speed tolerance for merging climate range profiles [m/s], 0 (default) to pass every profile')
+    parser.add_argument('--bathy_tolerance', type=float, default=0, help='depth tolerance for removing climate bathymetry breakpoints [m], 0 (default) to pass every breakpoint')
+    parser.add_argument('--mem_budget', type=float, default=None, help='memory available to RAM runs [GB], taken from SLURM if not given')
+    parser.add_argument('--max_parallel', type=int, default=None, help='maximum number of concurrent RAM runs')
+    parser.add_argument('--window', type=float, default=None, help='only solve the frequencies needed for an arrival window of this length [s] around the predicted travel time')
+    args = parser.parse_args()
+
+    ram_args = pe.run_args if args.window is None else pe.window_run_args(args.window)
+    if args.window is not None:
+        print(f'arrival window {args.window} s: T0 = {ram_args["T0"]} s')
+
     # load .env file
     current_file_path = pathlib.Path(__file__).resolve()
     env_path = f'{current_file_path.parent.parent.parent}/.env'
     load_dotenv(env_path)
-    
+
     # check that directory exists
     file_dir = f'{os.environ['data_directory']}/timefront/'
     if not os.path.exists(file_dir):
@@ -33,171 +159,50 @@ if __name__ == '__main__':
     # check that env_files directory exists
     if not os.path.exists(f'{file_dir}env_files/'):
         os.makedirs(f'{file_dir}env_files/')
-    
-    for node in hydrophones:
-        print(f'running PE for {node}...')
 
+    # climate and perturbed runs of every node are independent tasks
+    tasks = []
+    path_lengths = []
+    for node in args.nodes:
         fnr_iw = f'{file_dir}climate_{node}_Gfz_real.nc'
         fni_iw = f'{file_dir}climate_{node}_Gfz_imag.nc'
-        
+
         fnr_cl = f'{file_dir}iw_climate_{node}_Gfz_real.nc'
         fni_cl = f'{file_dir}iw_climate_{node}_Gfz_imag.nc'
 
         # check if simulation has already been run:
-        if os.path.exists(fnr_iw) and os.path.exists(fnr_iw) and os.path.exists(fni_cl) and os.path.exists(fni_cl):
+        run_cl = not pe.output_exists(fnr_cl, fni_cl)
+        run_pert = not pe.output_exists(fnr_iw, fni_iw)
+        if not (run_cl or run_pert):
             print(f'simulation files already exists for {node}, skipping...')
             continue
-        
-        ssp = envy.get_ssp_slice(
-            coords['KB'],
-            coords[node],
-            num_range_points=5000,
-            fillna=True,
-            climate=True,
-        ).load()
-
-        bathy = envy.get_bathymetry_slice(
-            coords['KB'],
-            coords[node],
-            num_range_points=5000,
-        ).load()
-
-        dciw_fn = f'{os.environ['data_directory']}/iws/realizations/dciw_001.nc'
-        dciw = xr.open_dataarray(dciw_fn)
-
-        # combine climate and iw perturbations
-        ssp_dciw = ssp.interp({'range':dciw.range}) + dciw.interp({'depth':ssp.depth}, kwargs={'bounds_error':False, 'fill_value':'extrapolate'})
-
-        # flat earth transform sound speed and bathymetry
-        print('computing flat earth transform...')
-        ssp_dciw_f = envy.flat_earth_c(ssp_dciw, verbose=True, n_cpus=90, chunk_size = 360)
-        ssp_f = envy.flat_earth_c(ssp, verbose=True)
-        bathy_f = envy.flat_earth_bathy(bathy)
-
-        # Bottom properties
-        cb = xr.DataArray(
-            np.ones((1,ssp_dciw_f.sizes['range'])),
-            dims=['depth','range'],
-            coords={
-                'range':ssp_dciw.range,
-                'depth':np.array([6000])}
-        )
-
-        rhob = xr.DataArray(
-            np.ones((1,ssp_dciw_f.sizes['range'])),
-            dims=['depth','range'],
-            coords={
-                'range':ssp_dciw.range,
-                'depth':np.array([6000])}
-        )
-
-        attn = xr.DataArray(
-            np.ones((1,ssp_dciw_f.sizes['range'])),
-            dims=['depth','range'],
-            coords = {
-                'depth':np.array([6000]),
-                'range':ssp_dciw_f.range
-            }
-        )
-        # use clay for ocean basin, med_silt near KB and rock for Axial Seamount
-        cb.loc[:,:30] = bighorn.bottom_props['med_silt']['soundSpeed']
-        cb.loc[:,30:] = bighorn.bottom_props['clay']['soundSpeed']
-        if node in ['AXBA1', 'AXCC1', 'AXEC2', 'PC03A']:
-            cb.loc[:,3555:] = bighorn.bottom_props['rock']['soundSpeed']
-
-        rhob.loc[:,:30] = bighorn.bottom_props['med_silt']['density']
-        rhob.loc[:,30:] = bighorn.bottom_props['clay']['density']
-        if node in ['AXBA1', 'AXCC1', 'AXEC2', 'PC03A']:
-            rhob.loc[:,3555:] = bighorn.bottom_props['rock']['density']
-
-        attn.loc[:,:30] = bighorn.bottom_props['med_silt']['soundAttenuation']
-        attn.loc[:,30:] = bighorn.bottom_props['clay']['soundAttenuation']
-        if node in ['AXBA1', 'AXCC1', 'AXEC2', 'PC03A']:
-            attn.loc[:,3555:] = bighorn.bottom_props['rock']['soundAttenuation']
-
-        # add cascadia slope model for continental slope nodes
-        if node in ['HYS14','LJ01C']:
-            cb.loc[:,3000:] = bighorn.bottom_props['cascadia-slope']['soundSpeed']
-            rhob.loc[:,3000:] = bighorn.bottom_props['cascadia-slope']['density']
-            attn.loc[:,3000:] = bighorn.bottom_props['cascadia-slope']['soundAttenuation']
-
-        input_params_dciw = {
-            'title':node,
-            'freq':75,
-            'zs':depths['KB']+10,
-            'zr':0,
-            'rmax':bathy.range[-1]*1000,
-            'dr':10,
-            'ndr':14,
-            'zmax':6200,
-            'dz':2,
-            'ndz':5,
-            'zmplt':6200,
-            'c0':1500,
-            'np':8,
-            'ns':1,
-            'rs':10000,
-            'bathymetry':bathy_f,
-            'soundspeed':ssp_dciw_f,
-            'cb':cb,
-            'rhob':rhob,
-            'attn':attn,
-        }
-
-        input_params= {
-            'title':node,
-            'freq':75,
-            'zs':depths['KB']+10,
-            'zr':0,
-            'rmax':bathy.range[-1]*1000,
-            'dr':10,
-            'ndr':14,
-            'zmax':6200,
-            'dz':2,
-            'ndz':5,
-            'zmplt':6200,
-            'c0':1500,
-            'np':8,
-            'ns':1,
-            'rs':10000,
-            'bathymetry':bathy_f,
-            'soundspeed':ssp_f,
-            'cb':cb.interp({'range':ssp_f.range}, kwargs = {'bounds_error':False, 'fill_value':'extrapolate'}),
-            'rhob':rhob.interp({'range':ssp_f.range}, kwargs = {'bounds_error':False, 'fill_value':'extrapolate'}),
-            'attn':attn.interp({'range':ssp_f.range}, kwargs = {'bounds_error':False, 'fill_value':'extrapolate'})
-        }
-
-        env = envy.EnvironmentRAM(**input_params)
-        env_dciw = envy.EnvironmentRAM(**input_params_dciw)
-
-        # save environment file info for climate (no iw perturbations)
-        with open(f"{file_dir}env_files/climate_{node}_env.txt", 'w') as f:
-            f.write(env.__repr__())
-        # save environment file info for iw perturbations
-        with open(f"{file_dir}env_files/iw_climate_{node}_env.txt", 'w') as f:
-            f.write(env_dciw.__repr__())
-        
-        ## saving output in earth flattened depth coordinates
-        # run RAM for climate profile
-        gf_cl = bighorn.run_ram(env, Fs=300, T0 = 10, bw = (37.5, 112.5), zdec=1, rdec = -1)
-
-        # save output
-        gf_cl.real.to_netcdf(fnr_cl)
-        gf_cl.imag.to_netcdf(fni_cl)
-
-        # run RAM for iw profile
-        gf_iw = bighorn.run_ram(env_dciw, Fs=300, T0 = 10, bw = (37.5, 112.5), zdec=1, rdec = -1)
-
-        # save output
-        gf_iw.real.to_netcdf(fnr_iw)
-        gf_iw.imag.to_netcdf(fni_iw)
-
-        # inverse flat-earth transform depth coordinates
-        #depths_climate_ife,_ = envy.eflatinv(gf_cl.depth.values, bathy.lat[-1].values)
-        #depths_iw_ife,_ = envy.eflatinv(gf_iw.depth.values, bathy.lat[-1].values)
-        #gf_cl_ife = gf_cl.assign_coords({'depth':depths_climate_ife})
-        #gf_iw_ife = gf_iw.assign_coords({'depth':depths_iw_ife})
-
-
-
-        print(f'{node} complete.')
\ No newline at end of file
+
+        print(f'loading path for {node}...')
+        ssp, bathy, dciw = load_node(node)
+        path_lengths.append(geodesic(coords['KB'], coords[node]).km)
+
+        if run_cl:
+            tasks.append({
+                'name':f'{node} climate',
+                'func':run_climate,
+                'args':(node, ssp, bathy, file_dir, fnr_cl, fni_cl, args.ssp_tolerance, args.bathy_tolerance, ram_args),
+            })
+        if run_pert:
+            tasks.append({
+                'name':f'{node} iw',
+                'func':run_iw,
+                'args':(node, ssp, bathy, dciw, file_dir, fnr_iw, fni_iw, ram_args),
+            })
+
+    if len(tasks) == 0:
+        sys.exit()
+
+    # memory is predicted for the longest path
+    features = resources.task_features(max(path_lengths), **{**resources.mc_params, 'num_range_points':5000, 'T0':ram_args['T0']})
+    mem_budget = args.mem_budget*1e9 if args.mem_budget is not None else None
+    failed = pe_tasks.run_tasks(tasks, features, mem_budget=mem_budget, max_slots=args.max_parallel)
+
+    if failed:
+        print(f'failed tasks: {failed}')
+        sys.exit(1)
+    print('time fronts complete.')
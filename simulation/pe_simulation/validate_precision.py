@@ -0,0 +1,60 @@
+# compare the arrivals of a float32 / complex64 run with a float64 reference run
+import os
+import json
+import argparse
+import pathlib
+import sys
+import bighorn
+from kaooi.coordinates import depths
+from dotenv import load_dotenv
+
+# make repository modules importable when run as a script
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent.parent))
+from kb2ooi import pe, precision, tracing, travel_times
+
+
+def run(node : str, name : str, dciw_fn : str, num_range_points : int):
+    '''
+    run - load the path, build the environment and run RAM with every array in precision name
+    '''
+    with precision.using(name):
+        ssp, bathy = pe.load_path(node, num_range_points=num_range_points, climate=True)
+        if dciw_fn is not None:
+            ssp = pe.add_perturbation(ssp, pe.load_dciw(dciw_fn))
+        env = pe.build_environment(node, ssp, bathy, cascadia_slope=True)
+        # the output is stored in the same precision as pe.write_gf would write it
+        return precision.as_complex(bighorn.run_ram(env, **pe.run_args))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Validate float32 environments and outputs against float64')
+    parser.add_argument('node', type=str, nargs='?', default='LJ01C', help='reference node (e.g. LJ01C)')
+    parser.add_argument('--window', type=float, default=5, help='arrival window around the predicted travel time [s]')
+    parser.add_argument('--dciw', type=int, default=1, help='realization of iws/realizations/ added to the climate, none if negative')
+    parser.add_argument('--num_range_points', type=int, default=3000, help='number of range points in the sound speed slice')
+    args = parser.parse_args()
+
+    # load .env file
+    current_file_path = pathlib.Path(__file__).resolve()
+    env_path = f'{current_file_path.parent.parent.parent}/.env'
+    load_dotenv(env_path)
+
+    file_dir = f'{os.environ["data_directory"]}timefront/env_files/'
+    os.makedirs(file_dir, exist_ok=True)
+    dciw_fn = f'{os.environ["data_directory"]}iws/realizations/dciw_{args.dciw:03}.nc' if args.dciw >= 0 else None
+
+    tracer = tracing.Tracer('validate_precision', node=args.node)
+    tracer.stage('float64')
+    gf_ref = run(args.node, 'float64', dciw_fn, args.num_range_points)
+    tracer.stage('float32')
+    gf_test = run(args.node, 'float32', dciw_fn, args.num_range_points)
+
+    tracer.stage('validation')
+    travel_time = travel_times.travel_time(args.node)
+    report = pe.validate_precision(gf_ref, gf_test, depths[args.node], travel_time, args.window)
+    report.update({'node':args.node, 'window':args.window, 'travel_time':travel_time, 'dciw':dciw_fn, 'bytes_ref':int(gf_ref.nbytes), 'bytes_test':int(gf_test.nbytes)})
+    tracer.close()
+
+    print(json.dumps(report, indent=2))
+    with open(f'{file_dir}precision_validation_{args.node}.json', 'w') as f:
+        json.dump(report, f, indent=2)
@@ -0,0 +1,62 @@
+# compare the Green's function of a node approximated from the run to another node on the same path with its own run
+import os
+import sys
+import json
+import argparse
+import pathlib
+import bighorn
+from kaooi.coordinates import coords, depths
+from dotenv import load_dotenv
+
+# make repository modules importable when run as a script
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent.parent))
+from kb2ooi import paths, pe, tracing
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Validate a shared path Green\'s function against a run to the node')
+    parser.add_argument('reference', type=str, help='node at the end of the shared path (e.g. LJ01A)')
+    parser.add_argument('node', type=str, help='node approximated from the reference run (e.g. PC01A)')
+    parser.add_argument('--num_range_points', type=int, default=3000, help='number of range points in the sound speed slice')
+    parser.add_argument('--min_correlation', type=float, default=pe.shift_tolerances['min_correlation'], help='smallest zero lag correlation of the arrival envelopes')
+    parser.add_argument('--max_energy_error', type=float, default=pe.shift_tolerances['max_energy_error'], help='largest relative error of the arrival envelope energy')
+    args = parser.parse_args()
+
+    # load .env file
+    current_file_path = pathlib.Path(__file__).resolve()
+    env_path = f'{current_file_path.parent.parent.parent}/.env'
+    load_dotenv(env_path)
+
+    fn = pe.validation_path(args.node)
+    os.makedirs(os.path.dirname(fn), exist_ok=True)
+
+    tracer = tracing.Tracer('validate_shared_path', node=args.node, reference=args.reference)
+    gfs = {}
+    for node in [args.reference, args.node]:
+        tracer.stage(f'ram {node}')
+        ssp, bathy = pe.load_path(node, num_range_points=args.num_range_points, climate=True)
+        env = pe.build_environment(node, ssp, bathy, cascadia_slope=True)
+        gfs[node] = bighorn.run_ram(env, **pe.run_args)
+
+    tracer.stage('validation')
+    offsets = {node: paths.track_offsets(coords['KB'], coords[args.reference], coords[node]) for node in [args.reference, args.node]}
+    _, shift_report = pe.extract_receivers(gfs[args.reference], offsets, args.reference)
+    tolerances = {'min_correlation':args.min_correlation, 'max_energy_error':args.max_energy_error}
+    validation = pe.validate_shift(gfs[args.node], gfs[args.reference], shift_report[args.node]['range_offset'], depths[args.node], tolerances=tolerances)
+    tracer.close()
+
+    report = {
+        'reference':args.reference,
+        'node':args.node,
+        **shift_report[args.node],
+        **validation,
+    }
+    print(json.dumps(report, indent=2))
+    tmp = f'{fn}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(report, f, indent=2)
+    os.replace(tmp, fn)
+
+    if not report['passed']:
+        print(f'{args.node} can not share the {args.reference} run: sign_ok {report["sign_ok"]}, correlation {report["correlation"]:.3f}, energy error {report["energy_error"]:.3f}')
+        sys.exit(1)
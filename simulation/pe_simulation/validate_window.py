@@ -0,0 +1,52 @@
+# compare a time window driven frequency grid with the full grid reconstruction
+import os
+import json
+import argparse
+import pathlib
+import sys
+import bighorn
+from dotenv import load_dotenv
+
+# make repository modules importable when run as a script
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent.parent))
+from kb2ooi import pe, tracing, travel_times
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Validate windowed frequency sampling against the full frequency grid')
+    parser.add_argument('node', type=str, help='Node identifier (e.g. AXCC1)')
+    parser.add_argument('--window', type=float, default=5, help='arrival window around the predicted travel time [s]')
+    parser.add_argument('--guard', type=float, default=0.2, help='fraction of the window added to T0')
+    parser.add_argument('--num_range_points', type=int, default=3000, help='number of range points in the sound speed slice')
+    args = parser.parse_args()
+
+    # load .env file
+    current_file_path = pathlib.Path(__file__).resolve()
+    env_path = f'{current_file_path.parent.parent.parent}/.env'
+    load_dotenv(env_path)
+
+    file_dir = f'{os.environ["data_directory"]}timefront/env_files/'
+    os.makedirs(file_dir, exist_ok=True)
+
+    tracer = tracing.Tracer('validate_window', node=args.node, window=args.window)
+    tracer.stage('environment fetch')
+    ssp, bathy = pe.load_path(args.node, num_range_points=args.num_range_points, climate=True)
+
+    tracer.stage('flat earth')
+    env = pe.build_environment(args.node, ssp, bathy, cascadia_slope=True)
+
+    window_args = pe.window_run_args(args.window, guard=args.guard)
+    tracer.stage('ram full')
+    gf_full = bighorn.run_ram(env, **pe.run_args)
+    tracer.stage('ram window')
+    gf_window = bighorn.run_ram(env, **window_args)
+
+    tracer.stage('validation')
+    travel_time = travel_times.travel_time(args.node)
+    report = pe.validate_window(gf_full, gf_window, travel_time, args.window, pe.run_args, window_args)
+    report.update({'node':args.node, 'window':args.window, 'travel_time':travel_time, 'T0':window_args['T0']})
+    tracer.close()
+
+    print(json.dumps(report, indent=2))
+    with open(f'{file_dir}window_validation_{args.node}.json', 'w') as f:
+        json.dump(report, f, indent=2)